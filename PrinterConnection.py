@@ -1,8 +1,19 @@
+import select
 import socket
 import time
+from collections import deque
+
+from metrics import timer, timed
+from printer_status import PrinterStatus, PrinterNotReady, HOST_STATUS_COMMAND, ETX
 
 class PrinterConnection:
-    def __init__(self, ip_address=None, port=9100, timeout=5):
+    # Numero massimo di formati lasciati in attesa nel buffer della stampante
+    # prima di inviare altre etichette
+    MAX_BUFFERED_FORMATS = 10
+    STATUS_TIMEOUT = 1
+    STATUS_POLL_INTERVAL = 0.2
+
+    def __init__(self, ip_address=None, port=9100, timeout=5, template=None):
         self.ip_address = ip_address
         self.port = port
         self.timeout = timeout
@@ -10,7 +21,17 @@ class PrinterConnection:
         self.connected = False
         self.last_print_time = 0
         self.reconnect_delay = 2
+        self.status_supported = True
+        # Layout salvato sulla stampante (zpl_templates.LabelTemplate); se None
+        # ogni etichetta viene inviata con il layout ZPL completo
+        self.template = template
+        self._template_loaded = False
+        # PrinterStatusMonitor sulla connessione di stato dedicata; se None
+        # lo stato viene chiesto con ~HS sulla connessione di stampa
+        self.status_monitor = None
+        self._sent_blocks = deque()  # (istante, etichette) degli ultimi blocchi inviati
 
+    @timed('printer.connect')
     def connect(self):
         """Stabilisce la connessione con la stampante"""
         try:
@@ -18,9 +39,13 @@ class PrinterConnection:
                 self.disconnect()
 
             self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            # ~HS e le etichette singole partono senza attendere l'ACK del segmento precedente
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
             self._socket.settimeout(self.timeout)
             self._socket.connect((self.ip_address, self.port))
             self.connected = True
+            self._template_loaded = False
             print(f"Connessione stabilita con {self.ip_address}:{self.port}")
             return True
         except Exception as e:
@@ -39,15 +64,12 @@ class PrinterConnection:
         finally:
             self._socket = None
             self.connected = False
+            self._template_loaded = False
 
-    def print_label(self, item_code, quantity, batch_number):
-        """Stampa un'etichetta con i dati forniti"""
-        try:
-            if not self.connected:
-                if not self.connect():
-                    return False
-
-            zpl_command = f"""
+    @staticmethod
+    def build_label_zpl(item_code, quantity, batch_number):
+        """Restituisce il blocco ZPL ^XA...^XZ di un'etichetta"""
+        return f"""
 ^XA
 ^FO50,50^A0N,45,45^FDProdotto: {item_code}^FS
 ^FO50,120^A0N,35,35^FDCodice: {item_code}^FS
@@ -61,25 +83,185 @@ class PrinterConnection:
 ^BCN,80,Y,N,N,A^FD{batch_number}^FS
 ^XZ
 """
-            self._socket.send(zpl_command.encode())
-            time.sleep(0.5)
-            self.last_print_time = time.time()
-            print(f"Stampa completata: {batch_number}")
-            return True
 
+    def _label_zpl(self, label):
+        """ZPL di un'etichetta: richiamo del layout salvato o layout completo"""
+        if self.template is not None:
+            return self.template.recall(label['item_code'], label['quantity'], label['batch_number'])
+        return self.build_label_zpl(label['item_code'], label['quantity'], label['batch_number'])
+
+    def _ensure_template(self):
+        """Invia il layout alla stampante una volta per connessione"""
+        if self.template is not None and not self._template_loaded:
+            self._socket.sendall(self.template.definition().encode())
+            self._template_loaded = True
+            print(f"Layout {self.template.path} caricato sulla stampante")
+
+    @timed('printer.print_label')
+    def print_label(self, item_code, quantity, batch_number):
+        """Stampa un'etichetta con i dati forniti"""
+        printed = self.print_labels([{
+            'item_code': item_code,
+            'quantity': quantity,
+            'batch_number': batch_number
+        }])
+        return printed == 1
+
+    def print_labels(self, labels, on_label_sent=None, on_label_uncertain=None):
+        """Invia più etichette sulla stessa connessione come un unico flusso ZPL.
+
+        Le etichette vengono spedite a blocchi con un solo sendall per
+        blocco; prima di ogni blocco si attende che il buffer della
+        stampante abbia spazio. on_label_sent(indice) viene chiamata per
+        ogni etichetta accettata. Se l'invio di un blocco si interrompe, una
+        parte può essere già arrivata alla stampante: on_label_uncertain(indice)
+        viene chiamata per ogni etichetta del blocco, che non va ristampata
+        in automatico. Restituisce il numero di etichette inviate: il
+        chiamante può riprendere dall'indice successivo alle etichette
+        incerte.
+        """
+        sent = 0
+        in_flight = 0
+        try:
+            if not self.connected:
+                if not self.connect():
+                    return 0
+
+            self._ensure_template()
+            while sent < len(labels):
+                free_slots = self._wait_for_buffer_space()
+                block = labels[sent:sent + free_slots]
+                stream = "".join(self._label_zpl(label) for label in block)
+                in_flight = len(block)
+                with timer('printer.send_block', labels=len(block)):
+                    self._socket.sendall(stream.encode())
+                in_flight = 0
+                self.last_print_time = time.time()
+                self._sent_blocks.append((self.last_print_time, len(block)))
+
+                for label in block:
+                    print(f"Stampa completata: {label['batch_number']}")
+                    if on_label_sent:
+                        on_label_sent(sent)
+                    sent += 1
+
+            return sent
+
+        except PrinterNotReady as e:
+            # La connessione resta valida: la stampa riprende quando l'operatore risolve il problema
+            print(str(e))
+            return sent
         except Exception as e:
             print(f"Errore durante la stampa: {str(e)}")
             self.disconnect()
-            return False
+            if in_flight:
+                print(f"Invio interrotto: {in_flight} etichette forse già stampate, da verificare")
+                if on_label_uncertain:
+                    for index in range(sent, sent + in_flight):
+                        on_label_uncertain(index)
+            return sent
+
+    @timed('printer.query_status')
+    def query_status(self):
+        """Interroga la stampante con ~HS; restituisce None se non supportato"""
+        if not self.connected or not self.status_supported:
+            return None
+
+        try:
+            self._socket.settimeout(self.STATUS_TIMEOUT)
+            self._socket.sendall(HOST_STATUS_COMMAND)
+            response = b''
+            while response.count(ETX) < 3:
+                chunk = self._socket.recv(1024)
+                if not chunk:
+                    break
+                response += chunk
+            return PrinterStatus.parse(response)
+        except (socket.timeout, ValueError):
+            # La stampante (o l'emulatore) non risponde a ~HS: si usa solo
+            # il controllo di flusso TCP
+            print("Stato stampante non disponibile, pacing tramite TCP")
+            self.status_supported = False
+            return None
+        finally:
+            if self._socket:
+                self._socket.settimeout(self.timeout)
+
+    def _wait_for_buffer_space(self):
+        """Attende che il buffer della stampante possa accettare altri formati.
+
+        Restituisce quante etichette possono essere inviate subito.
+        """
+        if self.status_monitor is not None and self.status_monitor.supported:
+            return self._wait_for_monitor_space(self.status_monitor)
+
+        deadline = time.time() + self.timeout * 6
+        while True:
+            status = self.query_status()
+            if status is None:
+                return self.MAX_BUFFERED_FORMATS
+
+            free_slots = self.MAX_BUFFERED_FORMATS - status.formats_in_buffer
+            if not status.buffer_full and free_slots > 0:
+                return free_slots
+
+            if time.time() > deadline:
+                raise Exception(f"Buffer della stampante pieno: {status}")
+            time.sleep(self.STATUS_POLL_INTERVAL)
+
+    def _sent_since(self, instant):
+        """Etichette inviate dopo instant, che la stampante non aveva ancora nel buffer"""
+        while self._sent_blocks and self._sent_blocks[0][0] < instant - 60:
+            self._sent_blocks.popleft()
+        return sum(count for sent_at, count in self._sent_blocks if sent_at > instant)
+
+    def _wait_for_monitor_space(self, monitor):
+        """Come _wait_for_buffer_space, con lo stato letto dal monitor sulla connessione dedicata.
+
+        Le etichette inviate dopo l'ultima lettura vengono contate come già
+        nel buffer, così non serve attendere un nuovo stato prima di ogni
+        blocco. Con un problema segnalato dalla stampante (carta, testina,
+        pausa) solleva PrinterNotReady invece di attendere.
+        """
+        deadline = time.time() + self.timeout * 6
+        status = monitor.status
+        if status is None:
+            monitor.poll_now()
+            status = monitor.wait_for_update(0, self.STATUS_TIMEOUT)
+        while True:
+            if status is None or monitor.error is not None:
+                # Stato non ancora disponibile: solo il controllo di flusso TCP
+                return self.MAX_BUFFERED_FORMATS
+            if status.fault:
+                raise PrinterNotReady(status)
+
+            free_slots = self.MAX_BUFFERED_FORMATS - status.formats_in_buffer - self._sent_since(monitor.updated_at)
+            if not status.buffer_full and free_slots > 0:
+                return free_slots
+
+            if time.time() > deadline:
+                raise Exception(f"Buffer della stampante pieno: {status}")
+            # Nuova lettura al più ogni STATUS_POLL_INTERVAL, come il polling sulla connessione di stampa
+            last_update = monitor.updated_at
+            time.sleep(max(0.0, last_update + self.STATUS_POLL_INTERVAL - time.time()))
+            monitor.poll_now()
+            status = monitor.wait_for_update(last_update, self.STATUS_TIMEOUT) or monitor.status
 
     def is_connected(self):
-        """Verifica se la stampante è connessa"""
+        """Verifica se la stampante è connessa.
+
+        Non scrive nulla sulla connessione di stampa: controlla solo lo stato
+        locale del socket. Se la stampante ha chiuso la connessione il socket
+        risulta leggibile senza dati (o con un errore) e la connessione viene
+        chiusa.
+        """
         if not self._socket or not self.connected:
             return False
         try:
-            self._socket.settimeout(1)
-            self._socket.send(b'\x00')
+            readable, _, _ = select.select([self._socket], [], [], 0)
+            if readable and not self._socket.recv(1, socket.MSG_PEEK):
+                raise ConnectionResetError("connessione chiusa dalla stampante")
             return True
-        except:
-            self.connected = False
-            return False
\ No newline at end of file
+        except (OSError, ValueError):
+            self.disconnect()
+            return False
@@ -5,7 +5,7 @@ a = Analysis(
     ['split_manager.py'],
     pathex=[],
     binaries=[],
-    datas=[],
+    datas=[('label_templates', 'label_templates')],
     hiddenimports=['cryptography', 'cffi', '_cffi_backend'],
     hookspath=[],
     hooksconfig={},
@@ -0,0 +1,130 @@
+# async_printer.py
+import asyncio
+import threading
+
+from printer_status import PrinterStatus, HOST_STATUS_COMMAND, ETX
+
+
+class AsyncPrinterConnection:
+    """Connessione asyncio verso una stampante Zebra (porta raw 9100) per la lettura dello stato.
+
+    Serve solo a interrogare molte stampanti in parallelo senza bloccare il
+    thread chiamante: la stampa delle etichette passa da PrinterConnection.
+    """
+
+    def __init__(self, ip_address, port=9100, timeout=5):
+        self.ip_address = ip_address
+        self.port = port
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        # Serializza richieste e risposte ~HS sulla stessa connessione
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self):
+        return self._writer is not None and not self._writer.is_closing()
+
+    async def connect(self):
+        await self.close()
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.ip_address, self.port), self.timeout)
+        return True
+
+    async def close(self):
+        writer, self._reader, self._writer = self._writer, None, None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ConnectionError):
+                pass
+
+    async def probe(self, status_timeout=1):
+        """Interroga la stampante con ~HS e restituisce lo stato interpretato"""
+        async with self._lock:
+            if not self.connected:
+                await self.connect()
+            self._writer.write(HOST_STATUS_COMMAND)
+            await asyncio.wait_for(self._writer.drain(), self.timeout)
+            response = b''
+            while response.count(ETX) < 3:
+                chunk = await asyncio.wait_for(self._reader.read(1024), status_timeout)
+                if not chunk:
+                    raise ConnectionError("Connessione chiusa dalla stampante")
+                response += chunk
+            return PrinterStatus.parse(response)
+
+
+async def probe_address(ip_address, port=9100, timeout=5):
+    """Connette e interroga una stampante; restituisce (stato o None, errore o None)"""
+    printer = AsyncPrinterConnection(ip_address, port, timeout)
+    try:
+        await printer.connect()
+        try:
+            return await printer.probe(), None
+        except (asyncio.TimeoutError, ValueError):
+            # Raggiungibile ma non risponde a ~HS
+            return None, None
+    except Exception as e:
+        return None, str(e) or e.__class__.__name__
+    finally:
+        await printer.close()
+
+
+async def probe_printers(entries, timeout=5):
+    """Interroga in parallelo le stampanti (dizionari con ip_address e port).
+
+    Restituisce una lista di (entry, stato o None, errore o None) nello
+    stesso ordine di entries.
+    """
+    results = await asyncio.gather(*(
+        probe_address(entry['ip_address'], int(entry.get('port', 9100)), timeout)
+        for entry in entries
+    ))
+    return [(entry, status, error) for entry, (status, error) in zip(entries, results)]
+
+
+class AsyncLoopRunner:
+    """Event loop asyncio su un thread dedicato, utilizzabile dall'app Tk.
+
+    submit() accoda una coroutine e restituisce un concurrent.futures.Future;
+    se viene passata call_soon (ad esempio TaskExecutor.call_soon) le
+    callback vengono eseguite sul thread dell'interfaccia.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, name="AsyncLoopRunner", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro, on_done=None, on_error=None, call_soon=None):
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+        def done(f):
+            try:
+                result = f.result()
+            except Exception as e:
+                callback, args = on_error, (e,)
+            else:
+                callback, args = on_done, (result,)
+            if callback is None:
+                return
+            if call_soon is not None:
+                call_soon(callback, *args)
+            else:
+                callback(*args)
+
+        future.add_done_callback(done)
+        return future
+
+    def run(self, coro, timeout=None):
+        """Esegue la coroutine e ne attende il risultato dal thread chiamante"""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
@@ -0,0 +1,113 @@
+# batch_index.py
+import threading
+import time
+from collections import OrderedDict
+
+from batch_record import BatchColumns, BatchRecord
+from query_registry import queries
+from metrics import timer
+
+BATCH_SEARCH_SELECT = """
+    SELECT
+        i.incomingid,
+        id.incomingdetid,
+        i.number,
+        it.itemid,
+        it.Code,
+        p.BatchNumber_HU,
+        p.Qty AS PackQty,
+        id.Qty AS IncomingQty,
+        l.locationid,
+        l.Code AS LocationCode,
+        p.PackingId
+    FROM dbo.incoming i
+    INNER JOIN dbo.incomingdet id ON i.IncomingId = id.incomingid
+    INNER JOIN dbo.item it ON it.itemid = id.ItemId
+    INNER JOIN dbo.packing p ON id.IncomingDetId = p.IncomingDetId
+    INNER JOIN dbo.Location L ON p.LocationId = l.locationid
+"""
+
+# Tutte le righe packing dei documenti incoming che contengono il batch cercato
+DOCUMENT_PREFETCH_QUERY = BATCH_SEARCH_SELECT + """
+    WHERE i.number IN (
+        SELECT i2.number
+        FROM dbo.packing p2
+        INNER JOIN dbo.incomingdet id2 ON id2.IncomingDetId = p2.IncomingDetId
+        INNER JOIN dbo.incoming i2 ON i2.IncomingId = id2.incomingid
+        WHERE p2.BatchNumber_HU = ?
+    )
+"""
+DOCUMENT_PREFETCH = queries.register('batch_search', DOCUMENT_PREFETCH_QUERY)
+
+
+class BatchIndex:
+    """Indice in memoria dei batch di una sessione di ricevimento.
+
+    Alla prima scansione di un batch vengono caricate con un'unica query
+    tutte le righe packing del suo documento incoming, così le scansioni
+    successive dello stesso documento non interrogano il database. Le voci
+    scadono dopo ttl secondi e l'indice non supera max_entries voci (LRU).
+    Le righe vengono conservate come BatchRecord, senza riferimenti al cursore.
+    """
+
+    def __init__(self, max_entries=5000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # batch number -> (BatchRecord, istante di caricamento)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, connection, batch_number):
+        """Restituisce la riga del batch, dall'indice o caricando il suo documento"""
+        row = self.get(batch_number)
+        if row is not None:
+            return row
+
+        with timer('db.batch_search'):
+            rows = BatchColumns(queries.fetchall(connection, DOCUMENT_PREFETCH, batch_number))
+
+        self.add_rows(rows)
+        return rows.find(batch_number)
+
+    def get(self, batch_number):
+        """Restituisce la riga in cache o None se assente o scaduta"""
+        with self._lock:
+            entry = self._entries.get(batch_number)
+            if entry is not None:
+                row, loaded_at = entry
+                if time.time() - loaded_at <= self.ttl:
+                    self._entries.move_to_end(batch_number)
+                    self.hits += 1
+                    return row
+                del self._entries[batch_number]
+            self.misses += 1
+            return None
+
+    def add_rows(self, rows):
+        """Inserisce nell'indice le righe caricate dal database"""
+        now = time.time()
+        loaded = {}
+        for row in rows:
+            # In caso di batch duplicati vale la prima riga, come nella ricerca singola
+            if row.BatchNumber_HU not in loaded:
+                loaded[row.BatchNumber_HU] = BatchRecord.from_row(row)
+
+        with self._lock:
+            for batch_number, row in loaded.items():
+                self._entries[batch_number] = (row, now)
+                self._entries.move_to_end(batch_number)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate_document(self, number):
+        """Rimuove tutte le righe di un documento incoming (dopo uno split)"""
+        with self._lock:
+            stale = [batch_number for batch_number, (row, _) in self._entries.items()
+                     if row.number == number]
+            for batch_number in stale:
+                del self._entries[batch_number]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
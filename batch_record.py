@@ -0,0 +1,181 @@
+# batch_record.py
+"""Righe dei batch indipendenti dal driver del database.
+
+BatchRecord copia i campi della ricerca (BATCH_SEARCH_SELECT) da una riga
+pyodbc, dal database simulato o dalla copia locale, con tipi fissi: id
+interi, testi str e quantità Decimal. Non tiene riferimenti al cursore e,
+con __slots__, occupa molto meno di una riga con dizionario. È immutabile:
+copiarlo non costa nulla e replace() crea una copia modificata.
+
+BatchColumns tiene molte righe per colonne (gli id in array di interi)
+e crea i BatchRecord solo quando vengono letti: serve per i documenti
+precaricati dall'indice e per le raccolte di scatole della sessione.
+"""
+from array import array
+from decimal import Decimal
+
+from split_planner import to_decimal
+
+BATCH_FIELDS = ('incomingid', 'incomingdetid', 'number', 'itemid', 'Code', 'BatchNumber_HU',
+                'PackQty', 'IncomingQty', 'locationid', 'LocationCode', 'PackingId')
+_ID_FIELDS = frozenset(('incomingid', 'incomingdetid', 'itemid', 'locationid', 'PackingId'))
+_QTY_FIELDS = frozenset(('PackQty', 'IncomingQty'))
+
+
+def _to_id(value):
+    return value if value is None or type(value) is int else int(value)
+
+
+def _to_text(value):
+    return value if value is None or type(value) is str else str(value)
+
+
+def _to_qty(value):
+    # Percorsi rapidi per i tipi restituiti dai driver; il resto passa da to_decimal
+    if value is None or type(value) is Decimal:
+        return value
+    if type(value) is float:
+        return Decimal(repr(value))
+    if type(value) is int:
+        return Decimal(value)
+    return to_decimal(value)
+
+
+_CONVERTERS = tuple(_to_id if field in _ID_FIELDS else _to_qty if field in _QTY_FIELDS else _to_text
+                    for field in BATCH_FIELDS)
+_CONVERTER = dict(zip(BATCH_FIELDS, _CONVERTERS))
+
+
+def _convert(field, value):
+    """Porta il valore di una colonna al tipo del campo"""
+    return _CONVERTER[field](value)
+
+
+def _row_values(row):
+    """Valori convertiti di una riga con attributi per nome"""
+    return [convert(getattr(row, field)) for field, convert in zip(BATCH_FIELDS, _CONVERTERS)]
+
+
+class BatchRecord:
+    """Riga di un batch con campi tipizzati e immutabili"""
+
+    __slots__ = BATCH_FIELDS
+
+    def __init__(self, *values, **fields):
+        if len(values) > len(BATCH_FIELDS):
+            raise TypeError(f"BatchRecord accetta al massimo {len(BATCH_FIELDS)} valori")
+        given = dict(zip(BATCH_FIELDS, values))
+        unknown = set(fields) - set(BATCH_FIELDS)
+        if unknown:
+            raise TypeError(f"Campi sconosciuti: {', '.join(sorted(unknown))}")
+        given.update(fields)
+        for field in BATCH_FIELDS:
+            object.__setattr__(self, field, _convert(field, given.get(field)))
+
+    @classmethod
+    def _from_values(cls, values):
+        """Record da valori già convertiti (colonne di BatchColumns)"""
+        record = object.__new__(cls)
+        for field, value in zip(BATCH_FIELDS, values):
+            object.__setattr__(record, field, value)
+        return record
+
+    @classmethod
+    def from_row(cls, row):
+        """Converte una riga con attributi per nome (pyodbc.Row o simili); None resta None"""
+        if row is None or isinstance(row, cls):
+            return row
+        return cls._from_values(_row_values(row))
+
+    def replace(self, **changes):
+        """Copia del record con i campi indicati modificati"""
+        values = [getattr(self, field) for field in BATCH_FIELDS]
+        for index, field in enumerate(BATCH_FIELDS):
+            if field in changes:
+                values[index] = _convert(field, changes.pop(field))
+        if changes:
+            raise TypeError(f"Campi sconosciuti: {', '.join(sorted(changes))}")
+        return self._from_values(values)
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in BATCH_FIELDS}
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BatchRecord è immutabile: usare replace()")
+
+    def __delattr__(self, name):
+        raise AttributeError("BatchRecord è immutabile")
+
+    def __iter__(self):
+        return (getattr(self, field) for field in BATCH_FIELDS)
+
+    def __eq__(self, other):
+        if not isinstance(other, BatchRecord):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return BatchRecord, tuple(self)
+
+    def __repr__(self):
+        return f"BatchRecord({', '.join(f'{field}={getattr(self, field)!r}' for field in BATCH_FIELDS)})"
+
+
+class BatchColumns:
+    """Raccolta di righe di batch memorizzate per colonne.
+
+    Gli id stanno in array di interi a 64 bit, testi e quantità in liste.
+    L'indice per batch number viene costruito alla prima ricerca; i
+    BatchRecord vengono creati solo quando le righe sono lette.
+    """
+
+    def __init__(self, rows=()):
+        self._columns = {field: array('q') if field in _ID_FIELDS else [] for field in BATCH_FIELDS}
+        self._by_batch = None
+        self.extend(rows)
+
+    def append(self, row):
+        values = list(row) if isinstance(row, BatchRecord) else _row_values(row)
+        for field, value in zip(BATCH_FIELDS, values):
+            self._columns[field].append(value)
+        self._by_batch = None
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return len(self._columns['PackingId'])
+
+    def __getitem__(self, index):
+        return BatchRecord._from_values([self._columns[field][index] for field in BATCH_FIELDS])
+
+    def __iter__(self):
+        columns = [self._columns[field] for field in BATCH_FIELDS]
+        return (BatchRecord._from_values(values) for values in zip(*columns))
+
+    def column(self, field):
+        """Valori di un campo per tutte le righe (da non modificare)"""
+        return self._columns[field]
+
+    def find(self, batch_number):
+        """Prima riga con il batch number indicato, o None"""
+        if self._by_batch is None:
+            self._by_batch = {}
+            for index, value in enumerate(self._columns['BatchNumber_HU']):
+                self._by_batch.setdefault(value, index)
+        index = self._by_batch.get(batch_number)
+        return self[index] if index is not None else None
+
+    def total(self, field='PackQty'):
+        """Somma esatta (Decimal) di una colonna di quantità"""
+        return sum((value for value in self._columns[field] if value is not None), to_decimal(0))
@@ -0,0 +1,652 @@
+# bench_fakes.py
+"""Sostituti locali di SQL Server e della stampante Zebra per i benchmark.
+
+FakeDatabase espone connessioni compatibili con pyodbc (cursor, execute con
+parametri '?', righe con accesso per nome di colonna, commit/rollback,
+autocommit) su un file SQLite con lo schema usato dall'applicazione.
+I batch T-SQL generati da SplitWriter vengono tradotti in SQLite; le
+procedure (sql/usp_SplitBox.sql) sono sostituite da funzioni Python
+installate con FakeDatabase.install_procedure.
+
+FakePrinter è un server TCP che accetta ZPL come una Zebra sulla porta
+9100: registra ogni etichetta ricevuta con il suo istante di arrivo,
+risponde a ~HS e può simulare la velocità di stampa e la perdita della
+connessione.
+"""
+import json
+import operator
+import os
+import random
+import re
+import socket
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from decimal import Decimal
+from functools import lru_cache
+
+import pyodbc
+
+# pyodbc accetta Decimal come parametro: in SQLite diventa un REAL
+sqlite3.register_adapter(Decimal, float)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS dbo.incoming (
+        IncomingId INTEGER PRIMARY KEY AUTOINCREMENT,
+        number TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS dbo.item (
+        itemid INTEGER PRIMARY KEY AUTOINCREMENT,
+        Code TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS dbo.Location (
+        locationid INTEGER PRIMARY KEY AUTOINCREMENT,
+        Code TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS dbo.incomingdet (
+        IncomingDetId INTEGER PRIMARY KEY AUTOINCREMENT,
+        incomingid INTEGER NOT NULL,
+        ItemId INTEGER NOT NULL,
+        batchnumber TEXT,
+        Qty REAL NOT NULL,
+        OriginalWas TEXT
+    );
+    CREATE TABLE IF NOT EXISTS dbo.packing (
+        PackingId INTEGER PRIMARY KEY AUTOINCREMENT,
+        IncomingDetId INTEGER NOT NULL,
+        LocationId INTEGER NOT NULL,
+        Qty REAL NOT NULL,
+        Code TEXT,
+        BatchNumber_HU TEXT NOT NULL,
+        CurrentDate TEXT,
+        UserId INTEGER
+    );
+    CREATE INDEX IF NOT EXISTS dbo.ix_packing_batch ON packing (BatchNumber_HU);
+    CREATE INDEX IF NOT EXISTS dbo.ix_packing_det ON packing (IncomingDetId);
+    CREATE INDEX IF NOT EXISTS dbo.ix_incomingdet_incoming ON incomingdet (incomingid);
+    CREATE TABLE IF NOT EXISTS dbo.SplitBoxes (
+        SplitBoxId INTEGER PRIMARY KEY AUTOINCREMENT,
+        UserId INTEGER,
+        IncomingDetid INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS dbo.[User] (
+        UserId INTEGER PRIMARY KEY AUTOINCREMENT,
+        Name TEXT NOT NULL,
+        Password TEXT
+    );
+"""
+
+_DECLARE_TABLE = re.compile(r'^DECLARE\s+@(\w+)\s+TABLE\s*\((.*)\)$', re.IGNORECASE | re.DOTALL)
+_OUTPUT_INTO = re.compile(r'\s+OUTPUT\s+(.*?)\s+INTO\s+@(\w+)\s*\(([^)]*)\)', re.IGNORECASE | re.DOTALL)
+_VALUES_ALIAS = re.compile(r'\(VALUES\s+((?:\([^()]*\)\s*,?\s*)+)\)\s+AS\s+(\w+)\s*\(([^)]*)\)',
+                           re.IGNORECASE)
+_TABLE_VARIABLE = re.compile(r'@(\w+)')
+_TABLE_HINTS = re.compile(r'\s+WITH\s*\(\s*(?:NOLOCK|UPDLOCK|ROWLOCK|HOLDLOCK|XLOCK|READPAST)'
+                          r'(?:\s*,\s*\w+)*\s*\)', re.IGNORECASE)
+
+# Errore restituito da SQL Server alla transazione vittima di un deadlock
+DEADLOCK_MESSAGE = ("[40001] [Microsoft][ODBC Driver 18 for SQL Server][SQL Server]Transaction was "
+                    "deadlocked on lock resources with another process and has been chosen as the "
+                    "deadlock victim. Rerun the transaction. (1205)")
+
+
+def _translate_statement(statement):
+    """Traduce una istruzione T-SQL in (sql SQLite, tabella destinazione di OUTPUT o None)"""
+    declare = _DECLARE_TABLE.match(statement)
+    if declare:
+        name, columns = declare.groups()
+        # Colonne senza tipi SQL Server: SQLite accetta qualsiasi valore
+        names = ", ".join(column.split()[0] for column in re.split(r',(?![^()]*\))', columns))
+        return [f"CREATE TEMP TABLE IF NOT EXISTS tv_{name} ({names})",
+                f"DELETE FROM temp.tv_{name}"], None
+
+    output_target = None
+    output = _OUTPUT_INTO.search(statement)
+    if output:
+        columns, target, target_columns = output.groups()
+        statement = statement[:output.start()] + statement[output.end():]
+        statement += " RETURNING " + re.sub(r'INSERTED\.', '', columns, flags=re.IGNORECASE)
+        output_target = f"INSERT INTO temp.tv_{target} ({target_columns}) " \
+                        f"VALUES ({', '.join('?' for _ in target_columns.split(','))})"
+
+    def values_alias(match):
+        rows, alias, names = match.groups()
+        aliases = ", ".join(f"column{i} AS {name.strip()}" for i, name in enumerate(names.split(','), 1))
+        return f"(SELECT {aliases} FROM (VALUES {rows})) AS {alias}"
+
+    statement = _VALUES_ALIAS.sub(values_alias, statement)
+    # SQLite blocca l'intero database in scrittura: i lock hint non servono
+    statement = _TABLE_HINTS.sub('', statement)
+    statement = re.sub(r'GetDate\(\)', 'CURRENT_TIMESTAMP', statement, flags=re.IGNORECASE)
+    statement = re.sub(r'\[WarehouseNEW\]\.', '', statement, flags=re.IGNORECASE)
+    statement = _TABLE_VARIABLE.sub(lambda m: f"temp.tv_{m.group(1)}", statement)
+    return [statement], output_target
+
+
+@lru_cache(maxsize=256)
+def translate_batch(sql):
+    """Divide un batch T-SQL in istruzioni SQLite.
+
+    Restituisce una tupla di (sql, numero di parametri, INSERT verso la
+    table variable di OUTPUT o None).
+    """
+    statements = []
+    for statement in sql.split(';'):
+        statement = statement.strip()
+        if not statement or re.match(r'^SET\s+(NOCOUNT|XACT_ABORT)', statement, re.IGNORECASE):
+            continue
+        count = statement.count('?')
+        translated, output_target = _translate_statement(statement)
+        for i, part in enumerate(translated):
+            last = i == len(translated) - 1
+            statements.append((part, count if last else 0, output_target if last else None))
+    return tuple(statements)
+
+
+_CALL = re.compile(r'^\{CALL\s+([\w.]+)\s*\(([^)]*)\)\}$', re.IGNORECASE)
+_EXEC = re.compile(r'^EXEC\s+([\w.]+)\s*(.*)$', re.IGNORECASE | re.DOTALL)
+
+
+def split_box_procedure(db, params):
+    """Equivalente SQLite di dbo.usp_SplitBox (sql/usp_SplitBox.sql)"""
+    (det_id, packing_id, incoming_id, item_id, location_id, batch_number,
+     original_was, user_id, quantities, separator) = params
+    quantities = [Decimal(qty) for qty in json.loads(quantities)]
+    if len(quantities) < 2:
+        raise pyodbc.Error('42000', '[SQL Server]Il numero di divisioni deve essere almeno 2 (50001)')
+
+    db.execute("UPDATE dbo.incomingdet SET Qty = ?, OriginalWas = ? WHERE incomingdetid = ?",
+               (quantities[0], original_was, det_id))
+    db.execute("UPDATE dbo.packing SET Qty = ?, BatchNumber_HU = ? WHERE PackingId = ?",
+               (quantities[0], batch_number, packing_id))
+    for position, qty in enumerate(quantities[1:], 1):
+        child = f"{batch_number}{separator}{position}"
+        new_id = db.execute("""
+            INSERT INTO dbo.incomingdet (incomingid, ItemId, batchnumber, Qty, OriginalWas)
+            VALUES (?, ?, ?, ?, ?)
+        """, (incoming_id, item_id, child, qty, original_was)).lastrowid
+        db.execute("""
+            INSERT INTO dbo.packing (IncomingDetId, LocationId, Qty, Code, BatchNumber_HU, CurrentDate, UserId)
+            VALUES (?, ?, ?, ?, ?, CURRENT_TIMESTAMP, ?)
+        """, (new_id, location_id, qty, child, child, user_id))
+        db.execute("INSERT INTO dbo.SplitBoxes (UserId, IncomingDetid) VALUES (?, ?)", (user_id, new_id))
+
+
+class FakeRow(tuple):
+    """Riga con accesso per nome di colonna come pyodbc.Row.
+
+    SQLite restituisce i nomi delle colonne come dichiarati nello schema e
+    non come scritti nella query: il confronto non distingue le maiuscole.
+    """
+
+    __slots__ = ()
+    _columns = {}
+
+    def __getattr__(self, name):
+        try:
+            return self[self._columns[name.lower()]]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class FakeCursor:
+    """Cursore con l'interfaccia di pyodbc usata dall'applicazione"""
+
+    _row_types = {}
+
+    def __init__(self, connection):
+        self.connection = connection
+        self._rows = []
+        self.description = None
+        self.rowcount = -1
+
+    def execute(self, sql, *params):
+        if len(params) == 1 and isinstance(params[0], (list, tuple)):
+            params = params[0]
+        self.connection._before_execute(sql)
+
+        db = self.connection._db
+        self._rows = []
+        self.description = None
+        if self._execute_special(sql, params):
+            return self
+        offset = 0
+        for statement, count, output_target in translate_batch(sql):
+            try:
+                cursor = db.execute(statement, params[offset:offset + count])
+            except sqlite3.OperationalError as e:
+                # Due transazioni che passano dalla lettura alla scrittura si bloccano a
+                # vicenda: SQLite fallisce subito, come la vittima di un deadlock
+                if 'locked' in str(e) or 'busy' in str(e):
+                    raise pyodbc.Error('40001', DEADLOCK_MESSAGE)
+                raise
+            offset += count
+            rows = cursor.fetchall() if cursor.description else []
+            if output_target:
+                db.executemany(output_target, rows)
+            elif cursor.description:
+                self.description = cursor.description
+                self._rows = self._wrap(cursor.description, rows)
+            self.rowcount = cursor.rowcount
+        return self
+
+    def _execute_special(self, sql, params):
+        """Chiamate di procedura e lettura della loro versione; False per il normale T-SQL"""
+        database = self.connection.database
+        if 'sys.extended_properties' in sql:
+            procedure = database.procedures.get(params[0].lower())
+            self.description = (('Version',),)
+            self._rows = self._wrap(self.description, [(procedure[0],)] if procedure else [])
+            return True
+
+        sql = sql.strip()
+        call = _CALL.match(sql)
+        if call:
+            self._call_procedure(call.group(1), params)
+            return True
+        if not re.search(r'^\s*EXEC\s', sql, re.IGNORECASE | re.MULTILINE):
+            return False
+
+        offset = 0
+        for statement in sql.split(';'):
+            statement = statement.strip()
+            execute = _EXEC.match(statement)
+            if execute:
+                count = statement.count('?')
+                self._call_procedure(execute.group(1), params[offset:offset + count])
+                offset += count
+        return True
+
+    def _call_procedure(self, name, params):
+        procedure = self.connection.database.procedures.get(name.lower())
+        if procedure is None:
+            raise pyodbc.ProgrammingError(
+                '42000', f"[SQL Server]Could not find stored procedure '{name}'. (2812)")
+        db = self.connection._db
+        # Come la procedura: transazione propria se il client è in autocommit
+        own_transaction = not db.in_transaction
+        if own_transaction:
+            db.execute("BEGIN")
+        try:
+            procedure[1](db, params)
+        except sqlite3.OperationalError as e:
+            if own_transaction:
+                db.execute("ROLLBACK")
+            if 'locked' in str(e) or 'busy' in str(e):
+                raise pyodbc.Error('40001', DEADLOCK_MESSAGE)
+            raise
+        except Exception:
+            if own_transaction:
+                db.execute("ROLLBACK")
+            raise
+        if own_transaction:
+            db.execute("COMMIT")
+
+    def _wrap(self, description, rows):
+        names = tuple(column[0] for column in description)
+        row_type = self._row_types.get(names)
+        if row_type is None:
+            columns = {name.lower(): i for i, name in reversed(list(enumerate(names)))}
+            # Come pyodbc.Row l'accesso per nome esatto non passa da Python: property per colonna
+            attributes = {name: property(operator.itemgetter(i)) for i, name in reversed(list(enumerate(names)))
+                          if name.isidentifier()}
+            row_type = self._row_types[names] = type('Row', (FakeRow,), {'__slots__': (), '_columns': columns,
+                                                                         **attributes})
+        return [row_type(row) for row in rows]
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def close(self):
+        self._rows = []
+
+
+class FakeConnection:
+    """Connessione compatibile con pyodbc verso il database SQLite del benchmark"""
+
+    def __init__(self, database):
+        self.database = database
+        # Le tabelle stanno nello schema 'dbo' come su SQL Server
+        self._db = sqlite3.connect(':memory:', timeout=30, check_same_thread=False,
+                                   isolation_level=None)
+        self._db.execute("ATTACH DATABASE ? AS dbo", (database.path,))
+        # Nessuna colonna rowversion nello schema simulato: la copia locale usa gli id
+        self._db.create_function('COL_LENGTH', 2, lambda table, column: None)
+        self.autocommit = True
+        self.closed = False
+        self.killed = False
+
+    def _before_execute(self, sql=''):
+        if self.closed:
+            raise pyodbc.ProgrammingError('Attempt to use a closed connection.')
+        if self.killed:
+            raise pyodbc.OperationalError('08S01', 'Communication link failure')
+        if self.database.query_latency:
+            time.sleep(self.database.query_latency)
+        session_option = sql.lstrip().upper().startswith('SET ') and ';' not in sql.strip().rstrip(';')
+        if session_option:
+            # Come su SQL Server, le opzioni di sessione (SET XACT_ABORT) non aprono la transazione
+            return
+        if not self.autocommit and not self._db.in_transaction:
+            # Una transazione che apre con una lettura WITH (UPDLOCK) prende subito il blocco
+            # in scrittura: le altre attendono, come con i lock di aggiornamento di SQL Server
+            self._db.execute("BEGIN IMMEDIATE" if 'UPDLOCK' in sql else "BEGIN")
+        if self._db.in_transaction and self.database.deadlock_rate \
+                and self.database.random.random() < self.database.deadlock_rate:
+            self.database.deadlocks += 1
+            raise pyodbc.Error('40001', DEADLOCK_MESSAGE)
+
+    def cursor(self):
+        if self.closed:
+            raise pyodbc.ProgrammingError('Attempt to use a closed connection.')
+        return FakeCursor(self)
+
+    def execute(self, sql, *params):
+        return self.cursor().execute(sql, *params)
+
+    def commit(self):
+        if self.killed:
+            raise pyodbc.OperationalError('08S01', 'Communication link failure')
+        if self._db.in_transaction:
+            self._db.execute("COMMIT")
+
+    def rollback(self):
+        if self.killed:
+            raise pyodbc.OperationalError('08S01', 'Communication link failure')
+        if self._db.in_transaction:
+            self._db.execute("ROLLBACK")
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.database._forget(self)
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Come pyodbc: commit all'uscita senza errori, altrimenti rollback
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+
+
+class FakeDatabase:
+    """Database SQLite con lo schema dell'applicazione, latenze e deadlock simulati.
+
+    Con deadlock_rate ogni istruzione eseguita in una transazione fallisce
+    con quella probabilità come vittima di un deadlock (1205). Con offline
+    il server non accetta nuove connessioni (set_offline).
+    """
+
+    def __init__(self, path=None, connect_latency=0.0, query_latency=0.0, deadlock_rate=0.0, seed=0):
+        if path is None:
+            handle, path = tempfile.mkstemp(prefix='bench_', suffix='.db')
+            os.close(handle)
+            self._temporary = True
+        else:
+            self._temporary = False
+        self.path = path
+        self.connect_latency = connect_latency
+        self.query_latency = query_latency
+        self.deadlock_rate = deadlock_rate
+        self.deadlocks = 0
+        self.procedures = {}  # nome in minuscolo -> (versione, funzione(db, parametri))
+        self.random = random.Random(seed)
+        self.connections_opened = 0
+        self.offline = False
+        self._live = set()
+        self._lock = threading.Lock()
+
+        setup = sqlite3.connect(':memory:', isolation_level=None)
+        setup.execute("ATTACH DATABASE ? AS dbo", (path,))
+        setup.execute("PRAGMA dbo.journal_mode=WAL")
+        setup.executescript(SCHEMA)
+        setup.close()
+
+    def connect(self):
+        """Equivalente di pyodbc.connect: usato come factory del ConnectionPool"""
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+        if self.offline:
+            raise pyodbc.OperationalError('08001', '[TCP Provider] Named Pipes Provider: Could not open a '
+                                                   'connection to SQL Server')
+        connection = FakeConnection(self)
+        with self._lock:
+            self.connections_opened += 1
+            self._live.add(connection)
+        return connection
+
+    def install_procedure(self, name, version, function):
+        """Simula l'esecuzione dello script SQL di una procedura sul server"""
+        self.procedures[name.lower()] = (version, function)
+
+    def _forget(self, connection):
+        with self._lock:
+            self._live.discard(connection)
+
+    def set_offline(self, offline=True):
+        """Simula il server non raggiungibile: le sessioni cadono e le nuove connessioni falliscono"""
+        self.offline = offline
+        if offline:
+            self.kill_connections()
+
+    def kill_connections(self):
+        """Simula la caduta di tutte le sessioni aperte (riavvio server, rete)"""
+        with self._lock:
+            live = list(self._live)
+        for connection in live:
+            connection.killed = True
+        return len(live)
+
+    def seed(self, documents=10, boxes_per_document=50, qty=120, item_code='ART-001', location='A01'):
+        """Crea documenti incoming con una scatola (packing) per riga; restituisce i batch number"""
+        db = sqlite3.connect(self.path, isolation_level=None)
+        try:
+            db.execute("BEGIN")
+            item_id = db.execute("INSERT INTO item (Code) VALUES (?)", (item_code,)).lastrowid
+            location_id = db.execute("INSERT INTO Location (Code) VALUES (?)", (location,)).lastrowid
+            batch_numbers = []
+            for doc in range(documents):
+                incoming_id = db.execute("INSERT INTO incoming (number) VALUES (?)",
+                                         (f"DOC{doc:05d}",)).lastrowid
+                for box in range(boxes_per_document):
+                    batch_number = f"HU{doc:05d}{box:04d}"
+                    det_id = db.execute("""
+                        INSERT INTO incomingdet (incomingid, ItemId, batchnumber, Qty)
+                        VALUES (?, ?, ?, ?)
+                    """, (incoming_id, item_id, batch_number, qty)).lastrowid
+                    db.execute("""
+                        INSERT INTO packing (IncomingDetId, LocationId, Qty, Code, BatchNumber_HU)
+                        VALUES (?, ?, ?, ?, ?)
+                    """, (det_id, location_id, qty, batch_number, batch_number))
+                    batch_numbers.append(batch_number)
+            db.execute("COMMIT")
+            return batch_numbers
+        finally:
+            db.close()
+
+    def count(self, table):
+        return self.query(f"SELECT COUNT(*) FROM {table}")[0][0]
+
+    def query(self, sql, *params):
+        """Esegue una query di controllo direttamente su SQLite"""
+        db = sqlite3.connect(self.path)
+        try:
+            return db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+
+    def close(self):
+        with self._lock:
+            live = list(self._live)
+        for connection in live:
+            connection.close()
+        if self._temporary:
+            for suffix in ('', '-wal', '-shm'):
+                try:
+                    os.remove(self.path + suffix)
+                except OSError:
+                    pass
+
+
+ReceivedLabel = namedtuple('ReceivedLabel', 'received_at batch_number zpl')
+
+
+class FakePrinter:
+    """Stampante Zebra simulata su una porta TCP locale.
+
+    print_time: secondi di stampa per etichetta (le etichette ricevute
+    restano nel buffer e sono riportate da ~HS come formati in attesa).
+    drop_rate: probabilità di chiudere la connessione alla ricezione di
+    un'etichetta, che va persa come in una caduta di rete.
+    set_fault() simula un problema segnalato da ~HS e ~HQES (carta
+    esaurita, testina aperta, pausa): le etichette inviate nel frattempo
+    vengono registrate come arrivate durante il guasto.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, print_time=0.0, drop_rate=0.0,
+                 status_supported=True, seed=None):
+        self.print_time = print_time
+        self.drop_rate = drop_rate
+        self.status_supported = status_supported
+        self.labels = []
+        self.formats = 0
+        self.connections = 0
+        self.drops = 0
+        self.fault = None
+        self.labels_during_fault = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._printed_until = 0.0
+        self._stop = threading.Event()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind((host, port))
+        self._server.listen(16)
+        self._server.settimeout(0.2)
+        self.address = self._server.getsockname()
+        self._thread = threading.Thread(target=self._accept_loop, name="FakePrinter", daemon=True)
+
+    @property
+    def port(self):
+        return self.address[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(2)
+        self._server.close()
+
+    def reset(self):
+        with self._lock:
+            self.labels = []
+            self.formats = 0
+            self.drops = 0
+
+    def _accept_loop(self):
+        while not self._stop.is_set():
+            try:
+                client, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            self.connections += 1
+            threading.Thread(target=self._serve, args=(client,), daemon=True).start()
+
+    def set_fault(self, fault=None):
+        """Imposta il problema riportato dallo stato: 'paper_out', 'head_open', 'paused' o None"""
+        self.fault = fault
+
+    def _buffered_formats(self):
+        """Etichette ricevute e non ancora stampate secondo print_time"""
+        if not self.print_time:
+            return 0
+        remaining = self._printed_until - time.time()
+        return max(0, int(remaining / self.print_time + 0.999))
+
+    def _status_response(self):
+        formats = self._buffered_formats()
+        paper_out = int(self.fault == 'paper_out')
+        paused = int(self.fault == 'paused')
+        head_open = int(self.fault == 'head_open')
+        return (f"\x02030,{paper_out},{paused},1245,{formats:03d},0,0,0,000,0,0,0\x03\r\n"
+                f"\x02000,0,{head_open},0,0,2,4,0,{formats:08d},1,000\x03\r\n"
+                f"\x021234,0\x03\r\n").encode('ascii')
+
+    def _extended_status_response(self):
+        errors = {'paper_out': 0x1, 'head_open': 0x4}.get(self.fault, 0)
+        return (f"\x02\r\n PRINTER STATUS\r\n"
+                f"   ERRORS:         {int(bool(errors))} 00000000 {errors:08X}\r\n"
+                f"   WARNINGS:       0 00000000 00000000\r\n\x03\r\n").encode('ascii')
+
+    def _serve(self, client):
+        buffer = ''
+        client.settimeout(0.5)
+        try:
+            while not self._stop.is_set():
+                try:
+                    chunk = client.recv(65536)
+                except socket.timeout:
+                    continue
+                if not chunk:
+                    break
+                buffer += chunk.decode('utf-8', errors='replace').replace('\x00', '')
+
+                if '~HQES' in buffer:
+                    count = buffer.count('~HQES')
+                    buffer = buffer.replace('~HQES', '')
+                    if self.status_supported:
+                        for _ in range(count):
+                            client.sendall(self._extended_status_response())
+
+                if '~HS' in buffer:
+                    count = buffer.count('~HS')
+                    buffer = buffer.replace('~HS', '')
+                    if self.status_supported:
+                        for _ in range(count):
+                            client.sendall(self._status_response())
+
+                while '^XZ' in buffer:
+                    end = buffer.index('^XZ') + 3
+                    block, buffer = buffer[:end], buffer[end:]
+                    if '^DF' in block:
+                        self.formats += 1
+                        continue
+                    if self.drop_rate and self._random.random() < self.drop_rate:
+                        self.drops += 1
+                        return
+                    self._record(block)
+        except OSError:
+            pass
+        finally:
+            client.close()
+
+    def _record(self, block):
+        now = time.time()
+        match = re.search(r'\^FN3\^FD(.*?)\^FS', block) or re.search(r'Lotto: (.*?)\^FS', block)
+        with self._lock:
+            if self.fault:
+                self.labels_during_fault += 1
+            self.labels.append(ReceivedLabel(now, match.group(1) if match else None, block))
+            if self.print_time:
+                self._printed_until = max(self._printed_until, now) + self.print_time
+
+    def wait_for(self, count, timeout=30):
+        """Attende di aver ricevuto almeno count etichette"""
+        deadline = time.time() + timeout
+        while len(self.labels) < count and time.time() < deadline:
+            time.sleep(0.01)
+        return len(self.labels) >= count
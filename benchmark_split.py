@@ -0,0 +1,780 @@
+# benchmark_split.py
+"""Benchmark riproducibile dello split con database e stampante simulati.
+
+Usa il codice reale dell'applicazione (SplitService, SplitWriter,
+BatchIndex, ConnectionPool, PrintOutbox, OutboxDrainer, PrinterConnection)
+contro i sostituti locali di bench_fakes, quindi non richiede SQL Server
+né una Zebra. Per ogni scenario riporta operazioni al secondo e percentili
+di latenza.
+
+Scenari:
+  split_2, split_10, split_100  ricerca + split in 2/10/100 scatole con stampa
+  burst_scan                    scansioni concorrenti di batch dello stesso documento
+  reconnect_storm               split concorrenti mentre le sessioni DB cadono
+                                e la stampante chiude le connessioni
+  planner                       piano automatico (split_planner) su quantità grandi
+  session                       sessione multipla: scansione, piano e conferma a gruppi
+  contention                    split concorrenti sugli stessi documenti con deadlock
+                                simulati: verifica che nessuno split resti a metà
+  procedure                     split in 10 scatole alternando il batch SQL del client
+                                e la procedura dbo.usp_SplitBox
+  offline                       scansioni dalla copia locale e split accodati con il server
+                                non raggiungibile, poi invio al ripristino della connessione
+  printer_fault                 split in 10 scatole con la stampante senza carta a metà serie:
+                                l'invio si sospende e riprende con il monitor di stato
+  quantities                    validazione di split casuali fino a 5000 scatole e da 0 a 4
+                                decimali: controlla le proprietà del modulo quantities
+
+Il programma termina con codice 1 se uno scenario ha errori o trova il
+database incoerente (documenti sbilanciati, scatole figlie perse o doppie).
+
+Con --split-mode gli altri scenari scrivono gli split con la procedura
+(installata nel database simulato) invece che con il batch SQL.
+
+Esempio:
+  python benchmark_split.py --scenario split_10 --iterations 200 --db-latency 0.002
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from decimal import Decimal
+
+from bench_fakes import FakeDatabase, FakePrinter, split_box_procedure
+from batch_index import BatchIndex
+from db_connection import ConnectionPool, DatabaseConnection, queries
+from local_cache import LocalCache, SplitQueued
+from metrics import LatencyHistogram, metrics
+from quantities import MAX_DECIMALS, db_param, format_quantity, to_quantity, validate_split
+from print_outbox import PrintOutbox, OutboxDrainer, HELD, PENDING, SENDING, UNCERTAIN
+from PrinterConnection import PrinterConnection
+from printer_pool import attach_status_monitor
+from split_planner import PackRule, plan_split
+from split_service import SplitService
+from split_session import SplitSession, DONE
+from split_writer import (SPLIT_MODES, SPLIT_PROCEDURE, SPLIT_PROCEDURE_VERSION, ProcedureSplitWriter,
+                          SplitWriter, create_split_writer)
+from zpl_templates import load_template
+
+# Quantità di ogni scatola: divisibile in 2, 10 e 100 parti intere
+BOX_QTY = 1200
+BENCH_USER_ID = 1
+
+
+class BenchEnvironment:
+    """Database, stampante e servizi dell'applicazione collegati come in produzione"""
+
+    def __init__(self, args, documents=20, boxes_per_document=50, drop_rate=0.0, deadlock_rate=0.0):
+        self.work_dir = tempfile.mkdtemp(prefix='bench_')
+        self.database = FakeDatabase(os.path.join(self.work_dir, 'warehouse.db'),
+                                     connect_latency=args.connect_latency,
+                                     query_latency=args.db_latency,
+                                     deadlock_rate=deadlock_rate, seed=args.seed)
+        self.boxes_per_document = boxes_per_document
+        self.batch_numbers = self.database.seed(documents, boxes_per_document, qty=BOX_QTY)
+        # Come l'esecuzione di sql/usp_SplitBox.sql sul server
+        self.database.install_procedure(SPLIT_PROCEDURE, SPLIT_PROCEDURE_VERSION, split_box_procedure)
+        self.fake_printer = FakePrinter(print_time=args.print_time, drop_rate=drop_rate,
+                                        seed=args.seed).start()
+
+        self.pool = ConnectionPool(self.database.connect, max_size=args.pool_size)
+        self.split_writer = DatabaseConnection(None, pool=self.pool).run(
+            lambda connection: create_split_writer(connection, args.split_mode))
+        self.batch_index = BatchIndex()
+        self.printer = PrinterConnection('127.0.0.1', self.fake_printer.port, timeout=5,
+                                         template=load_template('split_box'))
+        self.outbox = PrintOutbox(os.path.join(self.work_dir, 'print_outbox.db'))
+        self.drainer = OutboxDrainer(self.outbox, self._get_printer, retry_interval=0.2)
+        self.drainer.start()
+
+    def _get_printer(self):
+        return self.printer if self.printer.is_connected() or self.printer.connect() else None
+
+    def service(self):
+        """Un SplitService per thread: l'indice, la coda e il pool sono condivisi"""
+        return SplitService(DatabaseConnection(None, pool=self.pool), print_outbox=self.outbox,
+                            on_labels_queued=self.drainer.notify, batch_index=self.batch_index,
+                            split_writer=self.split_writer)
+
+    def close(self):
+        self.drainer.stop(timeout=5)
+        self.printer.disconnect()
+        self.fake_printer.stop()
+        self.pool.close_all()
+        self.database.close()
+        self.outbox.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+class ScenarioResult:
+    # Valori di extra che indicano un database incoerente se diversi da zero
+    CONSISTENCY_CHECKS = ('unbalanced_documents', 'lost_children', 'duplicate_children')
+
+    def __init__(self, name, ops, elapsed, latencies, **extra):
+        self.name = name
+        self.ops = ops
+        self.elapsed = elapsed
+        self.latencies = latencies
+        self.extra = extra
+
+    @property
+    def failed(self):
+        """True se lo scenario ha avuto errori o ha trovato incoerenze nel database"""
+        return bool(self.latencies.summary()['errors'] or any(self.extra.get(check) for check in self.CONSISTENCY_CHECKS))
+
+    def as_dict(self):
+        summary = self.latencies.summary()
+        return {
+            'scenario': self.name,
+            'ops': self.ops,
+            'errors': summary['errors'],
+            'elapsed_s': round(self.elapsed, 3),
+            'ops_per_s': round(self.ops / self.elapsed, 1) if self.elapsed else 0.0,
+            'p50_ms': round(summary['p50_ms'], 2),
+            'p95_ms': round(summary['p95_ms'], 2),
+            'p99_ms': round(summary['p99_ms'], 2),
+            'max_ms': round(summary['max_ms'], 2),
+            **self.extra,
+        }
+
+
+def even_quantities(total, ways):
+    """Divide total in ways parti intere (la prima assorbe il resto)"""
+    part = total // ways
+    return [total - part * (ways - 1)] + [part] * (ways - 1)
+
+
+def wait_for_labels(env, expected, timeout):
+    """Attende le etichette attese o che la coda di stampa sia vuota (etichette perse)"""
+    deadline = time.time() + timeout
+    while not env.fake_printer.wait_for(expected, 0.5) and time.time() < deadline:
+        if not env.outbox.count(PENDING) and not env.outbox.count(SENDING):
+            break
+    return env.fake_printer.labels[:]
+
+
+def label_latencies(received, released_at):
+    """Latenza end-to-end: dal salvataggio dello split all'arrivo dell'etichetta in stampante"""
+    histogram = LatencyHistogram(max_samples=len(received) or 1)
+    for label in received:
+        number = label.batch_number or ''
+        # Le figlie hanno il batch number della scatola originale più '-n'
+        base = number if number in released_at else number.rsplit('-', 1)[0]
+        if base in released_at:
+            histogram.add(label.received_at - released_at[base])
+    return histogram
+
+
+def scenario_split(env, ways, iterations, timeout):
+    """Ricerca + split + stampa di iterations scatole in ways parti"""
+    service = env.service()
+    latencies = LatencyHistogram(max_samples=iterations)
+    released_at = {}
+    batch_numbers = env.batch_numbers[:iterations]
+
+    started = time.perf_counter()
+    wall_started = time.time()
+    for batch_number in batch_numbers:
+        op_started = time.perf_counter()
+        error = False
+        try:
+            data = service.find_batch(batch_number)
+            service.split(data, even_quantities(int(data.PackQty), ways), BENCH_USER_ID)
+            released_at[batch_number] = time.time()
+        except Exception as e:
+            print(f"Errore nello split di {batch_number}: {str(e)}")
+            error = True
+        latencies.add(time.perf_counter() - op_started, error)
+    elapsed = time.perf_counter() - started
+
+    expected = len(released_at) * ways
+    received = wait_for_labels(env, expected, timeout)
+    printed_in = (received[-1].received_at - wall_started) if received else 0.0
+    e2e = label_latencies(received, released_at).summary()
+    return ScenarioResult(
+        f"split_{ways}", len(batch_numbers), elapsed, latencies,
+        labels_expected=expected,
+        labels_received=len(received),
+        labels_per_s=round(len(received) / printed_in, 1) if printed_in else 0.0,
+        label_p50_ms=round(e2e['p50_ms'], 2),
+        label_p95_ms=round(e2e['p95_ms'], 2),
+        split_boxes=env.database.count('SplitBoxes'),
+        db_connections=env.database.connections_opened,
+    )
+
+
+def run_threads(workers, target):
+    threads = [threading.Thread(target=target, args=(i,), daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def scenario_burst_scan(env, scans, workers):
+    """Scansioni concorrenti: il primo batch di ogni documento carica l'intero documento"""
+    latencies = LatencyHistogram(max_samples=scans)
+    rng = random.Random(0)
+    sequence = [rng.choice(env.batch_numbers) for _ in range(scans)]
+    lock = threading.Lock()
+
+    def worker(index):
+        service = env.service()
+        for batch_number in sequence[index::workers]:
+            op_started = time.perf_counter()
+            error = False
+            try:
+                if service.find_batch(batch_number) is None:
+                    raise ValueError(f"Batch {batch_number} non trovato")
+            except Exception as e:
+                print(f"Errore nella ricerca di {batch_number}: {str(e)}")
+                error = True
+            with lock:
+                latencies.add(time.perf_counter() - op_started, error)
+
+    started = time.perf_counter()
+    run_threads(workers, worker)
+    elapsed = time.perf_counter() - started
+    return ScenarioResult(
+        'burst_scan', scans, elapsed, latencies,
+        workers=workers,
+        index_hits=env.batch_index.hits,
+        index_misses=env.batch_index.misses,
+        cursor_reuses=queries.hits,
+        cursors_prepared=queries.misses,
+        db_connections=env.database.connections_opened,
+    )
+
+
+def scenario_reconnect_storm(env, iterations, workers, kill_interval, timeout):
+    """Split concorrenti mentre le sessioni DB vengono chiuse a intervalli regolari"""
+    latencies = LatencyHistogram(max_samples=iterations)
+    released_at = {}
+    lock = threading.Lock()
+    stop = threading.Event()
+    kills = []
+
+    def killer():
+        while not stop.wait(kill_interval):
+            kills.append(env.database.kill_connections())
+
+    def worker(index):
+        service = env.service()
+        for batch_number in env.batch_numbers[index:iterations:workers]:
+            op_started = time.perf_counter()
+            error = False
+            try:
+                data = service.find_batch(batch_number)
+                service.split(data, even_quantities(int(data.PackQty), 2), BENCH_USER_ID)
+                with lock:
+                    released_at[batch_number] = time.time()
+            except Exception as e:
+                print(f"Errore nello split di {batch_number}: {str(e)}")
+                error = True
+            with lock:
+                latencies.add(time.perf_counter() - op_started, error)
+
+    killer_thread = threading.Thread(target=killer, daemon=True)
+    killer_thread.start()
+    started = time.perf_counter()
+    run_threads(workers, worker)
+    elapsed = time.perf_counter() - started
+    stop.set()
+    killer_thread.join()
+
+    expected = len(released_at) * 2
+    received = wait_for_labels(env, expected, timeout)
+    return ScenarioResult(
+        'reconnect_storm', iterations, elapsed, latencies,
+        workers=workers,
+        sessions_killed=sum(kills),
+        db_connections=env.database.connections_opened,
+        printer_connections=env.fake_printer.connections,
+        printer_drops=env.fake_printer.drops,
+        labels_expected=expected,
+        labels_received=len(received),
+        # Etichette di un blocco interrotto dalla stampante: non vengono ristampate in automatico
+        labels_uncertain=env.outbox.count(UNCERTAIN),
+    )
+
+
+# (quantità, regola): da 100 a 100000 scatole, con pezzi per scatola o parti uguali
+PLANNER_CASES = (
+    ('1200', PackRule(box_size=12)),
+    ('120000', PackRule(box_size=12)),
+    ('1200000.5', PackRule(box_size='12.5')),
+    ('1000000', PackRule(boxes=1000, unit='0.001')),
+    ('999999.999', PackRule(boxes=100000, unit='0.001')),
+)
+
+
+def scenario_planner(iterations):
+    """Calcolo del piano per ogni caso di PLANNER_CASES, ripetuto iterations volte"""
+    latencies = LatencyHistogram(max_samples=iterations * len(PLANNER_CASES))
+    boxes = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        for total, rule in PLANNER_CASES:
+            op_started = time.perf_counter()
+            quantities = plan_split(total, rule)
+            latencies.add(time.perf_counter() - op_started)
+            boxes += len(quantities)
+    elapsed = time.perf_counter() - started
+    return ScenarioResult('planner', iterations * len(PLANNER_CASES), elapsed, latencies,
+                          boxes_per_s=round(boxes / elapsed) if elapsed else 0)
+
+
+def random_split(rng, decimals, max_parts=5000):
+    """Totale e quantità casuali con decimals decimali la cui somma è esattamente il totale"""
+    parts = rng.randint(2, max_parts)
+    units = [rng.randint(1, 10 ** (decimals + 3)) for _ in range(parts)]
+    scale = Decimal(1).scaleb(-decimals)
+    return sum(units) * scale, [value * scale for value in units]
+
+
+def check_quantity_properties(rng, total, quantities, decimals):
+    """Verifica le proprietà di validate_split su uno split corretto; restituisce l'errore o None"""
+    # Le stesse quantità come testo con la virgola, float e Decimal: stesso risultato
+    mixed = [format_quantity(qty).replace('.', ',') if i % 3 == 0 else float(qty) if i % 3 == 1 else qty
+             for i, qty in enumerate(quantities)]
+    validated = validate_split(total, mixed, decimals)
+    if validated != quantities or sum(validated) != total:
+        return "quantità validate diverse da quelle di partenza"
+    if any(qty.as_tuple().exponent != -decimals or db_param(qty) is not qty for qty in validated):
+        return "scala dei parametri non uniforme"
+    if any(to_quantity(format_quantity(qty), decimals) != qty for qty in validated[:100]):
+        return "formato dell'etichetta non reversibile"
+
+    # Un'unità minima in più o in meno su una scatola qualsiasi deve essere rifiutata
+    changed = list(quantities)
+    index = rng.randrange(len(changed))
+    changed[index] += Decimal(rng.choice((1, -1))).scaleb(-decimals)
+    try:
+        validate_split(total, changed, decimals)
+    except ValueError:
+        pass
+    else:
+        return "differenza di un'unità minima non rilevata"
+
+    # Un decimale oltre la precisione dell'articolo deve essere rifiutato
+    if decimals < MAX_DECIMALS:
+        changed = list(quantities)
+        changed[index] += Decimal(5).scaleb(-decimals - 1)
+        changed[-1 if index != len(changed) - 1 else 0] -= Decimal(5).scaleb(-decimals - 1)
+        try:
+            validate_split(total, changed, decimals)
+        except ValueError:
+            pass
+        else:
+            return "decimali oltre la precisione non rilevati"
+    return None
+
+
+def scenario_quantities(iterations, seed):
+    """Validazione di iterations split casuali; errore se una proprietà non vale.
+
+    Riporta anche quante volte la vecchia somma in float avrebbe dato un
+    totale diverso da PackQty (confronto esatto di SplitService.validate_quantities).
+    """
+    rng = random.Random(seed)
+    latencies = LatencyHistogram(max_samples=iterations)
+    checked = float_mismatches = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        decimals = rng.randint(0, MAX_DECIMALS)
+        total, quantities = random_split(rng, decimals)
+        op_started = time.perf_counter()
+        error = check_quantity_properties(rng, total, quantities, decimals)
+        latencies.add(time.perf_counter() - op_started, error is not None)
+        if error:
+            print(f"Split di {len(quantities)} scatole con {decimals} decimali: {error}")
+        checked += len(quantities)
+        if sum(float(qty) for qty in quantities) != float(total):
+            float_mismatches += 1
+    elapsed = time.perf_counter() - started
+    return ScenarioResult('quantities', iterations, elapsed, latencies,
+                          quantities_per_s=round(checked / elapsed) if elapsed else 0,
+                          float_sum_mismatches=float_mismatches)
+
+
+def scenario_session(env, iterations, timeout, ways=10, group_size=25):
+    """Sessione multipla: iterations scatole scansionate, pianificate e confermate a gruppi"""
+    service = env.service()
+    session = SplitSession(service, group_size=group_size)
+    latencies = LatencyHistogram(max_samples=iterations)
+
+    started = time.perf_counter()
+    wall_started = time.time()
+    for batch_number in env.batch_numbers[:iterations]:
+        session.add(batch_number)
+    session.plan_all(boxes=ways)
+
+    # La latenza di ogni scatola è quella del gruppo in cui è stata scritta
+    pending = session.pending()
+    group_started = [time.perf_counter()]
+
+    def on_progress(done, total):
+        now = time.perf_counter()
+        for entry in pending[latencies.count:done]:
+            latencies.add(now - group_started[0], entry.status != DONE)
+        group_started[0] = now
+
+    done, failed, label_count = session.commit(BENCH_USER_ID, on_progress=on_progress)
+    elapsed = time.perf_counter() - started
+
+    received = wait_for_labels(env, label_count, timeout)
+    printed_in = (received[-1].received_at - wall_started) if received else 0.0
+    snapshot = metrics.snapshot()
+    return ScenarioResult(
+        'session', len(session), elapsed, latencies,
+        boxes_done=done,
+        boxes_failed=failed,
+        groups=snapshot.get('split.group', {}).get('count', 0),
+        db_batches=snapshot.get('db.split_group_batch', {}).get('count', 0),
+        labels_expected=label_count,
+        labels_received=len(received),
+        labels_per_s=round(len(received) / printed_in, 1) if printed_in else 0.0,
+        split_boxes=env.database.count('SplitBoxes'),
+        db_connections=env.database.connections_opened,
+    )
+
+
+def scenario_contention(env, iterations, workers, ways=3):
+    """Split concorrenti di scatole degli stessi documenti mentre alcune transazioni
+    vengono scelte come vittime di deadlock; alla fine controlla la coerenza del database"""
+    latencies = LatencyHistogram(max_samples=iterations)
+    lock = threading.Lock()
+    completed = []
+
+    def worker(index):
+        service = env.service()
+        # Ogni thread prende scatole alterne degli stessi documenti
+        for batch_number in env.batch_numbers[index:iterations:workers]:
+            op_started = time.perf_counter()
+            error = False
+            try:
+                data = service.find_batch(batch_number)
+                service.split(data, even_quantities(int(data.PackQty), ways), BENCH_USER_ID)
+                with lock:
+                    completed.append(batch_number)
+            except Exception as e:
+                print(f"Errore nello split di {batch_number}: {str(e)}")
+                error = True
+            with lock:
+                latencies.add(time.perf_counter() - op_started, error)
+
+    started = time.perf_counter()
+    run_threads(workers, worker)
+    elapsed = time.perf_counter() - started
+
+    snapshot = metrics.snapshot()
+    return ScenarioResult(
+        'contention', iterations, elapsed, latencies,
+        workers=workers,
+        deadlocks=env.database.deadlocks,
+        deadlock_retries=snapshot.get('db.deadlock_retry', {}).get('count', 0),
+        split_boxes=env.database.count('SplitBoxes'),
+        split_boxes_expected=len(completed) * (ways - 1),
+        **split_consistency(env, completed, ways),
+    )
+
+
+def split_consistency(env, completed, ways):
+    """Controlla il database dopo split concorrenti.
+
+    Uno split a metà altera la quantità totale del documento; uno split
+    perso o ripetuto lascia un numero sbagliato di scatole figlie. Le scatole
+    in completed devono avere ways - 1 figlie, le altre nessuna.
+    """
+    document_qty = env.boxes_per_document * BOX_QTY
+    unbalanced = env.database.query("""
+        SELECT d.incomingid FROM incomingdet d
+        GROUP BY d.incomingid HAVING ABS(SUM(d.Qty) - ?) > 0.001
+    """, document_qty)
+    duplicates = env.database.query("""
+        SELECT batchnumber FROM incomingdet GROUP BY batchnumber HAVING COUNT(*) > 1
+        UNION ALL
+        SELECT BatchNumber_HU FROM packing GROUP BY BatchNumber_HU HAVING COUNT(*) > 1
+    """)
+    children = {}
+    for (batch_number,) in env.database.query(
+            "SELECT BatchNumber_HU FROM packing WHERE PackingId > ?", len(env.batch_numbers)):
+        parent = batch_number.rsplit(env.split_writer.batch_separator, 1)[0]
+        children[parent] = children.get(parent, 0) + 1
+    done = set(completed)
+    lost = sum(max(0, (ways - 1 if batch_number in done else 0) - children.get(batch_number, 0))
+               for batch_number in env.batch_numbers)
+    extra = sum(max(0, count - (ways - 1 if parent in done else 0)) for parent, count in children.items())
+    return {
+        'unbalanced_documents': len(unbalanced),
+        'lost_children': lost,
+        'duplicate_children': len(duplicates) + extra,
+    }
+
+
+def scenario_procedure(env, iterations, ways=10):
+    """Split alternati tra batch SQL del client e procedura, sulla stessa base dati"""
+    writers = {'sql': SplitWriter(), 'procedure': ProcedureSplitWriter()}
+    services = {}
+    for mode, writer in writers.items():
+        services[mode] = env.service()
+        services[mode].split_writer = writer
+    latencies = {mode: LatencyHistogram(max_samples=iterations) for mode in writers}
+    all_latencies = LatencyHistogram(max_samples=iterations)
+
+    started = time.perf_counter()
+    for i, batch_number in enumerate(env.batch_numbers[:iterations]):
+        mode = 'sql' if i % 2 == 0 else 'procedure'
+        service = services[mode]
+        op_started = time.perf_counter()
+        error = False
+        try:
+            data = service.find_batch(batch_number)
+            service.save_split(data, even_quantities(int(data.PackQty), ways), BENCH_USER_ID)
+        except Exception as e:
+            print(f"Errore nello split di {batch_number} ({mode}): {str(e)}")
+            error = True
+        op_elapsed = time.perf_counter() - op_started
+        latencies[mode].add(op_elapsed, error)
+        all_latencies.add(op_elapsed, error)
+    elapsed = time.perf_counter() - started
+
+    # Testo SQL e parametri inviati per uno split (la procedura riceve solo id e quantità)
+    sample = services['sql'].find_batch(env.batch_numbers[iterations]) if iterations < len(env.batch_numbers) else None
+    extra = {}
+    for mode, histogram in latencies.items():
+        summary = histogram.summary()
+        extra[f"{mode}_p50_ms"] = round(summary['p50_ms'], 2)
+        extra[f"{mode}_p95_ms"] = round(summary['p95_ms'], 2)
+    if sample is not None:
+        quantities = even_quantities(int(sample.PackQty), ways)
+        sql, params = writers['sql']._build_batch(sample, quantities[0], f"1 x {sample.PackQty}",
+                                                  [(f"{sample.BatchNumber_HU}-{i}", qty)
+                                                   for i, qty in enumerate(quantities[1:], 1)],
+                                                  BENCH_USER_ID, include_parent_update=True)
+        extra['sql_request_chars'] = len(sql) + sum(len(str(param)) for param in params)
+        extra['procedure_request_chars'] = sum(
+            len(str(param)) for param in writers['procedure'].call_params(sample, quantities, BENCH_USER_ID))
+    return ScenarioResult(
+        'procedure', iterations, elapsed, all_latencies,
+        split_boxes=env.database.count('SplitBoxes'),
+        split_boxes_expected=(iterations - all_latencies.errors) * (ways - 1),
+        **extra,
+    )
+
+
+def scenario_offline(env, iterations, timeout, ways=2):
+    """Split con il server non raggiungibile: ricerca sulla copia locale, coda e invio successivo"""
+    cache = LocalCache(os.path.join(env.work_dir, 'local_cache.db'))
+    service = env.service()
+    service.local_cache = cache
+    sync_started = time.perf_counter()
+    cached_rows = service.db_connection.run(cache.sync)
+    sync_elapsed = time.perf_counter() - sync_started
+
+    env.database.set_offline()
+    latencies = LatencyHistogram(max_samples=iterations)
+    queued = 0
+    started = time.perf_counter()
+    for batch_number in env.batch_numbers[:iterations]:
+        op_started = time.perf_counter()
+        error = False
+        try:
+            data = service.find_batch(batch_number)
+            service.split(data, even_quantities(int(data.PackQty), ways), BENCH_USER_ID)
+            print(f"Split di {batch_number} scritto con il server offline")
+            error = True
+        except SplitQueued:
+            queued += 1
+        except Exception as e:
+            print(f"Errore nello split di {batch_number}: {str(e)}")
+            error = True
+        latencies.add(time.perf_counter() - op_started, error)
+    elapsed = time.perf_counter() - started
+    labels_held = env.outbox.count(HELD)
+
+    env.database.set_offline(False)
+    replay_started = time.perf_counter()
+    replayed, rejected = service.replay_pending()
+    replay_elapsed = time.perf_counter() - replay_started
+    # Un secondo invio non deve duplicare nulla
+    service.replay_pending()
+    received = wait_for_labels(env, replayed * ways, timeout)
+    cache.close()
+    return ScenarioResult(
+        'offline', iterations, elapsed, latencies,
+        cached_rows=cached_rows,
+        sync_ms=round(sync_elapsed * 1000, 1),
+        cache_hits=cache.hits,
+        queued=queued,
+        labels_held=labels_held,
+        replayed=replayed,
+        rejected=rejected,
+        replay_ms=round(replay_elapsed * 1000, 1),
+        split_boxes=env.database.count('SplitBoxes'),
+        split_boxes_expected=replayed * (ways - 1),
+        labels_received=len(received),
+    )
+
+
+def scenario_printer_fault(env, iterations, timeout, ways=10, fault_time=1.0):
+    """Split con la stampante in errore (carta esaurita) per fault_time secondi a metà serie"""
+    # La stampante simulata accetta più connessioni: lo stato viaggia sulla porta di stampa
+    monitor = attach_status_monitor(env.printer, {'status_port': env.printer.port}, interval=0.05)
+    env.drainer.watch(monitor)
+    monitor.wait_for_update(0, 2)
+    service = env.service()
+    latencies = LatencyHistogram(max_samples=iterations)
+    released = 0
+
+    started = time.perf_counter()
+    fault_started = None
+    for i, batch_number in enumerate(env.batch_numbers[:iterations]):
+        if i == iterations // 2:
+            # Le etichette della prima metà vengono stampate prima del guasto
+            env.fake_printer.wait_for(released * ways, timeout)
+            env.fake_printer.set_fault('paper_out')
+            fault_started = time.time()
+            monitor.wait_for_update(fault_started, 2)
+        op_started = time.perf_counter()
+        error = False
+        try:
+            data = service.find_batch(batch_number)
+            service.split(data, even_quantities(int(data.PackQty), ways), BENCH_USER_ID)
+            released += 1
+        except Exception as e:
+            print(f"Errore nello split di {batch_number}: {str(e)}")
+            error = True
+        latencies.add(time.perf_counter() - op_started, error)
+    elapsed = time.perf_counter() - started
+
+    if fault_started is not None:
+        time.sleep(max(0.0, fault_started + fault_time - time.time()))
+    held_during_fault = env.outbox.count(PENDING)
+    cleared_at = time.time()
+    env.fake_printer.set_fault(None)
+    received = wait_for_labels(env, released * ways, timeout)
+    resumed = [label.received_at for label in received if label.received_at >= cleared_at]
+    monitor.stop(timeout=1)
+    status_reads = metrics.snapshot().get('printer.status_monitor', {})
+    return ScenarioResult(
+        'printer_fault', iterations, elapsed, latencies,
+        labels_expected=released * ways,
+        labels_received=len(received),
+        labels_during_fault=env.fake_printer.labels_during_fault,
+        labels_held_during_fault=held_during_fault,
+        resume_ms=round((min(resumed) - cleared_at) * 1000, 1) if resumed else None,
+        status_reads=status_reads.get('count', 0),
+        status_p50_ms=round(status_reads.get('p50_ms', 0.0), 2),
+    )
+
+
+SCENARIOS = ('split_2', 'split_10', 'split_100', 'burst_scan', 'reconnect_storm', 'planner', 'session',
+             'contention', 'procedure', 'offline', 'printer_fault', 'quantities')
+
+
+def run_scenario(name, args):
+    if name == 'planner':
+        metrics.reset()
+        return scenario_planner(args.iterations)
+    if name == 'quantities':
+        metrics.reset()
+        return scenario_quantities(args.iterations, args.seed)
+    drop_rate = args.drop_rate if name == 'reconnect_storm' else 0.0
+    deadlock_rate = args.deadlock_rate if name == 'contention' else 0.0
+    env = BenchEnvironment(args, drop_rate=drop_rate, deadlock_rate=deadlock_rate)
+    metrics.reset()
+    queries.reset_stats()
+    try:
+        if name.startswith('split_'):
+            ways = int(name.split('_')[1])
+            return scenario_split(env, ways, args.iterations, args.print_timeout)
+        if name == 'burst_scan':
+            return scenario_burst_scan(env, args.iterations * 10, args.workers)
+        if name == 'session':
+            return scenario_session(env, args.iterations, args.print_timeout)
+        if name == 'contention':
+            return scenario_contention(env, args.iterations, args.workers)
+        if name == 'procedure':
+            return scenario_procedure(env, args.iterations)
+        if name == 'offline':
+            return scenario_offline(env, args.iterations, args.print_timeout)
+        if name == 'printer_fault':
+            return scenario_printer_fault(env, args.iterations, args.print_timeout)
+        return scenario_reconnect_storm(env, args.iterations, args.workers,
+                                        args.kill_interval, args.print_timeout)
+    finally:
+        env.close()
+
+
+def format_result(result):
+    row = result.as_dict()
+    head = (f"{row['scenario']:<16} {row['ops']:>6} op  {row['ops_per_s']:>8.1f} op/s  "
+            f"p50 {row['p50_ms']:>7.2f}  p95 {row['p95_ms']:>7.2f}  p99 {row['p99_ms']:>7.2f} ms  "
+            f"errori {row['errors']}")
+    extra = ", ".join(f"{key}={value}" for key, value in result.extra.items())
+    return f"{head}\n{'':<16} {extra}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark dello split con database e stampante simulati")
+    parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                        help="Scenario da eseguire (ripetibile; predefinito: tutti)")
+    parser.add_argument('--iterations', type=int, default=100, help="Split per scenario")
+    parser.add_argument('--workers', type=int, default=4,
+                        help="Thread concorrenti (burst_scan, reconnect_storm, contention)")
+    parser.add_argument('--pool-size', type=int, default=5, help="Connessioni massime del pool")
+    parser.add_argument('--db-latency', type=float, default=0.0, help="Secondi aggiunti a ogni query")
+    parser.add_argument('--connect-latency', type=float, default=0.05, help="Secondi per aprire una connessione")
+    parser.add_argument('--print-time', type=float, default=0.0, help="Secondi di stampa per etichetta")
+    parser.add_argument('--drop-rate', type=float, default=0.01,
+                        help="Probabilità di caduta della connessione stampante (reconnect_storm)")
+    parser.add_argument('--kill-interval', type=float, default=0.05,
+                        help="Secondi tra le cadute delle sessioni DB (reconnect_storm)")
+    parser.add_argument('--deadlock-rate', type=float, default=0.05,
+                        help="Probabilità che un'istruzione in transazione sia vittima di deadlock (contention)")
+    parser.add_argument('--split-mode', choices=SPLIT_MODES, default='sql',
+                        help="Scrittura degli split negli altri scenari: batch SQL (sql) o procedura")
+    parser.add_argument('--print-timeout', type=float, default=60,
+                        help="Secondi di attesa per la ricezione delle etichette")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="Salva i risultati in un file JSON")
+    parser.add_argument('--details', action='store_true', help="Mostra anche le metriche interne per scenario")
+    parser.add_argument('--verbose', action='store_true', help="Mostra i messaggi dell'applicazione")
+    args = parser.parse_args()
+
+    # Le misure del benchmark non finiscono in metrics.log
+    metrics.log_file = None
+
+    results = []
+    for name in args.scenario or SCENARIOS:
+        output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            result = run_scenario(name, args)
+            details = metrics.snapshot()
+        results.append(result)
+        print(format_result(result))
+        if args.details:
+            for metric, stats in details.items():
+                print(f"{'':<16} {metric:<28} n={stats['count']:<6} p50 {stats['p50_ms']:.2f} "
+                      f"p95 {stats['p95_ms']:.2f} p99 {stats['p99_ms']:.2f} ms")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump([result.as_dict() for result in results], f, indent=2)
+    failed = [result.name for result in results if result.failed]
+    if failed:
+        print(f"Scenari non riusciti: {', '.join(failed)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,5 +1,4 @@
 # config_manager.py
-from cryptography.fernet import Fernet
 import json
 import os
 
@@ -8,9 +7,13 @@ class ConfigManager:
     def __init__(self, key_file='encryption_key.key', config_file='db_config.enc'):
         self.key_file = key_file
         self.config_file = config_file
+        # Configurazione decrittata e firma (mtime, dimensione) dei file da cui deriva
+        self._cached_config = None
+        self._cached_signature = None
 
     def generate_key(self):
         """Genera una chiave di crittografia e la salva in un file"""
+        from cryptography.fernet import Fernet
         key = Fernet.generate_key()
         with open(self.key_file, 'wb') as key_file:
             key_file.write(key)
@@ -32,6 +35,7 @@ class ConfigManager:
             'password': password
         }
 
+        from cryptography.fernet import Fernet
         key = self.load_key()
         f = Fernet(key)
         encrypted_config = f.encrypt(json.dumps(config).encode())
@@ -39,11 +43,35 @@ class ConfigManager:
         with open(self.config_file, 'wb') as config_file:
             config_file.write(encrypted_config)
 
+        self._cached_config = None
+        self._cached_signature = None
+
+    def _file_signature(self):
+        """Firma dei file di chiave e configurazione usata per invalidare la cache"""
+        signature = []
+        for path in (self.key_file, self.config_file):
+            stat = os.stat(path)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        return tuple(signature)
+
     def load_config(self):
-        """Carica e decritta le credenziali del database"""
+        """Carica e decritta le credenziali del database.
+
+        Il risultato resta in cache finché i file di chiave e configurazione
+        non cambiano; il dizionario restituito non va modificato.
+        """
         if not os.path.exists(self.config_file):
             raise FileNotFoundError("File di configurazione non trovato")
 
+        if not os.path.exists(self.key_file):
+            self.generate_key()
+
+        signature = self._file_signature()
+        if self._cached_config is not None and signature == self._cached_signature:
+            return self._cached_config
+
+        # Import differito: cryptography rallenta l'avvio dell'eseguibile
+        from cryptography.fernet import Fernet
         key = self.load_key()
         f = Fernet(key)
 
@@ -51,4 +79,6 @@ class ConfigManager:
             encrypted_config = config_file.read()
 
         decrypted_config = f.decrypt(encrypted_config)
-        return json.loads(decrypted_config)
+        self._cached_config = json.loads(decrypted_config)
+        self._cached_signature = signature
+        return self._cached_config
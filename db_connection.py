@@ -1,91 +1,448 @@
 # db_connection.py
+import random
+import threading
+import time
+from contextlib import contextmanager
+
 import pyodbc
 
+from metrics import metrics, timer, timed
+from query_registry import QueryRegistry, queries
+
+# Errore di SQL Server per la transazione scelta come vittima di un deadlock
+DEADLOCK_ERROR = 1205
+
+# Driver ODBC risolto al primo utilizzo e stringa di connessione costruita
+# per l'ultima configurazione caricata
+_resolved_driver = None
+_connection_string_cache = (None, None)
+
+
+def resolve_driver():
+    """Restituisce il primo driver SQL Server disponibile (calcolato una sola volta)"""
+    global _resolved_driver
+    if _resolved_driver is not None:
+        return _resolved_driver
+
+    # Lista dei possibili driver da provare
+    drivers = [
+        'ODBC Driver 18 for SQL Server',
+        'ODBC Driver 17 for SQL Server',
+        'SQL Server',
+        'SQL Server Native Client 11.0'
+    ]
+
+    # Trova il primo driver disponibile
+    available_drivers = pyodbc.drivers()
+    for d in drivers:
+        if d in available_drivers:
+            _resolved_driver = d
+            return d
+
+    raise Exception("Nessun driver SQL Server trovato. Installa un driver ODBC per SQL Server.")
+
+
+def build_connection_string(config_manager):
+    """Costruisce la stringa di connessione, riutilizzandola se la configurazione non è cambiata"""
+    global _connection_string_cache
+    config = config_manager.load_config()
+    cached_config, cached_conn_str = _connection_string_cache
+    if cached_config is config:
+        return cached_conn_str
+
+    driver = resolve_driver()
+    #print(f"Utilizzo del driver: {driver}")
+
+    conn_str = (
+        f"DRIVER={{{driver}}};"
+        f"SERVER={config['server']};"
+        f"DATABASE={config['database']};"
+        f"UID={config['username']};"
+        f"PWD={config['password']};"
+        "Trusted_Connection=no;"
+        "TrustServerCertificate=yes;"
+        "Encrypt=yes;"
+        "Connection Timeout=30;"
+        "Mars_Connection=yes;"  # Aggiunto per gestire meglio le connessioni multiple
+    )
+    _connection_string_cache = (config, conn_str)
+    return conn_str
+
+
+def is_deadlock(error):
+    """Verifica se l'errore pyodbc indica una transazione vittima di deadlock (1205)"""
+    state = error.args[0] if error.args else ''
+    return state == '40001' or f"({DEADLOCK_ERROR})" in str(error)
+
+
+def is_connection_lost(error):
+    """Verifica se l'errore pyodbc indica la caduta della connessione (SQLSTATE 08xxx)"""
+    state = error.args[0] if error.args else ''
+    return isinstance(state, str) and state.startswith('08')
+
+
+def is_offline_error(error):
+    """Verifica se l'errore indica che il server non è raggiungibile (connessione caduta o scaduta)"""
+    if not isinstance(error, pyodbc.Error):
+        return False
+    state = error.args[0] if error.args else ''
+    return is_connection_lost(error) or state in ('HYT00', 'HYT01')
+
+
+def failed_during_commit(error):
+    """True se error è stato sollevato dal COMMIT di transaction() (esito della transazione incerto)"""
+    return getattr(error, 'during_commit', False)
+
+
+def open_connection(config_manager):
+    """Apre una nuova connessione fisica al database usando le credenziali crittografate"""
+    conn_str = build_connection_string(config_manager)
+
+    try:
+        with timer('db.connect'):
+            connection = pyodbc.connect(conn_str)
+        connection.autocommit = True  # Aggiunto per evitare problemi di transazioni pendenti
+        print("Connessione stabilita con successo!")
+        return connection
+    except pyodbc.Error as e:
+        print(f"Errore durante la connessione: {str(e)}")
+        raise
+
+
+# QueryRegistry sta in query_registry (senza pyodbc) perché i moduli che
+# registrano le istruzioni vengono importati anche prima della connessione
+PING = queries.register('ping', "SELECT 1")
+# Verifica delle credenziali e dati dell'utente in un solo round trip
+AUTHENTICATE = queries.register('authenticate', """
+    SELECT UserId, Name, [Name] AS Username
+    FROM [WarehouseNEW].[dbo].[User]
+    WHERE Name = ? AND Password = ?
+""")
+
+
+class ConnectionPool:
+    """Pool di connessioni condiviso da tutte le finestre dell'applicazione.
+
+    Le connessioni restituite con release() restano aperte e vengono
+    riutilizzate, evitando handshake TLS e login a ogni operazione. Una
+    connessione rimasta inattiva più di validate_after secondi viene
+    verificata con una query leggera prima di essere riconsegnata; quelle
+    non più valide vengono chiuse e sostituite in modo trasparente.
+    """
+
+    def __init__(self, factory, min_size=1, max_size=5, idle_timeout=600,
+                 validate_after=30, acquire_timeout=30):
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.validate_after = validate_after
+        self.acquire_timeout = acquire_timeout
+        self._idle = []  # lista di (connessione, istante dell'ultimo utilizzo)
+        self._in_use = set()
+        self._opening = 0  # connessioni in fase di apertura fuori dal lock
+        self._condition = threading.Condition()
+
+    @property
+    def size(self):
+        with self._condition:
+            return len(self._idle) + len(self._in_use) + self._opening
+
+    def acquire(self, validate=False):
+        """Prende in prestito una connessione valida dal pool.
+
+        Con validate=True anche le connessioni usate da poco vengono
+        verificate: serve dopo una caduta, quando le altre sessioni inattive
+        possono essere cadute insieme a quella che ha dato errore.
+        """
+        deadline = time.time() + self.acquire_timeout
+        while True:
+            with self._condition:
+                self._evict_idle_locked()
+                if self._idle:
+                    connection, last_used = self._idle.pop()
+                    self._in_use.add(connection)
+                elif len(self._in_use) + self._opening < self.max_size:
+                    connection, last_used = None, None
+                    # Riserva il posto mentre la connessione viene aperta fuori dal lock
+                    self._opening += 1
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        raise Exception("Nessuna connessione disponibile nel pool")
+                    self._condition.wait(remaining)
+                    continue
+
+            if connection is None:
+                return self._open_reserved()
+
+            if (not validate and time.time() - last_used < self.validate_after) or self.ping(connection):
+                return connection
+
+            # Connessione non più valida: viene chiusa e sostituita
+            print("Connessione al database scaduta, riconnessione in corso...")
+            self.release(connection, discard=True)
+
+    def _open_reserved(self):
+        try:
+            connection = self.factory()
+        except Exception:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opening -= 1
+            self._in_use.add(connection)
+        return connection
+
+    def release(self, connection, discard=False):
+        """Restituisce una connessione al pool; con discard=True la chiude"""
+        if not discard:
+            try:
+                if not connection.autocommit:
+                    connection.rollback()
+                    connection.autocommit = True
+            except pyodbc.Error:
+                discard = True
+
+        with self._condition:
+            self._in_use.discard(connection)
+            if not discard:
+                self._idle.append((connection, time.time()))
+            self._condition.notify()
+
+        if discard:
+            self._close(connection)
+
+    @contextmanager
+    def connection(self):
+        """Context manager: prende una connessione e la restituisce al termine"""
+        connection = self.acquire()
+        try:
+            yield connection
+        except pyodbc.Error:
+            self.release(connection, discard=not self.ping(connection))
+            raise
+        except Exception:
+            self.release(connection)
+            raise
+        else:
+            self.release(connection)
+
+    def warm(self):
+        """Apre in anticipo min_size connessioni"""
+        connections = []
+        try:
+            while self.size < self.min_size:
+                connections.append(self.acquire())
+        finally:
+            for connection in connections:
+                self.release(connection)
+
+    @staticmethod
+    def ping(connection):
+        """Verifica che la sessione sul server sia ancora attiva"""
+        try:
+            queries.fetchone(connection, PING)
+            return True
+        except pyodbc.Error:
+            return False
+
+    def _evict_idle_locked(self):
+        now = time.time()
+        keep = []
+        total = len(self._idle) + len(self._in_use) + self._opening
+        for connection, last_used in self._idle:
+            if now - last_used > self.idle_timeout and total > self.min_size:
+                self._close(connection)
+                total -= 1
+            else:
+                keep.append((connection, last_used))
+        self._idle = keep
+
+    def close_all(self):
+        """Chiude tutte le connessioni inattive"""
+        with self._condition:
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._close(connection)
+
+    @staticmethod
+    def _close(connection):
+        queries.forget(connection)
+        try:
+            connection.close()
+        except Exception as e:
+            print(f"Errore durante la chiusura della connessione: {str(e)}")
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(config_manager):
+    """Restituisce il pool di connessioni condiviso dal processo"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(lambda: open_connection(config_manager))
+        return _pool
+
 
 class DatabaseConnection:
-    def __init__(self, config_manager):
+    # Tentativi e attesa iniziale (raddoppiata a ogni tentativo) dopo un deadlock
+    DEADLOCK_RETRIES = 3
+    DEADLOCK_BACKOFF = 0.1
+    # Tentativi di run() con una nuova connessione verificata dopo una caduta
+    RECONNECT_RETRIES = 3
+
+    def __init__(self, config_manager, pool=None):
         self.config_manager = config_manager
+        self.pool = pool or get_pool(config_manager)
         self.connection = None
 
-    def verify_credentials(self, username, password):
+    @timed('db.authenticate')
+    def authenticate(self, username, password):
+        """Verifica le credenziali; restituisce la riga (UserId, Name, Username) o None"""
         try:
-            cursor = self.connection.cursor()  # Usa self.connection invece di self
-            cursor.execute("""
-                SELECT UserId, Name 
-                FROM [WarehouseNEW].[dbo].[User] 
-                WHERE Name = ? AND Password = ?
-            """, (username, password))
-            row = cursor.fetchone()
-            return True if row else False
+            return queries.fetchone(self.connect(), AUTHENTICATE, username, password)
         except Exception as e:
             raise Exception(f"Errore durante la verifica delle credenziali: {str(e)}")
 
+    def fetchone(self, name, *params):
+        """Esegue l'istruzione registrata name sulla connessione corrente"""
+        return queries.fetchone(self.connect(), name, *params)
+
+    def fetchall(self, name, *params):
+        return queries.fetchall(self.connect(), name, *params)
+
     def connect(self):
-        """Crea una connessione al database usando le credenziali crittografate"""
+        """Prende in prestito una connessione dal pool condiviso"""
         if self.connection is not None:
             return self.connection
 
-        config = self.config_manager.load_config()
-
-        # Lista dei possibili driver da provare
-        drivers = [
-            'ODBC Driver 18 for SQL Server',
-            'ODBC Driver 17 for SQL Server',
-            'SQL Server',
-            'SQL Server Native Client 11.0'
-        ]
-
-        # Trova il primo driver disponibile
-        driver = None
-        available_drivers = pyodbc.drivers()
-        for d in drivers:
-            if d in available_drivers:
-                driver = d
-                break
-
-        if driver is None:
-            raise Exception("Nessun driver SQL Server trovato. Installa un driver ODBC per SQL Server.")
-
-        #print(f"Utilizzo del driver: {driver}")
-
-        conn_str = (
-            f"DRIVER={{{driver}}};"
-            f"SERVER={config['server']};"
-            f"DATABASE={config['database']};"
-            f"UID={config['username']};"
-            f"PWD={config['password']};"
-            "Trusted_Connection=no;"
-            "TrustServerCertificate=yes;"
-            "Encrypt=yes;"
-            "Connection Timeout=30;"
-            "Mars_Connection=yes;"  # Aggiunto per gestire meglio le connessioni multiple
-        )
-
-        try:
-            self.connection = pyodbc.connect(conn_str)
-            self.connection.autocommit = True  # Aggiunto per evitare problemi di transazioni pendenti
-            print("Connessione stabilita con successo!")
-            return self.connection
-        except pyodbc.Error as e:
-            print(f"Errore durante la connessione: {str(e)}")
-            raise
+        self.connection = self.pool.acquire()
+        return self.connection
 
     def is_connected(self):
         """Verifica se la connessione al database è attiva"""
         if self.connection:
-            try:
-                self.connection.cursor()
+            if self.pool.ping(self.connection):
                 return True
-            except pyodbc.Error:
-                return False
+            # Sessione caduta: la connessione viene scartata e sarà sostituita da connect()
+            self.pool.release(self.connection, discard=True)
+            self.connection = None
         return False
 
+    def run(self, operation):
+        """Esegue operation(connection) in sola lettura con una connessione del pool.
+
+        La connessione è presa in prestito solo per l'operazione: quella
+        eventualmente aperta con connect() resta al chiamante. Se la
+        connessione risulta caduta viene scartata e l'operazione ripetuta con
+        una connessione verificata, fino a RECONNECT_RETRIES volte.
+        """
+        lost = False
+        for attempt in range(self.RECONNECT_RETRIES + 1):
+            connection = self.pool.acquire(validate=lost)
+            try:
+                result = operation(connection)
+            except pyodbc.Error:
+                lost = not self.pool.ping(connection)
+                self.pool.release(connection, discard=lost)
+                if not lost or attempt == self.RECONNECT_RETRIES:
+                    raise
+                print("Connessione al database persa, nuovo tentativo...")
+                continue
+            except BaseException:
+                self.pool.release(connection)
+                raise
+            self.pool.release(connection)
+            return result
+
+    @contextmanager
+    def transaction(self, validate=False):
+        """Unità di lavoro: COMMIT all'uscita senza errori, altrimenti ROLLBACK.
+
+        Le connessioni del pool sono in autocommit: qui l'autocommit viene
+        disattivato, così il driver apre la transazione alla prima istruzione
+        e tutte le scritture del blocco vengono confermate o annullate
+        insieme. Con XACT_ABORT un errore a metà batch annulla l'intera
+        transazione anche sul server. La connessione torna al pool al
+        termine, di nuovo in autocommit e con XACT_ABORT disattivato, così
+        le letture successive sulla stessa sessione non ne risentono. Come run(), non usa la connessione
+        aperta con connect(); validate=True la verifica prima dell'uso.
+
+        Un errore sollevato dal COMMIT viene marcato (failed_during_commit):
+        la fase è legata alla singola chiamata, non all'istanza condivisa tra
+        i thread.
+        """
+        with timer('db.acquire'):
+            connection = self.pool.acquire(validate=validate)
+        committing = False
+        lost = False
+        try:
+            connection.autocommit = False
+            connection.execute("SET XACT_ABORT ON")
+            yield connection
+            committing = True
+            with timer('db.commit'):
+                connection.commit()
+        except BaseException as e:
+            if committing:
+                e.during_commit = True
+            try:
+                connection.rollback()
+            except pyodbc.Error as e:
+                print(f"Errore durante il rollback: {str(e)}")
+                lost = True
+            raise
+        finally:
+            if not lost:
+                try:
+                    connection.autocommit = True
+                    connection.execute("SET XACT_ABORT OFF")
+                except pyodbc.Error:
+                    # Sessione non ripristinabile: meglio chiuderla che riusarla con XACT_ABORT attivo
+                    lost = True
+            self.pool.release(connection, discard=lost)
+
+    def run_in_transaction(self, operation, retries=None, backoff=None):
+        """Esegue operation(connection) in una transazione e ne restituisce il risultato.
+
+        Se SQL Server sceglie la transazione come vittima di un deadlock
+        (1205), o la connessione cade prima del commit, la transazione è già
+        stata annullata e viene ripetuta da capo dopo un'attesa crescente.
+        """
+        retries = self.DEADLOCK_RETRIES if retries is None else retries
+        backoff = self.DEADLOCK_BACKOFF if backoff is None else backoff
+        lost = False
+        for attempt in range(retries + 1):
+            try:
+                with self.transaction(validate=lost) as connection:
+                    return operation(connection)
+            except pyodbc.Error as e:
+                deadlock = is_deadlock(e)
+                # Se la connessione cade durante il commit l'esito è incerto: niente nuovo tentativo
+                lost = is_connection_lost(e) and not failed_during_commit(e)
+                if attempt == retries or not (deadlock or lost):
+                    raise
+                delay = backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                metrics.record('db.deadlock_retry' if deadlock else 'db.reconnect_retry', delay)
+                reason = "Deadlock" if deadlock else "Connessione persa"
+                print(f"{reason} durante la transazione, nuovo tentativo tra {delay:.2f} s...")
+                time.sleep(delay)
+
+    def commit_uncertain(self, error):
+        """True se error è la caduta della connessione durante il commit di run_in_transaction"""
+        return isinstance(error, pyodbc.Error) and is_connection_lost(error) and failed_during_commit(error)
+
     def disconnect(self):
-        """Chiude la connessione al database"""
+        """Restituisce la connessione al pool"""
         try:
             if self.connection:
-                if not self.connection.closed:
-                    self.connection.close()
+                self.pool.release(self.connection)
                 self.connection = None
         except Exception as e:
             print(f"Errore durante la chiusura della connessione: {str(e)}")
@@ -0,0 +1,383 @@
+# local_cache.py
+"""Copia locale (SQLite) dei dati usati dallo split.
+
+Tiene articoli, ubicazioni e le righe packing degli ultimi documenti
+incoming, così le scansioni vengono risolte sul disco della postazione
+anche quando il collegamento con il server si interrompe. La copia viene
+aggiornata a intervalli:
+  - con la colonna rowversion SyncVersion (sql/local_cache_rowversion.sql)
+    arrivano solo le righe modificate dopo l'ultimo allineamento;
+  - senza, arrivano le righe nuove (PackingId crescente) e ogni
+    full_refresh secondi la finestra dei documenti viene ricaricata.
+Gli split salvati mentre il server non è raggiungibile vengono accodati
+in pending_writes e inviati al ripristino della connessione; le loro
+etichette restano sospese nella coda di stampa fino all'invio.
+"""
+import json
+import sqlite3
+import threading
+import time
+
+from batch_index import BATCH_SEARCH_SELECT
+from batch_record import BATCH_FIELDS, BatchRecord
+from query_registry import queries
+from quantities import format_quantity
+from split_planner import to_decimal
+
+# Stati di uno split accodato
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+# Versione dello schema (PRAGMA user_version): la 2 tiene le quantità come testo
+# decimale e i valori di sync_state con il loro tipo
+SCHEMA_VERSION = 2
+
+CACHE_ITEMS = queries.register('cache_items', "SELECT itemid, Code FROM dbo.item WHERE itemid > ?")
+CACHE_LOCATIONS = queries.register('cache_locations',
+                                   "SELECT locationid, Code FROM dbo.Location WHERE locationid > ?")
+CACHE_LAST_DOCUMENT = queries.register('cache_last_document',
+                                       "SELECT MAX(IncomingId) AS MaxId FROM dbo.incoming")
+CACHE_NEW_ROWS = queries.register('cache_new_rows', BATCH_SEARCH_SELECT + """
+    WHERE i.IncomingId > ? AND p.PackingId > ?
+""")
+CACHE_HAS_ROWVERSION = queries.register('cache_has_rowversion', """
+    SELECT COL_LENGTH('dbo.packing', 'SyncVersion') AS PackingVersion,
+           COL_LENGTH('dbo.incomingdet', 'SyncVersion') AS DetVersion
+""")
+CACHE_VERSION = queries.register('cache_version',
+                                 "SELECT CAST(MIN_ACTIVE_ROWVERSION() AS BIGINT) AS Version")
+CACHE_CHANGED_ROWS = queries.register('cache_changed_rows', BATCH_SEARCH_SELECT + """
+    WHERE i.IncomingId > ?
+      AND (p.SyncVersion >= CAST(? AS BINARY(8)) OR id.SyncVersion >= CAST(? AS BINARY(8)))
+""")
+
+
+class SplitQueued(Exception):
+    """Il server non è raggiungibile: lo split è stato accodato e verrà inviato più tardi"""
+
+
+class LocalCache:
+    """Archivio SQLite della postazione: dati anagrafici, righe packing e split da inviare"""
+
+    def __init__(self, db_file='local_cache.db', documents=2000, full_refresh=600):
+        self.db_file = db_file
+        self.documents = documents          # documenti incoming più recenti tenuti in locale
+        self.full_refresh = full_refresh    # secondi tra due ricariche complete (senza rowversion)
+        self.rowversion = None              # rilevato al primo allineamento
+        self.online = None                  # ultimo stato noto del server (None: non ancora verificato)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+            # Le righe e lo stato dell'allineamento si riscaricano dal server;
+            # gli split da inviare (pending_writes) restano
+            self._conn.executescript("DROP TABLE IF EXISTS batches; DROP TABLE IF EXISTS sync_state;")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS items (
+                itemid INTEGER PRIMARY KEY,
+                Code TEXT
+            );
+            CREATE TABLE IF NOT EXISTS locations (
+                locationid INTEGER PRIMARY KEY,
+                Code TEXT
+            );
+            -- PackingId negativo: scatola creata da uno split non ancora riletto dal server
+            CREATE TABLE IF NOT EXISTS batches (
+                PackingId INTEGER PRIMARY KEY,
+                incomingid INTEGER NOT NULL,
+                incomingdetid INTEGER NOT NULL,
+                number TEXT,
+                itemid INTEGER,
+                BatchNumber_HU TEXT NOT NULL,
+                -- Quantità come testo decimale (format_quantity): nessun arrotondamento binario
+                PackQty TEXT,
+                IncomingQty TEXT,
+                locationid INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS ix_batches_batch ON batches (BatchNumber_HU);
+            CREATE INDEX IF NOT EXISTS ix_batches_incoming ON batches (incomingid);
+            -- value senza tipo: la rowversion e gli id restano interi, last_full resta un istante
+            CREATE TABLE IF NOT EXISTS sync_state (
+                name TEXT PRIMARY KEY,
+                value NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS pending_writes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                split_key TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                created_at REAL NOT NULL
+            );
+        """)
+        self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params)
+
+    def _state(self, name, default=0):
+        rows = self._query("SELECT value FROM sync_state WHERE name = ?", (name,))
+        return rows[0][0] if rows else default
+
+    # --- Ricerca -------------------------------------------------------------
+
+    def lookup(self, batch_number):
+        """Restituisce la riga del batch dalla copia locale, o None"""
+        rows = self._query("""
+            SELECT b.incomingid, b.incomingdetid, b.number, b.itemid, i.Code, b.BatchNumber_HU,
+                   b.PackQty, b.IncomingQty, b.locationid, l.Code, b.PackingId
+            FROM batches b
+            LEFT JOIN items i ON i.itemid = b.itemid
+            LEFT JOIN locations l ON l.locationid = b.locationid
+            WHERE b.BatchNumber_HU = ?
+            ORDER BY b.PackingId
+            LIMIT 1
+        """, (batch_number,))
+        if not rows:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return BatchRecord(*rows[0])
+
+    # --- Allineamento con il server ------------------------------------------
+
+    def _detect_rowversion(self, connection):
+        try:
+            row = queries.fetchone(connection, CACHE_HAS_ROWVERSION)
+            return bool(row and row.PackingVersion and row.DetVersion)
+        except Exception as e:
+            print(f"Verifica della colonna SyncVersion non riuscita: {str(e)}")
+            return False
+
+    def sync(self, connection, full=False):
+        """Scarica dal server le righe nuove o modificate; restituisce il numero di righe ricevute"""
+        if self.rowversion is None:
+            self.rowversion = self._detect_rowversion(connection)
+        last_full = self._state('last_full')
+        full = full or not last_full or (not self.rowversion and time.time() - last_full > self.full_refresh)
+
+        # Per articoli e ubicazioni bastano quelli nuovi: le righe packing portano comunque i codici
+        items = queries.fetchall(connection, CACHE_ITEMS, 0 if full else int(self._state('max_item')))
+        locations = queries.fetchall(connection, CACHE_LOCATIONS,
+                                     0 if full else int(self._state('max_location')))
+        last_document = queries.fetchone(connection, CACHE_LAST_DOCUMENT)
+        first_document = max(0, (last_document.MaxId or 0) - self.documents)
+
+        # Il limite va letto prima delle righe: le transazioni ancora aperte restano per il prossimo giro
+        version = queries.fetchone(connection, CACHE_VERSION).Version if self.rowversion else None
+        if full:
+            rows = queries.fetchall(connection, CACHE_NEW_ROWS, first_document, 0)
+        elif self.rowversion:
+            since = int(self._state('version'))
+            rows = queries.fetchall(connection, CACHE_CHANGED_ROWS, first_document, since, since)
+        else:
+            rows = queries.fetchall(connection, CACHE_NEW_ROWS, first_document,
+                                    int(self._state('max_packing')))
+
+        self._apply(items, locations, rows, first_document, full, version)
+        return len(rows)
+
+    def _apply(self, items, locations, rows, first_document, full, version):
+        state = {'first_document': first_document}
+        if full:
+            state['last_full'] = time.time()
+        if version is not None:
+            state['version'] = version
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                if full:
+                    # Le scatole create offline restano finché il server non le restituisce
+                    self._conn.execute("DELETE FROM batches WHERE PackingId >= 0")
+                self._conn.execute("DELETE FROM batches WHERE incomingid <= ?", (first_document,))
+                self._conn.executemany("INSERT OR REPLACE INTO items (itemid, Code) VALUES (?, ?)",
+                                       [(item.itemid, item.Code) for item in items] +
+                                       [(row.itemid, row.Code) for row in rows])
+                self._conn.executemany("INSERT OR REPLACE INTO locations (locationid, Code) VALUES (?, ?)",
+                                       [(location.locationid, location.Code) for location in locations] +
+                                       [(row.locationid, row.LocationCode) for row in rows])
+                self._store_rows(rows)
+                for name, value in state.items():
+                    self._conn.execute("INSERT OR REPLACE INTO sync_state (name, value) VALUES (?, ?)",
+                                       (name, value))
+                self._conn.execute("""
+                    INSERT OR REPLACE INTO sync_state (name, value)
+                    SELECT 'max_packing', COALESCE(MAX(PackingId), 0) FROM batches
+                    UNION ALL SELECT 'max_item', COALESCE(MAX(itemid), 0) FROM items
+                    UNION ALL SELECT 'max_location', COALESCE(MAX(locationid), 0) FROM locations
+                """)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _store_rows(self, rows):
+        self._conn.executemany("DELETE FROM batches WHERE BatchNumber_HU = ? AND PackingId < 0",
+                               [(row.BatchNumber_HU,) for row in rows])
+        self._conn.executemany("""
+            INSERT OR REPLACE INTO batches
+            (PackingId, incomingid, incomingdetid, number, itemid, BatchNumber_HU, PackQty, IncomingQty, locationid)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, [(row.PackingId, row.incomingid, row.incomingdetid, row.number, row.itemid, row.BatchNumber_HU,
+               format_quantity(row.PackQty),
+               format_quantity(row.IncomingQty) if row.IncomingQty is not None else None,
+               row.locationid) for row in rows])
+
+    def request_full_sync(self):
+        """Il prossimo allineamento ricarica tutta la finestra dei documenti"""
+        self._execute("DELETE FROM sync_state WHERE name = 'last_full'")
+
+    def add_rows(self, rows):
+        """Aggiunge righe lette dal server fuori dall'allineamento (ricerca di un batch mancante)"""
+        rows = [row for row in rows if row is not None]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR IGNORE INTO items (itemid, Code) VALUES (?, ?)",
+                                       [(row.itemid, row.Code) for row in rows])
+                self._conn.executemany("INSERT OR IGNORE INTO locations (locationid, Code) VALUES (?, ?)",
+                                       [(row.locationid, row.LocationCode) for row in rows])
+                self._store_rows(rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def invalidate(self, packing_id):
+        """Toglie la riga di una scatola non più aggiornata: la prossima ricerca la rilegge dal server"""
+        self._execute("DELETE FROM batches WHERE PackingId = ?", (packing_id,))
+
+    def apply_split(self, data, quantities, child_batch_number):
+        """Riporta uno split nella copia locale, in attesa che l'allineamento lo rilegga dal server"""
+        children = [child_batch_number(data.BatchNumber_HU, i) for i in range(1, len(quantities))]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("UPDATE batches SET PackQty = ? WHERE PackingId = ?",
+                                   (format_quantity(quantities[0]), data.PackingId))
+                # Uno split inviato dopo essere stato accodato non duplica le scatole figlie
+                self._conn.executemany("DELETE FROM batches WHERE BatchNumber_HU = ? AND PackingId < 0",
+                                       [(child,) for child in children])
+                next_id = self._conn.execute(
+                    "SELECT MIN(0, COALESCE(MIN(PackingId), 0)) - 1 FROM batches").fetchone()[0]
+                self._conn.executemany("""
+                    INSERT INTO batches
+                    (PackingId, incomingid, incomingdetid, number, itemid, BatchNumber_HU, PackQty, locationid)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                """, [(next_id - i, data.incomingid, data.incomingdetid, data.number, data.itemid,
+                       child, format_quantity(qty), data.locationid)
+                      for i, (child, qty) in enumerate(zip(children, quantities[1:]))])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def discard_split(self, data, quantities, child_batch_number):
+        """Toglie le scatole figlie create offline da uno split rifiutato dal server"""
+        with self._lock:
+            self._conn.executemany("DELETE FROM batches WHERE BatchNumber_HU = ? AND PackingId < 0",
+                                   [(child_batch_number(data.BatchNumber_HU, i),)
+                                    for i in range(1, len(quantities))])
+
+    # --- Split da inviare ----------------------------------------------------
+
+    def queue_split(self, split_key, data, quantities, user_id):
+        """Accoda uno split da inviare quando il server torna raggiungibile"""
+        payload = json.dumps({
+            'data': {field: getattr(data, field) for field in BATCH_FIELDS},
+            'quantities': [format(to_decimal(qty), 'f') for qty in quantities],
+            'user_id': user_id,
+        }, default=str)
+        self._execute("""
+            INSERT OR IGNORE INTO pending_writes (split_key, payload, status, created_at)
+            VALUES (?, ?, ?, ?)
+        """, (split_key, payload, PENDING, time.time()))
+
+    def pending_writes(self):
+        """Split da inviare in ordine di inserimento: (id, split_key, data, quantità, user_id)"""
+        writes = []
+        for write_id, split_key, payload in self._query(
+                "SELECT id, split_key, payload FROM pending_writes WHERE status = ? ORDER BY id", (PENDING,)):
+            payload = json.loads(payload)
+            data = BatchRecord(**payload['data'])
+            quantities = [to_decimal(qty) for qty in payload['quantities']]
+            writes.append((write_id, split_key, data, quantities, payload['user_id']))
+        return writes
+
+    def mark_replayed(self, write_id):
+        self._execute("UPDATE pending_writes SET status = ?, attempts = attempts + 1 WHERE id = ?",
+                      (DONE, write_id))
+
+    def mark_failed(self, write_id, error):
+        self._execute("UPDATE pending_writes SET status = ?, attempts = attempts + 1, error = ? WHERE id = ?",
+                      (FAILED, error, write_id))
+
+    def count_writes(self, status=PENDING):
+        return self._query("SELECT COUNT(*) FROM pending_writes WHERE status = ?", (status,))[0][0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CacheSynchronizer:
+    """Thread che invia gli split accodati e aggiorna la copia locale a intervalli"""
+
+    def __init__(self, cache, service, interval=30, retry_interval=10, on_status=None):
+        self.cache = cache
+        self.service = service
+        self.interval = interval
+        self.retry_interval = retry_interval
+        self.on_status = on_status
+        self.online = None
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="CacheSynchronizer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        if timeout is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def notify(self):
+        """Richiede un allineamento immediato (per esempio dopo uno split accodato)"""
+        self._wakeup.set()
+
+    def _set_online(self, online, message):
+        if online != self.online and self.on_status:
+            self.on_status(message, self.cache.count_writes())
+        self.online = online
+        self.cache.online = online
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                replayed, rejected = self.service.replay_pending()
+                self.service.db_connection.run(self.cache.sync)
+                self._set_online(True, "Server raggiungibile, copia locale aggiornata")
+                if (replayed or rejected) and self.on_status:
+                    self.on_status(f"Split inviati: {replayed}, rifiutati: {rejected}", self.cache.count_writes())
+                wait = self.interval
+            except Exception as e:
+                print(f"Allineamento della copia locale non riuscito: {str(e)}")
+                self._set_online(False, "Server non raggiungibile: lavoro sulla copia locale")
+                wait = self.retry_interval
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
@@ -0,0 +1,104 @@
+# login_cache.py
+"""Verifica locale delle credenziali per i login ripetuti sulla postazione.
+
+Dopo un login verificato dal server viene salvato, per ogni utente, un
+verificatore PBKDF2 della password con un sale casuale: la password non
+viene mai scritta su disco. Un nuovo login entro la scadenza (ttl) viene
+verificato localmente, senza connessione né query al database; se la
+password non corrisponde o la voce è scaduta la verifica torna al server.
+Un cambio password sul server vale quindi sulla postazione al più dopo
+ttl secondi (o subito, eliminando login_cache.json).
+"""
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+
+LOGIN_CACHE_FILE = 'login_cache.json'
+
+
+class User:
+    """Utente autenticato: UserId e Name come nella tabella dbo.[User]"""
+
+    def __init__(self, user_id, name, username=None):
+        self.UserId = user_id
+        self.Name = name
+        self.Username = username or name
+
+
+class CredentialCache:
+    """Verificatori salati delle password degli ultimi utenti, con scadenza"""
+
+    def __init__(self, path=LOGIN_CACHE_FILE, ttl=12 * 3600, iterations=200000):
+        self.path = path
+        self.ttl = ttl
+        self.iterations = iterations
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(username):
+        # Come il confronto sul server, il nome utente non distingue le maiuscole
+        return username.strip().casefold()
+
+    def _verifier(self, password, salt, iterations):
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Cache dei login non leggibile, verrà ricreata: {str(e)}")
+            return {}
+
+    def _save(self, entries):
+        # Scrittura su file temporaneo e sostituzione: un'interruzione non lascia il file a metà
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, indent=2)
+        os.replace(temp_path, self.path)
+
+    def verify(self, username, password):
+        """Restituisce l'utente se la password corrisponde a un verificatore valido, altrimenti None"""
+        with self._lock:
+            entries = self._load()
+            entry = entries.get(self._key(username))
+            if entry is None:
+                return None
+            if entry['expires'] < time.time():
+                del entries[self._key(username)]
+                self._save(entries)
+                return None
+        verifier = self._verifier(password, bytes.fromhex(entry['salt']), entry['iterations'])
+        if not hmac.compare_digest(verifier.hex(), entry['verifier']):
+            return None
+        return User(entry['user_id'], entry['name'], username)
+
+    def store(self, user, password):
+        """Salva il verificatore dopo un login confermato dal server"""
+        salt = os.urandom(16)
+        entry = {
+            'user_id': user.UserId,
+            'name': user.Name,
+            'salt': salt.hex(),
+            'iterations': self.iterations,
+            'verifier': self._verifier(password, salt, self.iterations).hex(),
+            'expires': time.time() + self.ttl,
+        }
+        with self._lock:
+            entries = self._load()
+            now = time.time()
+            entries = {key: value for key, value in entries.items() if value['expires'] >= now}
+            entries[self._key(user.Username)] = entry
+            self._save(entries)
+
+    def forget(self, username):
+        """Elimina il verificatore dell'utente (per esempio dopo un login rifiutato dal server)"""
+        with self._lock:
+            entries = self._load()
+            if entries.pop(self._key(username), None) is not None:
+                self._save(entries)
@@ -0,0 +1,134 @@
+# metrics.py
+import functools
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class LatencyHistogram:
+    """Latenze di un'operazione: conteggi totali e percentili sugli ultimi campioni"""
+
+    def __init__(self, max_samples=2000):
+        self.samples = deque(maxlen=max_samples)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds, error=False):
+        self.samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if error:
+            self.errors += 1
+
+    def percentile(self, p, ordered=None):
+        """Percentile p (0-100) in secondi"""
+        ordered = ordered if ordered is not None else sorted(self.samples)
+        if not ordered:
+            return 0.0
+        return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+    def summary(self):
+        """Statistiche in millisecondi"""
+        ordered = sorted(self.samples)
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean_ms': (self.total / self.count * 1000) if self.count else 0.0,
+            'p50_ms': self.percentile(50, ordered) * 1000,
+            'p95_ms': self.percentile(95, ordered) * 1000,
+            'p99_ms': self.percentile(99, ordered) * 1000,
+            'max_ms': self.max * 1000,
+        }
+
+
+class MetricsRegistry:
+    """Raccoglie le latenze di query, stampe e azioni dell'interfaccia.
+
+    Ogni misura aggiorna un istogramma in memoria e viene scritta come riga
+    JSON in un file a rotazione, separato dal log dell'applicazione.
+    """
+
+    def __init__(self, log_file='metrics.log', max_bytes=1_000_000, backup_count=5):
+        self.log_file = log_file
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._logger = None
+
+    def _get_logger(self):
+        if self._logger is None and self.log_file:
+            # logging.handlers viene caricato alla prima misura, non all'avvio
+            import logging
+            from logging.handlers import RotatingFileHandler
+            logger = logging.getLogger('boxsplitter.metrics')
+            # Nessuna propagazione al logger radice: evita righe duplicate in app.log
+            logger.propagate = False
+            logger.setLevel(logging.INFO)
+            if not logger.handlers:
+                handler = RotatingFileHandler(self.log_file, maxBytes=self.max_bytes,
+                                              backupCount=self.backup_count, encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(message)s'))
+                logger.addHandler(handler)
+            self._logger = logger
+        return self._logger
+
+    def record(self, name, seconds, error=None, **fields):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = LatencyHistogram()
+            histogram.add(seconds, error is not None)
+
+        logger = self._get_logger()
+        if logger is not None:
+            entry = {'ts': round(time.time(), 3), 'metric': name, 'ms': round(seconds * 1000, 2)}
+            if error is not None:
+                entry['error'] = str(error)
+            entry.update(fields)
+            try:
+                logger.info(json.dumps(entry, default=str))
+            except Exception:
+                pass
+
+    @contextmanager
+    def timer(self, name, **fields):
+        """Misura la durata del blocco; gli errori vengono conteggiati e propagati"""
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception as e:
+            self.record(name, time.perf_counter() - started, error=e, **fields)
+            raise
+        else:
+            self.record(name, time.perf_counter() - started, **fields)
+
+    def timed(self, name):
+        """Decoratore che misura ogni chiamata della funzione"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        """Restituisce {nome: statistiche} ordinato per nome"""
+        with self._lock:
+            return {name: histogram.summary() for name, histogram in sorted(self._histograms.items())}
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+
+# Registro condiviso dal processo
+metrics = MetricsRegistry()
+timer = metrics.timer
+timed = metrics.timed
@@ -0,0 +1,249 @@
+# print_outbox.py
+import sqlite3
+import threading
+import time
+
+# Stati di un'etichetta nella outbox
+HELD = 'held'            # accodata, in attesa del commit dello split
+PENDING = 'pending'      # pronta per la stampa
+SENDING = 'sending'      # in invio alla stampante
+DONE = 'done'            # accettata dalla stampante
+UNCERTAIN = 'uncertain'  # invio interrotto (crash o errore a metà blocco): non viene ristampata in automatico
+
+
+class PrintOutbox:
+    """Coda persistente (SQLite) delle etichette da stampare.
+
+    Le etichette sopravvivono a crash e a stampanti irraggiungibili e
+    vengono stampate nell'ordine di inserimento. Un'etichetta segnata come
+    stampata non viene mai reinviata; quelle rimaste in invio durante un
+    crash, o in un blocco il cui invio si è interrotto, passano allo stato
+    'uncertain' invece di essere ristampate.
+    """
+
+    def __init__(self, db_file='print_outbox.db'):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_file, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                split_key TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                item_code TEXT NOT NULL,
+                quantity TEXT NOT NULL,
+                batch_number TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                printed_at REAL,
+                UNIQUE (split_key, seq)
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_status ON outbox (status, id)")
+
+    def _execute(self, sql, params=(), many=False):
+        with self._lock:
+            if many:
+                self._conn.execute("BEGIN")
+                try:
+                    cursor = self._conn.executemany(sql, params)
+                    self._conn.execute("COMMIT")
+                except Exception:
+                    self._conn.execute("ROLLBACK")
+                    raise
+                return cursor
+            return self._conn.execute(sql, params)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def enqueue(self, labels, split_key, hold=False):
+        """Accoda le etichette di uno split.
+
+        Reinserire le stesse etichette con la stessa split_key non crea
+        duplicati. Con hold=True restano sospese fino a release().
+        """
+        now = time.time()
+        status = HELD if hold else PENDING
+        self._execute("""
+            INSERT OR IGNORE INTO outbox
+            (split_key, seq, item_code, quantity, batch_number, status, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, [(split_key, seq, str(label['item_code']), str(label['quantity']),
+               str(label['batch_number']), status, now)
+              for seq, label in enumerate(labels)], many=True)
+
+    def release(self, split_key):
+        """Rende stampabili le etichette sospese di uno split"""
+        self._execute("UPDATE outbox SET status = ? WHERE split_key = ? AND status = ?",
+                      (PENDING, split_key, HELD))
+
+    def discard(self, split_key):
+        """Elimina le etichette di uno split non ancora stampate"""
+        self._execute("DELETE FROM outbox WHERE split_key = ? AND status IN (?, ?)",
+                      (split_key, HELD, PENDING))
+
+    def recover(self):
+        """Da chiamare all'avvio: gestisce le etichette rimaste in invio.
+
+        Restituisce il numero di etichette in stato incerto.
+        """
+        self._execute("UPDATE outbox SET status = ? WHERE status = ?", (UNCERTAIN, SENDING))
+        return self.count(UNCERTAIN)
+
+    def next_batch(self, limit=50):
+        """Restituisce le prossime etichette da stampare in ordine di arrivo"""
+        rows = self._query("""
+            SELECT id, item_code, quantity, batch_number
+            FROM outbox WHERE status = ? ORDER BY id LIMIT ?
+        """, (PENDING, limit))
+        return [{'id': row[0], 'item_code': row[1], 'quantity': row[2], 'batch_number': row[3]}
+                for row in rows]
+
+    def mark_sending(self, ids):
+        self._execute("UPDATE outbox SET status = ? WHERE id = ?",
+                      [(SENDING, job_id) for job_id in ids], many=True)
+
+    def mark_done(self, job_id):
+        self._execute("UPDATE outbox SET status = ?, printed_at = ? WHERE id = ?",
+                      (DONE, time.time(), job_id))
+
+    def mark_uncertain(self, ids):
+        self._execute("UPDATE outbox SET status = ? WHERE id = ? AND status = ?",
+                      [(UNCERTAIN, job_id, SENDING) for job_id in ids], many=True)
+
+    def mark_pending(self, ids):
+        self._execute("UPDATE outbox SET status = ? WHERE id = ? AND status = ?",
+                      [(PENDING, job_id, SENDING) for job_id in ids], many=True)
+
+    def list_uncertain(self):
+        """Etichette in stato incerto, da verificare dall'operatore, in ordine di arrivo"""
+        rows = self._query("""
+            SELECT id, item_code, quantity, batch_number, created_at
+            FROM outbox WHERE status = ? ORDER BY id
+        """, (UNCERTAIN,))
+        return [{'id': row[0], 'item_code': row[1], 'quantity': row[2], 'batch_number': row[3],
+                 'created_at': row[4]} for row in rows]
+
+    def requeue(self, ids):
+        """Rimette in coda per la stampa le etichette incerte indicate (non stampate)"""
+        self._execute("UPDATE outbox SET status = ? WHERE id = ? AND status = ?",
+                      [(PENDING, job_id, UNCERTAIN) for job_id in ids], many=True)
+
+    def dismiss(self, ids):
+        """Segna come stampate le etichette incerte indicate (uscite dalla stampante)"""
+        now = time.time()
+        self._execute("UPDATE outbox SET status = ?, printed_at = ? WHERE id = ? AND status = ?",
+                      [(DONE, now, job_id, UNCERTAIN) for job_id in ids], many=True)
+
+    def count(self, status=PENDING):
+        return self._query("SELECT COUNT(*) FROM outbox WHERE status = ?", (status,))[0][0]
+
+    def purge(self, older_than_days=30):
+        """Elimina le etichette stampate più vecchie del limite indicato"""
+        cutoff = time.time() - older_than_days * 86400
+        self._execute("DELETE FROM outbox WHERE status = ? AND printed_at < ?", (DONE, cutoff))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class OutboxDrainer:
+    """Thread che svuota la outbox verso la stampante quando è raggiungibile.
+
+    Con i monitor di stato collegati (watch) l'invio si sospende mentre la
+    stampante segnala un problema e riprende appena torna pronta.
+    """
+
+    def __init__(self, outbox, get_printer, on_status=None, retry_interval=5, batch_size=50):
+        self.outbox = outbox
+        self.get_printer = get_printer
+        self.on_status = on_status
+        self.retry_interval = retry_interval
+        self.batch_size = batch_size
+        self._monitors = []
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="OutboxDrainer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        if timeout is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def notify(self):
+        """Segnala che ci sono nuove etichette da stampare"""
+        self._wakeup.set()
+
+    def watch(self, monitor):
+        """Collega un PrinterStatusMonitor: la stampa riprende appena la stampante torna pronta"""
+        self._monitors.append(monitor)
+        monitor.subscribe(lambda m: self.notify() if m.ready else None)
+
+    def _report(self, message):
+        if self.on_status:
+            self.on_status(message, self.outbox.count(PENDING))
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                drained = self._drain_once()
+            except Exception as e:
+                print(f"Errore nello svuotamento della coda di stampa: {str(e)}")
+                drained = False
+
+            if not drained:
+                self._wakeup.wait(self.retry_interval)
+            self._wakeup.clear()
+
+    def _drain_once(self):
+        """Stampa il prossimo blocco di etichette; False se non c'è nulla da fare o la stampante è giù"""
+        batch = self.outbox.next_batch(self.batch_size)
+        if not batch:
+            return False
+
+        faults = [monitor for monitor in self._monitors if not monitor.ready]
+        if faults and len(faults) == len(self._monitors):
+            # Invio sospeso finché il monitor non segnala la stampante di nuovo pronta
+            self._report(f"Stampa sospesa: {faults[0].describe()}")
+            return False
+
+        printer = self.get_printer()
+        if printer is None:
+            self._report("Stampante non raggiungibile, etichette in coda")
+            return False
+
+        ids = [label['id'] for label in batch]
+        acked = set()
+        uncertain = set()
+        self.outbox.mark_sending(ids)
+        try:
+            def on_label_sent(index):
+                # Può essere chiamata da più thread se la stampa usa un pool di stampanti
+                self.outbox.mark_done(ids[index])
+                acked.add(index)
+
+            def on_label_uncertain(index):
+                # Blocco interrotto durante l'invio: forse già stampata, non va ripetuta
+                self.outbox.mark_uncertain([ids[index]])
+                uncertain.add(index)
+
+            printer.print_labels(batch, on_label_sent=on_label_sent, on_label_uncertain=on_label_uncertain)
+        finally:
+            # Le etichette non inviate tornano in coda
+            self.outbox.mark_pending([job_id for index, job_id in enumerate(ids)
+                                      if index not in acked and index not in uncertain])
+
+        if uncertain:
+            self._report(f"Invio interrotto: {len(uncertain)} etichette da verificare e ristampare se necessario")
+        else:
+            self._report("Stampa etichette in corso" if acked else "Errore di stampa, nuovo tentativo a breve")
+        return len(acked) == len(batch)
@@ -0,0 +1,275 @@
+# printer_pool.py
+import threading
+
+from PrinterConnection import PrinterConnection
+from printer_status import PrinterStatusMonitor
+
+ROUND_ROBIN = 'round_robin'
+LEAST_QUEUED = 'least_queued'
+
+
+def printer_entries(config):
+    """Restituisce l'elenco delle stampanti da printer_config.json.
+
+    Accetta sia il formato con una sola stampante (ip_address/port) sia
+    una lista "printers" di oggetti con gli stessi campi.
+    """
+    if config.get('printers'):
+        return [entry for entry in config['printers'] if entry.get('ip_address')]
+    if config.get('ip_address'):
+        entry = {'printer_name': config.get('printer_name', ''),
+                 'ip_address': config['ip_address'],
+                 'port': config.get('port', 9100)}
+        if config.get('status_port'):
+            entry['status_port'] = config['status_port']
+        return [entry]
+    return []
+
+
+def attach_status_monitor(printer, entry, interval):
+    """Collega a una PrinterConnection il monitor di stato sulla connessione dedicata.
+
+    Il monitor tiene aperta una seconda connessione e va abilitato per
+    stampante indicando 'status_port'. Molti print server Zebra accettano un
+    solo client alla volta sulla porta raw 9100: una connessione di stato
+    sulla stessa porta bloccherebbe la stampa. Indicare la porta di stampa
+    solo per le stampanti che accettano più connessioni. Senza status_port
+    lo stato si legge con ~HS sulla connessione di stampa.
+    """
+    if not interval or not entry.get('status_port'):
+        return None
+    printer.status_monitor = PrinterStatusMonitor(
+        printer.ip_address, port=int(entry['status_port']), interval=interval).start()
+    return printer.status_monitor
+
+
+def status_monitors(printer):
+    """Monitor di stato di una PrinterConnection o delle stampanti di un PrinterPool"""
+    printers = [member.printer for member in printer.members] if isinstance(printer, PrinterPool) else [printer]
+    return [p.status_monitor for p in printers if getattr(p, 'status_monitor', None) is not None]
+
+
+def create_printer(config, template=None, timeout=5):
+    """Crea una PrinterConnection per una sola stampante o un PrinterPool per più stampanti"""
+    entries = printer_entries(config)
+    # Secondi tra due letture dello stato (~HS/~HQES) per le stampanti con status_port; 0 disattiva il monitor
+    status_interval = config.get('status_interval', 1.0)
+    if len(entries) > 1:
+        pool = PrinterPool.from_config(config, template=template, timeout=timeout)
+        for entry, member in zip(entries, pool.members):
+            attach_status_monitor(member.printer, entry, status_interval)
+        pool.start_health_checks()
+        return pool
+    entry = entries[0] if entries else {}
+    printer = PrinterConnection(ip_address=entry.get('ip_address'),
+                                port=int(entry.get('port', 9100)),
+                                timeout=timeout,
+                                template=template)
+    if entry:
+        attach_status_monitor(printer, entry, status_interval)
+    return printer
+
+
+class PoolMember:
+    """Stampante del pool con il suo stato di salute"""
+
+    def __init__(self, name, printer):
+        self.name = name
+        self.printer = printer
+        self.healthy = True
+        self.queued = 0
+        self.last_error = None
+        self.lock = threading.Lock()  # una stampante è usata da un solo thread alla volta
+
+    def __repr__(self):
+        state = "ok" if self.healthy else f"guasta ({self.last_error})"
+        return f"{self.name} {self.printer.ip_address}:{self.printer.port} [{state}]"
+
+
+class PrinterPool:
+    """Insieme di stampanti Zebra su cui distribuire le etichette.
+
+    Espone la stessa interfaccia di PrinterConnection (connect, is_connected,
+    print_label, print_labels, disconnect), quindi può sostituirla ovunque.
+    Le etichette di uno split vengono divise in blocchi assegnati alle
+    stampanti sane in parallelo; se una stampante si guasta i suoi blocchi
+    non confermati passano alle altre senza interrompere lo split.
+    """
+
+    BLOCK_SIZE = 10
+
+    def __init__(self, members, strategy=LEAST_QUEUED, health_interval=10):
+        if not members:
+            raise ValueError("Nessuna stampante configurata")
+        self.members = members
+        self.strategy = strategy
+        self.health_interval = health_interval
+        self._next = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread = None
+
+    @classmethod
+    def from_config(cls, config, template=None, timeout=5):
+        members = [
+            PoolMember(entry.get('printer_name') or entry['ip_address'],
+                       PrinterConnection(ip_address=entry['ip_address'],
+                                         port=int(entry.get('port', 9100)),
+                                         timeout=timeout,
+                                         template=template))
+            for entry in printer_entries(config)
+        ]
+        return cls(members, strategy=config.get('balancing', LEAST_QUEUED))
+
+    # Interfaccia compatibile con PrinterConnection
+
+    @property
+    def ip_address(self):
+        return ", ".join(member.printer.ip_address for member in self.members)
+
+    def connect(self):
+        """Connette tutte le stampanti; True se almeno una è disponibile"""
+        for member in self.members:
+            self._check_member(member)
+        return any(member.healthy for member in self.members)
+
+    def is_connected(self):
+        return any(member.healthy and member.printer.connected for member in self.members)
+
+    def disconnect(self):
+        for member in self.members:
+            with member.lock:
+                member.printer.disconnect()
+
+    def print_label(self, item_code, quantity, batch_number):
+        printed = self.print_labels([{
+            'item_code': item_code,
+            'quantity': quantity,
+            'batch_number': batch_number
+        }])
+        return printed == 1
+
+    def print_labels(self, labels, on_label_sent=None, on_label_uncertain=None):
+        """Distribuisce le etichette sulle stampanti sane.
+
+        on_label_sent(indice) viene chiamata per ogni etichetta confermata,
+        anche da thread diversi; on_label_uncertain(indice) per quelle di un
+        blocco interrotto, che non vengono riassegnate ad altre stampanti.
+        Restituisce il numero di etichette stampate.
+        """
+        acked = set()
+        uncertain = set()
+        ack_lock = threading.Lock()
+        remaining = list(range(len(labels)))
+
+        def ack(index):
+            with ack_lock:
+                acked.add(index)
+            if on_label_sent:
+                on_label_sent(index)
+
+        def ack_uncertain(index):
+            with ack_lock:
+                uncertain.add(index)
+            if on_label_uncertain:
+                on_label_uncertain(index)
+
+        while remaining:
+            healthy = [member for member in self.members if member.healthy]
+            if not healthy:
+                print("Nessuna stampante disponibile nel pool")
+                break
+
+            assignments = self._assign(remaining, healthy)
+            threads = [
+                threading.Thread(target=self._send_block, args=(member, indices, labels, ack, ack_uncertain),
+                                 name=f"PrinterPool-{member.name}", daemon=True)
+                for member, indices in assignments.items()
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            remaining = [index for index in remaining if index not in acked and index not in uncertain]
+            if remaining:
+                print(f"{len(remaining)} etichette da riassegnare ad altre stampanti")
+
+        return len(acked)
+
+    def _assign(self, indices, healthy):
+        """Divide le etichette in blocchi e li assegna alle stampanti"""
+        assignments = {}
+        with self._lock:
+            for start in range(0, len(indices), self.BLOCK_SIZE):
+                block = indices[start:start + self.BLOCK_SIZE]
+                if self.strategy == ROUND_ROBIN:
+                    member = healthy[self._next % len(healthy)]
+                    self._next += 1
+                else:
+                    member = min(healthy, key=lambda m: m.queued + len(assignments.get(m, ())))
+                assignments.setdefault(member, []).extend(block)
+        return assignments
+
+    def _send_block(self, member, indices, labels, ack, ack_uncertain):
+        with member.lock:
+            member.queued += len(indices)
+            try:
+                sent = member.printer.print_labels(
+                    [labels[index] for index in indices],
+                    on_label_sent=lambda offset: ack(indices[offset]),
+                    on_label_uncertain=lambda offset: ack_uncertain(indices[offset]))
+            except Exception as e:
+                sent = 0
+                member.last_error = str(e)
+            finally:
+                member.queued -= len(indices)
+
+            if sent < len(indices):
+                member.healthy = False
+                member.last_error = member.last_error or "stampa interrotta"
+                print(f"Stampante esclusa dal pool: {member}")
+
+    # Controllo di salute in background
+
+    def start_health_checks(self):
+        if self._health_thread is None:
+            self._health_thread = threading.Thread(target=self._health_loop, name="PrinterPoolHealth",
+                                                   daemon=True)
+            self._health_thread.start()
+
+    def stop_health_checks(self):
+        self._stop.set()
+
+    def _health_loop(self):
+        while not self._stop.wait(self.health_interval):
+            for member in self.members:
+                # Le stampanti occupate in una stampa vengono saltate
+                if member.lock.acquire(blocking=False):
+                    try:
+                        self._check_member_locked(member)
+                    finally:
+                        member.lock.release()
+
+    def _check_member(self, member):
+        with member.lock:
+            self._check_member_locked(member)
+
+    def _check_member_locked(self, member):
+        was_healthy = member.healthy
+        printer = member.printer
+        if printer.is_connected() or printer.connect():
+            monitor = printer.status_monitor
+            status = monitor.status if monitor is not None and monitor.supported else printer.query_status()
+            member.healthy = status is None or status.ready
+            member.last_error = None if member.healthy else repr(status)
+        else:
+            member.healthy = False
+            member.last_error = "non raggiungibile"
+
+        if member.healthy != was_healthy:
+            print(f"Stato stampante cambiato: {member}")
+
+    def status_summary(self):
+        healthy = sum(1 for member in self.members if member.healthy)
+        return f"{healthy}/{len(self.members)} stampanti disponibili"
@@ -0,0 +1,326 @@
+# printer_status.py
+import re
+import socket
+import threading
+import time
+
+from metrics import timed
+
+STX = b'\x02'
+ETX = b'\x03'
+
+# Comando ZPL che restituisce lo stato host della stampante (tre stringhe STX...ETX)
+HOST_STATUS_COMMAND = b'~HS'
+# Stato esteso: errori e avvisi come maschere di bit (una stringa STX...ETX)
+EXTENDED_STATUS_COMMAND = b'~HQES'
+
+# Bit del secondo gruppo di ERRORS e WARNINGS nella risposta a ~HQES
+ERROR_FLAGS = (
+    (0x00000001, "carta esaurita"),
+    (0x00000002, "nastro esaurito"),
+    (0x00000004, "testina aperta"),
+    (0x00000008, "errore taglierina"),
+    (0x00000010, "testina surriscaldata"),
+    (0x00000020, "motore surriscaldato"),
+    (0x00000040, "elemento della testina guasto"),
+    (0x00000080, "testina non rilevata"),
+)
+WARNING_FLAGS = (
+    (0x00000001, "calibrare il supporto"),
+    (0x00000002, "pulire la testina"),
+    (0x00000004, "sostituire la testina"),
+    (0x00000008, "carta in esaurimento"),
+)
+_EXTENDED_LINE = re.compile(r'(ERRORS|WARNINGS):\s*(\d)\s+([0-9A-Fa-f]{8})\s+([0-9A-Fa-f]{8})')
+
+
+def parse_extended_status(raw):
+    """Interpreta la risposta a ~HQES; restituisce (errori, avvisi) come liste di descrizioni"""
+    text = raw.decode('ascii', errors='ignore')
+    found = {name: (flag, int(group2, 16)) for name, flag, _, group2 in _EXTENDED_LINE.findall(text)}
+    if 'ERRORS' not in found:
+        raise ValueError(f"Risposta di stato estesa non valida: {raw!r}")
+
+    def describe(name, flags):
+        present, mask = found.get(name, ('0', 0))
+        if present != '1':
+            return []
+        return [text for bit, text in flags if mask & bit]
+
+    return describe('ERRORS', ERROR_FLAGS), describe('WARNINGS', WARNING_FLAGS)
+
+
+class PrinterNotReady(Exception):
+    """La stampante segnala uno stato che impedisce la stampa (carta, testina, pausa...)"""
+
+    def __init__(self, status):
+        super().__init__(f"Stampante non pronta: {status.describe()}")
+        self.status = status
+
+
+class PrinterStatus:
+    """Stato della stampante ricavato dalla risposta a ~HS"""
+
+    def __init__(self, paper_out=False, paused=False, formats_in_buffer=0, buffer_full=False,
+                 partial_format=False, corrupt_ram=False, under_temperature=False,
+                 over_temperature=False, head_open=False, ribbon_out=False,
+                 label_waiting=False, labels_remaining=0, errors=(), warnings=()):
+        self.paper_out = paper_out
+        self.paused = paused
+        self.formats_in_buffer = formats_in_buffer
+        self.buffer_full = buffer_full
+        self.partial_format = partial_format
+        self.corrupt_ram = corrupt_ram
+        self.under_temperature = under_temperature
+        self.over_temperature = over_temperature
+        self.head_open = head_open
+        self.ribbon_out = ribbon_out
+        self.label_waiting = label_waiting
+        self.labels_remaining = labels_remaining
+        # Dettaglio di ~HQES, se la stampante lo supporta
+        self.errors = list(errors)
+        self.warnings = list(warnings)
+
+    @classmethod
+    def parse(cls, raw):
+        """Interpreta la risposta grezza (bytes) di ~HS"""
+        text = raw.decode('ascii', errors='ignore')
+        lines = [part.strip() for part in text.replace('\x02', '').split('\x03') if part.strip()]
+        if len(lines) < 2:
+            raise ValueError(f"Risposta di stato non valida: {raw!r}")
+
+        first = lines[0].split(',')
+        second = lines[1].split(',')
+        if len(first) < 12 or len(second) < 9:
+            raise ValueError(f"Risposta di stato incompleta: {raw!r}")
+
+        return cls(
+            paper_out=first[1] == '1',
+            paused=first[2] == '1',
+            formats_in_buffer=int(first[4]),
+            buffer_full=first[5] == '1',
+            partial_format=first[7] == '1',
+            corrupt_ram=first[9] == '1',
+            under_temperature=first[10] == '1',
+            over_temperature=first[11] == '1',
+            head_open=second[2] == '1',
+            ribbon_out=second[3] == '1',
+            label_waiting=second[7] == '1',
+            labels_remaining=int(second[8]),
+        )
+
+    @property
+    def fault(self):
+        """True se la stampa è bloccata da un problema che richiede l'operatore (non dal buffer pieno)"""
+        return bool(self.paper_out or self.paused or self.head_open or self.ribbon_out
+                    or self.corrupt_ram or self.over_temperature or self.errors)
+
+    @property
+    def ready(self):
+        """True se la stampante può accettare e stampare etichette"""
+        return not (self.fault or self.buffer_full)
+
+    def describe(self):
+        """Descrizione leggibile dello stato per l'operatore"""
+        problems = []
+        if self.paper_out:
+            problems.append("carta esaurita")
+        if self.ribbon_out:
+            problems.append("nastro esaurito")
+        if self.head_open:
+            problems.append("testina aperta")
+        if self.paused:
+            problems.append("in pausa")
+        if self.buffer_full:
+            problems.append("buffer pieno")
+        if self.corrupt_ram:
+            problems.append("memoria corrotta")
+        if self.over_temperature:
+            problems.append("temperatura eccessiva")
+        problems += [error for error in self.errors if error not in problems]
+        if not problems:
+            text = f"pronta ({self.formats_in_buffer} etichette in attesa)"
+        else:
+            text = ", ".join(problems)
+        if self.warnings:
+            text += f" - attenzione: {', '.join(self.warnings)}"
+        return text
+
+    def __repr__(self):
+        return (f"PrinterStatus(ready={self.ready}, formats_in_buffer={self.formats_in_buffer}, "
+                f"paper_out={self.paper_out}, paused={self.paused}, head_open={self.head_open})")
+
+
+class PrinterStatusMonitor:
+    """Thread che interroga la stampante con ~HS (e ~HQES) su una connessione dedicata.
+
+    La connessione di stato è separata da quella di stampa: le richieste
+    non si mescolano al flusso delle etichette e lo stato resta aggiornato
+    anche durante un invio lungo. Chi stampa legge l'ultimo stato (status)
+    o attende il prossimo (wait_for_update); i listener ricevono ogni
+    cambio di stato. Una risposta in ritardo (stampante occupata) è
+    trattata come un errore di connessione: il monitor riapre la connessione
+    e riprova con attese crescenti. Solo se la stampante non ha mai risposto
+    a ~HS per MAX_TIMEOUTS tentativi consecutivi supported diventa False e
+    chi stampa torna al controllo di flusso TCP.
+    """
+
+    # Timeout consecutivi prima di considerare ~HS (o ~HQES) non supportato
+    MAX_TIMEOUTS = 3
+    # Attesa massima tra due tentativi dopo timeout ripetuti
+    MAX_BACKOFF = 30.0
+
+    def __init__(self, ip_address, port=9100, interval=1.0, timeout=2, extended=True):
+        self.ip_address = ip_address
+        self.port = port
+        self.interval = interval
+        self.timeout = timeout
+        self.extended = extended
+        self.supported = True
+        self.status = None          # ultimo PrinterStatus letto
+        self.updated_at = 0.0       # istante della lettura di status
+        self.error = None           # ultimo errore di connessione
+        self.answered = False       # la stampante ha risposto almeno una volta a ~HS
+        self._timeouts = 0          # timeout consecutivi di ~HS
+        self._extended_timeouts = 0
+        self._socket = None
+        self._listeners = []
+        self._condition = threading.Condition()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="PrinterStatusMonitor", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wakeup.set()
+        if timeout is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self._close()
+
+    def subscribe(self, callback):
+        """Registra callback(monitor) per ogni cambio di stato (chiamata dal thread del monitor)"""
+        self._listeners.append(callback)
+        if self.status is not None or self.error is not None:
+            callback(self)
+
+    def poll_now(self):
+        """Richiede una lettura immediata senza attendere l'intervallo"""
+        self._wakeup.set()
+
+    @property
+    def ready(self):
+        """False solo se la stampante segnala un problema: senza stato non si blocca la stampa"""
+        return self.status is None or self.error is not None or self.status.ready
+
+    def describe(self):
+        if not self.supported:
+            return "stato non disponibile"
+        if self.error is not None:
+            return f"non raggiungibile ({self.error})"
+        if self.status is None:
+            return "stato in lettura"
+        return self.status.describe()
+
+    def wait_for_update(self, after, timeout):
+        """Attende uno stato letto dopo l'istante after; restituisce lo stato o None allo scadere"""
+        deadline = time.time() + timeout
+        with self._condition:
+            while self.supported and self.updated_at <= after:
+                remaining = deadline - time.time()
+                if remaining <= 0 or self._stop.is_set():
+                    return None
+                self._condition.wait(remaining)
+            return self.status if self.updated_at > after else None
+
+    def _connect(self):
+        sock = socket.create_connection((self.ip_address, self.port), self.timeout)
+        # Le richieste di stato sono pochi byte: senza Nagle partono subito
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(self.timeout)
+        self._socket = sock
+
+    def _close(self):
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+
+    def _request(self, command, terminators):
+        self._socket.sendall(command)
+        response = b''
+        while response.count(ETX) < terminators:
+            chunk = self._socket.recv(1024)
+            if not chunk:
+                raise ConnectionError("Connessione di stato chiusa dalla stampante")
+            response += chunk
+        return response
+
+    @timed('printer.status_monitor')
+    def read_status(self):
+        """Legge lo stato sulla connessione dedicata (già aperta)"""
+        status = PrinterStatus.parse(self._request(HOST_STATUS_COMMAND, 3))
+        self.answered = True
+        if self.extended:
+            try:
+                status.errors, status.warnings = parse_extended_status(
+                    self._request(EXTENDED_STATUS_COMMAND, 1))
+                self._extended_timeouts = 0
+            except socket.timeout:
+                # La connessione va riaperta per scartare una risposta tardiva
+                self._close()
+                self._extended_timeouts += 1
+                if self._extended_timeouts >= self.MAX_TIMEOUTS:
+                    print("Stato esteso ~HQES non supportato dalla stampante")
+                    self.extended = False
+        return status
+
+    def _publish(self, status, error):
+        previous = (self.describe(), self.ready)
+        with self._condition:
+            if status is not None:
+                self.status = status
+                self.updated_at = time.time()
+            self.error = error
+            self._condition.notify_all()
+        if (self.describe(), self.ready) != previous:
+            for callback in list(self._listeners):
+                try:
+                    callback(self)
+                except Exception as e:
+                    print(f"Errore nella notifica dello stato stampante: {str(e)}")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self._socket is None:
+                    self._connect()
+            except OSError as e:
+                self._publish(None, str(e))
+                self._wakeup.wait(self.interval)
+                self._wakeup.clear()
+                continue
+            wait = self.interval
+            try:
+                self._publish(self.read_status(), None)
+                self._timeouts = 0
+            except socket.timeout:
+                self._close()
+                self._timeouts += 1
+                if not self.answered and self._timeouts >= self.MAX_TIMEOUTS:
+                    print("Stato stampante non disponibile, pacing tramite TCP")
+                    self.supported = False
+                    self._publish(None, None)
+                    return
+                self._publish(None, "nessuna risposta a ~HS")
+                wait = min(self.interval * 2 ** self._timeouts, self.MAX_BACKOFF)
+            except (OSError, ValueError) as e:
+                self._close()
+                self._publish(None, str(e))
+            self._wakeup.wait(wait)
+            self._wakeup.clear()
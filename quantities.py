@@ -0,0 +1,166 @@
+# quantities.py
+"""Quantità esatte per validazione, scrittura e stampa degli split.
+
+Le quantità viaggiano come Decimal con il numero di decimali dell'unità
+di misura dell'articolo (0 per i pezzi, 3 per kg o metri): i valori con
+più decimali vengono rifiutati, i float del driver vengono arrotondati
+alla precisione dell'articolo. La somma di uno split si confronta in
+modo esatto, su interi nell'unità minima, senza tolleranze.
+
+I decimali per articolo si leggono da pack_rules.json come le regole di
+split:
+  {"default": {"unit": 1, "decimals": 3},
+   "items": {"ART-001": {"decimals": 0}}}
+
+format_quantity dà lo stesso testo per etichette, messaggi e procedura
+(punto decimale, senza esponente né zeri finali); db_param dà il Decimal
+con scala fissa da passare come parametro al database.
+"""
+import math
+from decimal import Decimal, InvalidOperation
+
+from split_planner import to_decimal
+
+QUANTITY_DECIMALS = 3
+# Le quantità dello split viaggiano come DECIMAL(18, 4) (SplitWriter, usp_SplitBox)
+MAX_DECIMALS = 4
+
+_QUANTUMS = tuple(Decimal(1).scaleb(-decimals) for decimals in range(MAX_DECIMALS + 1))
+_SCALES = tuple(10 ** decimals for decimals in range(MAX_DECIMALS + 1))
+
+
+def _quantum(decimals):
+    if not isinstance(decimals, int) or not 0 <= decimals <= MAX_DECIMALS:
+        raise ValueError(f"Numero di decimali non valido: {decimals} (da 0 a {MAX_DECIMALS})")
+    return _QUANTUMS[decimals]
+
+
+def decimals_for(rules, item_code):
+    """Decimali dell'unità di misura dell'articolo (pack_rules.json), o QUANTITY_DECIMALS"""
+    value = rules.get('items', {}).get(item_code, {}).get('decimals')
+    if value is None:
+        value = rules.get('default', {}).get('decimals', QUANTITY_DECIMALS)
+    try:
+        decimals = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Numero di decimali non valido per {item_code}: {value}")
+    _quantum(decimals)
+    return decimals
+
+
+def to_quantity(value, decimals=QUANTITY_DECIMALS, name="quantità"):
+    """Converte un valore in Decimal con esattamente decimals decimali.
+
+    I float (colonne FLOAT lette dal driver) vengono arrotondati alla
+    precisione; testi e Decimal con più decimali significativi sono un
+    errore.
+    """
+    quantum = _quantum(decimals)
+    try:
+        if type(value) is float:
+            if not math.isfinite(value):
+                raise ValueError(value)
+            return Decimal(repr(value)).quantize(quantum)
+        value = to_decimal(value, name)
+        if not value.is_finite():
+            raise ValueError(value)
+        rounded = value.quantize(quantum)
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Valore non valido per {name}: {value}")
+    if rounded != value:
+        raise ValueError(f"La {name} {value} ha più di {decimals} decimali")
+    return rounded
+
+
+def parse_quantity(text, decimals=QUANTITY_DECIMALS, index=None):
+    """Quantità inserita dall'operatore (anche con la virgola decimale)"""
+    label = f"Quantità {index + 1}" if index is not None else "Quantità"
+    text = str(text).strip()
+    if not text:
+        raise ValueError(f"Inserire la quantità {index + 1}" if index is not None else "Inserire la quantità")
+    try:
+        return to_quantity(text, decimals)
+    except ValueError:
+        # Distingue i decimali in eccesso da un testo che non è un numero
+        try:
+            value = to_decimal(text)
+        except ValueError:
+            value = None
+        if value is not None and value.is_finite():
+            raise ValueError(f"{label} {text}: al massimo {decimals} decimali")
+        raise ValueError(f"{label} non valida: {text}")
+
+
+def to_units(quantities, decimals=QUANTITY_DECIMALS):
+    """Quantità come interi nell'unità minima (10 ** -decimals); ValueError con l'indice del primo valore non valido"""
+    _quantum(decimals)
+    scale = _SCALES[decimals]
+    units = []
+    append = units.append
+    for index, qty in enumerate(quantities):
+        # Percorso rapido: Decimal già alla precisione (piani, valori validati)
+        if type(qty) is Decimal and qty.is_finite() and qty.as_tuple().exponent >= -decimals:
+            append(int(qty * scale))
+            continue
+        try:
+            qty = to_quantity(qty, decimals)
+        except ValueError:
+            raise ValueError(f"Quantità {index + 1} non valida: {qty} (al massimo {decimals} decimali)")
+        append(int(qty * scale))
+    return units
+
+
+def from_units(units, decimals=QUANTITY_DECIMALS):
+    """Decimal con scala fissa da una quantità in unità minime"""
+    return Decimal(units).scaleb(-decimals)
+
+
+def sum_quantities(quantities, decimals=QUANTITY_DECIMALS):
+    """Somma esatta di un vettore di quantità, con scala fissa"""
+    return from_units(sum(to_units(quantities, decimals)), decimals)
+
+
+def validate_split(total, quantities, decimals=QUANTITY_DECIMALS):
+    """Verifica uno split e restituisce le quantità come Decimal con decimals decimali.
+
+    Le quantità vengono convertite una sola volta in interi: minimo e somma
+    si calcolano sugli interi con le funzioni native, quindi anche migliaia
+    di scatole si validano in un passaggio e senza errori di arrotondamento.
+    """
+    if len(quantities) < 2:
+        raise ValueError("Il numero di divisioni deve essere almeno 2")
+    total_units = to_units([to_quantity(total, decimals, "quantità totale")], decimals)[0]
+    units = to_units(quantities, decimals)
+
+    smallest = min(units)
+    if smallest <= 0:
+        raise ValueError(f"La quantità {units.index(smallest) + 1} deve essere maggiore di zero")
+
+    entered = sum(units)
+    if entered != total_units:
+        raise ValueError(
+            f"La somma delle quantità ({format_quantity(from_units(entered, decimals))}) "
+            f"non corrisponde al totale ({format_quantity(from_units(total_units, decimals))})")
+    return [from_units(value, decimals) for value in units]
+
+
+def format_quantity(value):
+    """Testo della quantità per etichette ZPL e messaggi: '12', '0.5', '1200'"""
+    value = to_decimal(value)
+    if not value.is_finite():
+        raise ValueError(f"Valore non valido per quantità: {value}")
+    if value == value.to_integral_value():
+        return format(value.quantize(_QUANTUMS[0]), 'f')
+    return format(value.normalize(), 'f')
+
+
+def db_param(value, decimals=None):
+    """Quantità da passare come parametro al database.
+
+    Le quantità validate (validate_split) hanno già la scala dell'articolo
+    e passano invariate; i float e i testi diventano Decimal con decimals
+    decimali (QUANTITY_DECIMALS se non indicati).
+    """
+    if type(value) is Decimal and value.is_finite() and (decimals is None or value.as_tuple().exponent == -decimals):
+        return value
+    return to_quantity(value, QUANTITY_DECIMALS if decimals is None else decimals)
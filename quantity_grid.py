@@ -0,0 +1,322 @@
+# quantity_grid.py
+import re
+import tkinter as tk
+from array import array
+from tkinter import ttk
+
+from quantities import QUANTITY_DECIMALS, format_quantity, from_units, parse_quantity, to_units
+from split_planner import to_decimal
+
+# Separatori tra i valori incollati: a capo, tab, punto e virgola e virgola seguita da spazio
+_SEPARATORS = re.compile(r'[\r\n\t;]+|,\s+')
+_REPEAT = re.compile(r'^(\d+)x(.+)$')
+# Cella vuota nell'array delle quantità in unità minime
+_EMPTY = -2 ** 63
+
+
+def parse_number(text):
+    """Converte un valore inserito dall'operatore, accettando anche la virgola decimale"""
+    value = to_decimal(text)
+    if not value.is_finite():
+        raise ValueError(text)
+    return value
+
+
+def parse_quantity_spec(text):
+    """Espande una colonna di numeri o una specifica come '10x12, 1x5' in una lista di quantità.
+
+    '10x12' significa 10 scatole da 12. I valori possono essere separati da
+    a capo (colonna copiata da Excel), tab, punto e virgola o ', '.
+    """
+    text = re.sub(r'\s*[xX×*]\s*', 'x', text.strip())
+    quantities = []
+    for token in _SEPARATORS.split(text):
+        token = token.strip()
+        if not token:
+            continue
+        # '10x12,1x5' senza spazi: la virgola separa due ripetizioni
+        parts = token.split(',') if token.count('x') > 1 else [token]
+        for part in parts:
+            repeat = _REPEAT.match(part)
+            try:
+                if repeat:
+                    count = int(repeat.group(1))
+                    if count <= 0:
+                        raise ValueError(part)
+                    quantities.extend([parse_number(repeat.group(2))] * count)
+                else:
+                    quantities.append(parse_number(part))
+            except ValueError:
+                raise ValueError(f"Valore non valido: {part}")
+    if not quantities:
+        raise ValueError("Nessuna quantità indicata")
+    return quantities
+
+
+class QuantityModel:
+    """Quantità dello split in un array compatto di interi.
+
+    Ogni quantità è memorizzata in unità minime (10 ** -decimals), quindi
+    il totale aggiornato a ogni modifica è esatto anche con molte righe.
+    Le celle vuote valgono _EMPTY; i testi non numerici o con troppi
+    decimali restano in un dizionario a parte per poterli mostrare e
+    segnalare alla conferma.
+    """
+
+    def __init__(self, size, max_size=1000, decimals=QUANTITY_DECIMALS):
+        self.max_size = max_size
+        self.decimals = decimals
+        self._values = array('q', [_EMPTY]) * size
+        self._invalid = {}  # indice -> testo non valido
+        self._total = 0
+        self.filled = 0
+
+    def __len__(self):
+        return len(self._values)
+
+    @property
+    def total(self):
+        """Somma esatta (Decimal) delle quantità inserite"""
+        return from_units(self._total, self.decimals)
+
+    def get(self, index):
+        """Quantità della riga o None se vuota o non valida"""
+        value = self._values[index]
+        return None if value == _EMPTY else from_units(value, self.decimals)
+
+    def text(self, index):
+        """Testo da mostrare nella cella"""
+        if index in self._invalid:
+            return self._invalid[index]
+        value = self._values[index]
+        if value == _EMPTY:
+            return ""
+        return format_quantity(from_units(value, self.decimals))
+
+    def _store(self, index, value):
+        old = self._values[index]
+        if old != _EMPTY:
+            self._total -= old
+            self.filled -= 1
+        if value != _EMPTY:
+            self._total += value
+            self.filled += 1
+        self._values[index] = value
+
+    def set_text(self, index, text):
+        """Aggiorna la riga dal testo inserito; restituisce False se il testo non è una quantità valida"""
+        text = text.strip()
+        self._invalid.pop(index, None)
+        if not text:
+            self._store(index, _EMPTY)
+            return True
+        try:
+            self._store(index, self._units([parse_quantity(text, self.decimals)])[0])
+            return True
+        except ValueError:
+            self._store(index, _EMPTY)
+            self._invalid[index] = text
+            return False
+
+    def resize(self, size):
+        if size > self.max_size:
+            raise ValueError(f"Numero massimo di scatole: {self.max_size}")
+        if size > len(self._values):
+            self._values.extend([_EMPTY] * (size - len(self._values)))
+        else:
+            for index in range(size, len(self._values)):
+                self._store(index, _EMPTY)
+                self._invalid.pop(index, None)
+            del self._values[size:]
+
+    def _units(self, quantities):
+        try:
+            values = array('q', to_units(quantities, self.decimals))
+        except OverflowError:
+            raise ValueError("Quantità troppo grande")
+        if _EMPTY in values:
+            raise ValueError("Quantità troppo grande")
+        return values
+
+    def load(self, quantities):
+        """Sostituisce tutte le righe con le quantità indicate"""
+        if len(quantities) > self.max_size:
+            raise ValueError(f"Numero massimo di scatole: {self.max_size}")
+        self._values = self._units(quantities)
+        self._invalid.clear()
+        self._total = sum(self._values)
+        self.filled = len(self._values)
+
+    def paste(self, quantities, start=0):
+        """Scrive le quantità a partire dalla riga start, aggiungendo righe se servono"""
+        values = self._units(quantities)
+        end = start + len(values)
+        if end > len(self._values):
+            self.resize(end)
+        for offset, value in enumerate(values):
+            self._invalid.pop(start + offset, None)
+            self._store(start + offset, value)
+        return end
+
+    def quantities(self):
+        """Restituisce la lista delle quantità (Decimal); ValueError alla prima riga vuota o non valida"""
+        for index in range(len(self._values)):
+            if index in self._invalid:
+                # Ripete la conversione per riportare il motivo (testo o decimali in eccesso)
+                parse_quantity(self._invalid[index], self.decimals, index)
+                raise ValueError(f"Quantità {index + 1} non valida: {self._invalid[index]}")
+            if self._values[index] == _EMPTY:
+                raise ValueError(f"Inserire la quantità {index + 1}")
+        return [from_units(value, self.decimals) for value in self._values]
+
+
+class QuantityGrid(ttk.Frame):
+    """Editor delle quantità che crea i widget solo per le righe visibili.
+
+    Scorrendo vengono riutilizzate le stesse visible_rows righe di Label ed
+    Entry, caricando i valori dal modello; Invio e le frecce spostano il
+    cursore in tempo costante. Incollando una colonna di numeri o una
+    specifica '10x12, 1x5' le righe vengono riempite dalla riga corrente.
+    """
+
+    def __init__(self, parent, model, visible_rows=12, on_change=None):
+        super().__init__(parent)
+        self.model = model
+        self.visible_rows = visible_rows
+        self.on_change = on_change
+        self.top = 0      # prima riga del modello mostrata
+        self.cursor = 0   # riga del modello con il focus
+        self._slots = []  # (label, entry, StringVar)
+
+        for slot in range(visible_rows):
+            label = ttk.Label(self, width=14, anchor=tk.W)
+            var = tk.StringVar()
+            entry = ttk.Entry(self, textvariable=var, width=15)
+            label.grid(row=slot, column=0, sticky=tk.W, pady=2)
+            entry.grid(row=slot, column=1, padx=5, pady=2)
+            entry.bind('<FocusIn>', lambda e, s=slot: self._on_focus(s))
+            entry.bind('<FocusOut>', lambda e, s=slot: self._commit(s))
+            entry.bind('<Return>', lambda e: self.move(1))
+            entry.bind('<Down>', lambda e: self.move(1))
+            entry.bind('<Up>', lambda e: self.move(-1))
+            entry.bind('<Next>', lambda e: self.move(self.visible_rows))
+            entry.bind('<Prior>', lambda e: self.move(-self.visible_rows))
+            entry.bind('<<Paste>>', lambda e, s=slot: self._on_paste(s))
+            entry.bind('<MouseWheel>', self._on_wheel)
+            label.bind('<MouseWheel>', self._on_wheel)
+            self._slots.append((label, entry, var))
+
+        self.scrollbar = ttk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.grid(row=0, column=2, rowspan=visible_rows, sticky=(tk.N, tk.S))
+        self.bind('<MouseWheel>', self._on_wheel)
+        self.refresh()
+
+    def refresh(self):
+        """Ridisegna le righe visibili a partire da self.top"""
+        size = len(self.model)
+        self.top = max(0, min(self.top, size - self.visible_rows))
+        for slot, (label, entry, var) in enumerate(self._slots):
+            index = self.top + slot
+            if index < size:
+                label.config(text=f"Quantità {index + 1}:")
+                var.set(self.model.text(index))
+                entry.state(['!disabled'])
+            else:
+                label.config(text="")
+                var.set("")
+                entry.state(['disabled'])
+
+        if size > self.visible_rows:
+            self.scrollbar.set(self.top / size, (self.top + self.visible_rows) / size)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def _commit(self, slot):
+        """Copia nel modello il testo della riga visibile"""
+        index = self.top + slot
+        if index < len(self.model):
+            self.model.set_text(index, self._slots[slot][2].get())
+            if self.on_change:
+                self.on_change()
+
+    def commit(self):
+        """Salva la riga in modifica (da chiamare prima di leggere il modello)"""
+        if self.top <= self.cursor < self.top + self.visible_rows:
+            self._commit(self.cursor - self.top)
+
+    def _on_focus(self, slot):
+        self.cursor = self.top + slot
+
+    def focus_row(self, index):
+        """Porta il focus sulla riga index, scorrendo solo se non è visibile"""
+        if not len(self.model):
+            return
+        index = max(0, min(index, len(self.model) - 1))
+        if index < self.top:
+            self.top = index
+            self.refresh()
+        elif index >= self.top + self.visible_rows:
+            self.top = index - self.visible_rows + 1
+            self.refresh()
+        self.cursor = index
+        entry = self._slots[index - self.top][1]
+        entry.focus_set()
+        entry.icursor(tk.END)
+
+    def move(self, delta):
+        self.commit()
+        self.focus_row(self.cursor + delta)
+        return "break"
+
+    def scroll_to(self, top):
+        self.commit()
+        self.top = top
+        self.refresh()
+        if self.top <= self.cursor < self.top + self.visible_rows:
+            self._slots[self.cursor - self.top][1].focus_set()
+        else:
+            # La riga in modifica non è più visibile: la sua Entry ora mostra un'altra riga
+            self.focus_set()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        size = len(self.model)
+        if action == tk.MOVETO:
+            self.scroll_to(int(float(amount) * size))
+        elif unit == tk.PAGES:
+            self.scroll_to(self.top + int(amount) * self.visible_rows)
+        else:
+            self.scroll_to(self.top + int(amount))
+
+    def _on_wheel(self, event):
+        self.scroll_to(self.top - int(event.delta / 120) * 3)
+        return "break"
+
+    def _on_paste(self, slot):
+        """Incolla più valori a partire dalla riga corrente; un solo numero segue il comportamento normale"""
+        try:
+            text = self.clipboard_get()
+        except tk.TclError:
+            return None
+        if not _SEPARATORS.search(text.strip()) and 'x' not in text.lower():
+            return None
+        try:
+            quantities = parse_quantity_spec(text)
+            end = self.model.paste(quantities, start=self.top + slot)
+        except ValueError as e:
+            self.bell()
+            if self.on_change:
+                self.on_change(str(e))
+            return "break"
+        self.refresh()
+        if self.on_change:
+            self.on_change()
+        self.focus_row(end - 1)
+        return "break"
+
+    def load(self, quantities):
+        """Sostituisce tutte le righe (specifica '10x12, 1x5' applicata dal dialogo)"""
+        self.model.load(quantities)
+        self.top = self.cursor = 0
+        self.refresh()
+        if self.on_change:
+            self.on_change()
@@ -0,0 +1,125 @@
+# query_registry.py
+"""Registro delle istruzioni SQL con nome condiviso dai moduli dell'applicazione.
+
+Non importa pyodbc: split_writer, batch_index, local_cache e split_service
+registrano le proprie istruzioni al caricamento del modulo, e split_manager
+li importa prima che serva una connessione al database.
+"""
+import threading
+import time
+
+
+class QueryRegistry:
+    """Istruzioni SQL con nome e cursori riutilizzati per connessione.
+
+    pyodbc prepara l'istruzione alla prima execute di un cursore e, se lo
+    stesso cursore riesegue lo stesso testo, riusa l'handle preparato senza
+    farlo ricompilare al server. Il registro tiene quindi un cursore aperto
+    per ogni (connessione, istruzione) e lo chiude quando il pool chiude la
+    connessione. Conta i riutilizzi (hits), le nuove preparazioni (misses)
+    e il tempo di esecuzione di ogni istruzione.
+    """
+
+    def __init__(self):
+        self._sql = {}
+        self._cursors = {}  # connessione -> {nome istruzione: cursore}
+        self._stats = {}    # nome istruzione -> [esecuzioni, secondi totali]
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, name, sql):
+        """Registra l'istruzione name; restituisce il nome da usare in execute()"""
+        with self._lock:
+            if self._sql.get(name, sql) != sql:
+                raise ValueError(f"Istruzione '{name}' già registrata con un testo diverso")
+            self._sql[name] = sql
+            self._stats.setdefault(name, [0, 0.0])
+        return name
+
+    def sql(self, name):
+        return self._sql[name]
+
+    def cursor(self, connection, name):
+        """Cursore dedicato all'istruzione name sulla connessione, creato al primo uso.
+
+        Il cursore appartiene al registro: non va chiuso dal chiamante.
+        """
+        with self._lock:
+            cursors = self._cursors.setdefault(connection, {})
+            cursor = cursors.get(name)
+            if cursor is not None:
+                self.hits += 1
+                return cursor
+            self.misses += 1
+        cursor = connection.cursor()
+        with self._lock:
+            cursors[name] = cursor
+        return cursor
+
+    def execute(self, connection, name, *params):
+        """Esegue l'istruzione registrata e restituisce il cursore con i risultati"""
+        cursor = self.cursor(connection, name)
+        started = time.perf_counter()
+        try:
+            cursor.execute(self._sql[name], *params)
+        except Exception:
+            # Un cursore in errore non viene riutilizzato
+            self.discard(connection, name)
+            raise
+        finally:
+            self._account(name, time.perf_counter() - started)
+        return cursor
+
+    def fetchone(self, connection, name, *params):
+        return self.execute(connection, name, *params).fetchone()
+
+    def fetchall(self, connection, name, *params):
+        return self.execute(connection, name, *params).fetchall()
+
+    def _account(self, name, seconds):
+        with self._lock:
+            stats = self._stats.setdefault(name, [0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+
+    def discard(self, connection, name):
+        """Chiude il cursore di name sulla connessione; il prossimo uso ne crea uno nuovo"""
+        with self._lock:
+            cursor = self._cursors.get(connection, {}).pop(name, None)
+        if cursor is not None:
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def forget(self, connection):
+        """Chiude i cursori della connessione (da chiamare prima di chiuderla)"""
+        with self._lock:
+            cursors = self._cursors.pop(connection, {})
+        for cursor in cursors.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = 0
+            for stats in self._stats.values():
+                stats[:] = [0, 0.0]
+
+    def stats(self):
+        """Riutilizzi, preparazioni e per ogni istruzione (esecuzioni, ms medi)"""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'open_cursors': sum(len(cursors) for cursors in self._cursors.values()),
+                'statements': {name: (count, total * 1000 / count if count else 0.0)
+                               for name, (count, total) in self._stats.items()},
+            }
+
+
+# Registro condiviso da tutti i moduli che interrogano il database
+queries = QueryRegistry()
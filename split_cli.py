@@ -0,0 +1,172 @@
+# split_cli.py
+"""Modalità batch: esegue gli split da file CSV o JSONL senza interfaccia grafica.
+
+Formati accettati:
+  CSV   -> batch_number,quantità_1,quantità_2,...
+  JSONL -> {"batch_number": "...", "quantities": [10, 12, 5]}
+
+Le righe senza quantità vengono divise con il piano automatico
+(--box-size, --boxes o le regole di pack_rules.json).
+
+Esempio:
+  python split_cli.py splits.csv --user-id 12 --report esito.csv
+"""
+import argparse
+import contextlib
+import csv
+import json
+import sys
+import time
+
+from config_manager import ConfigManager
+from db_connection import DatabaseConnection
+from printer_pool import create_printer
+from zpl_templates import load_template
+from print_outbox import PrintOutbox, OutboxDrainer, PENDING, SENDING
+from split_service import SplitService
+from split_planner import load_pack_rules
+from split_writer import SPLIT_MODES, create_split_writer
+
+
+def read_rows(path):
+    """Restituisce (numero di riga, batch number, quantità) per ogni riga del file"""
+    with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+        if path.lower().endswith(('.jsonl', '.json')):
+            for line_no, line in enumerate(f, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                row = json.loads(line)
+                yield line_no, str(row['batch_number']).strip(), row.get('quantities') or []
+        else:
+            for line_no, row in enumerate(csv.reader(f), 1):
+                if not row or not row[0].strip() or row[0].startswith('#'):
+                    continue
+                if line_no == 1 and row[0].strip().lower() in ('batch_number', 'batchnumber_hu'):
+                    continue
+                yield line_no, row[0].strip(), [value for value in row[1:] if value.strip()]
+
+
+def load_printer(config_file):
+    """Crea la connessione alla stampante (o il pool di stampanti) da printer_config.json"""
+    with open(config_file, 'r') as f:
+        config = json.load(f)
+    template_name = config.get('label_template', 'split_box')
+    return create_printer(config, template=load_template(template_name) if template_name else None, timeout=5)
+
+
+def process_rows(service, rows, user_id, report, plan_options=None):
+    """Esegue gli split riga per riga; restituisce (righe ok, righe in errore, scatole create)"""
+    ok = errors = boxes = 0
+    for line_no, batch_number, values in rows:
+        started = time.perf_counter()
+        try:
+            data = service.find_batch(batch_number)
+            if data is None:
+                raise ValueError(f"Batch number '{batch_number}' non trovato nel database")
+            if values:
+                quantities = service.parse_quantities(values, service.decimals(data))
+            else:
+                quantities = service.plan(data, **(plan_options or {}))
+            labels = service.split(data, quantities, user_id)
+            status, message = 'OK', f"{len(labels)} scatole"
+            ok += 1
+            boxes += len(labels)
+        except Exception as e:
+            status, message = 'ERRORE', str(e)
+            errors += 1
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        report.writerow([line_no, batch_number, status, message, f"{elapsed_ms:.1f}"])
+    return ok, errors, boxes
+
+
+def queued_labels(outbox):
+    """Etichette non ancora accettate dalla stampante: in coda o in invio"""
+    return outbox.count(PENDING) + outbox.count(SENDING)
+
+
+def wait_for_printing(outbox, timeout):
+    """Attende che la coda di stampa si svuoti; restituisce le etichette ancora in coda o in invio"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if not queued_labels(outbox):
+            return 0
+        time.sleep(0.5)
+    return queued_labels(outbox)
+
+
+def run(args):
+    # Il report senza --report va su stdout: i messaggi dei moduli (print) vanno su stderr
+    # per non mescolarsi alle righe CSV
+    report_file = open(args.report, 'w', newline='', encoding='utf-8') if args.report else sys.stdout
+    try:
+        with contextlib.redirect_stdout(sys.stderr):
+            return _run(args, report_file)
+    finally:
+        if report_file is not sys.stdout:
+            report_file.close()
+
+
+def _run(args, report_file):
+    db_connection = DatabaseConnection(ConfigManager())
+    outbox = drainer = None
+
+    if not args.no_print:
+        printer = load_printer(args.printer_config)
+        outbox = PrintOutbox(args.outbox)
+        outbox.recover()
+        drainer = OutboxDrainer(outbox,
+                                lambda: printer if printer.is_connected() or printer.connect() else None)
+        drainer.start()
+
+    split_writer = db_connection.run(lambda connection: create_split_writer(connection, args.split_mode))
+    service = SplitService(db_connection, print_outbox=outbox,
+                           on_labels_queued=drainer.notify if drainer else None,
+                           split_writer=split_writer,
+                           pack_rules=load_pack_rules(args.pack_rules))
+    plan_options = {'box_size': args.box_size, 'boxes': args.boxes}
+
+    report = csv.writer(report_file)
+    report.writerow(['riga', 'batch_number', 'esito', 'messaggio', 'ms'])
+
+    started = time.perf_counter()
+    ok, errors, boxes = process_rows(service, read_rows(args.input), args.user_id, report, plan_options)
+    elapsed = time.perf_counter() - started
+    report_file.flush()
+
+    total = ok + errors
+    print(f"Righe elaborate: {total} (ok: {ok}, errori: {errors}), scatole create: {boxes}", file=sys.stderr)
+    if elapsed > 0:
+        print(f"Tempo: {elapsed:.1f} s - {total / elapsed:.1f} righe/s, {boxes / elapsed:.1f} scatole/s",
+              file=sys.stderr)
+
+    if drainer:
+        pending = wait_for_printing(outbox, args.print_timeout)
+        drainer.stop(timeout=5)
+        if pending:
+            print(f"{pending} etichette ancora in coda: verranno stampate al prossimo avvio", file=sys.stderr)
+
+    return 0 if errors == 0 else 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split di scatole in modalità batch, senza interfaccia grafica")
+    parser.add_argument('input', help="File CSV o JSONL con batch number e quantità")
+    parser.add_argument('--user-id', type=int, required=True, help="UserId registrato negli split")
+    parser.add_argument('--report', help="File CSV dell'esito per riga (predefinito: stdout)")
+    parser.add_argument('--no-print', action='store_true', help="Non stampa le etichette")
+    parser.add_argument('--printer-config', default='printer_config.json')
+    parser.add_argument('--outbox', default='print_outbox.db', help="Coda di stampa persistente")
+    parser.add_argument('--box-size', help="Pezzi per scatola per le righe senza quantità")
+    parser.add_argument('--boxes', type=int, help="Numero di scatole uguali per le righe senza quantità")
+    parser.add_argument('--pack-rules', default='pack_rules.json', help="Regole di confezionamento per articolo")
+    parser.add_argument('--split-mode', choices=SPLIT_MODES, default='auto',
+                        help="Scrittura degli split: procedura sul server se presente (auto), "
+                             "batch SQL del client (sql) o solo procedura (procedure)")
+    parser.add_argument('--print-timeout', type=float, default=300,
+                        help="Secondi di attesa per lo svuotamento della coda di stampa")
+    sys.exit(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,31 @@
-import socket
+import sys
+from startup_profile import profiler
+
+if '--profile-startup' in sys.argv:
+    profiler.install()
+
 import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
-import pyodbc
+from tkinter import ttk, messagebox
 import json
-import win32print
-import tempfile
 import os
-from datetime import datetime
-from db_connection import DatabaseConnection
 from config_manager import ConfigManager
+from login_cache import CredentialCache, User
 import time
 import threading
-from queue import Queue
-from PrinterConnection import PrinterConnection
+from zpl_templates import load_template
+from split_service import SplitService
+from split_writer import create_split_writer
+from quantity_grid import QuantityGrid, QuantityModel, parse_quantity_spec
+from split_planner import load_pack_rules, rule_for, to_decimal
+from quantities import format_quantity
+from split_session import SplitSession, DONE
+from batch_record import BatchRecord
+from task_executor import TaskExecutor
+from metrics import metrics, timed
+
+# pyodbc (db_connection), socket (printer_pool), asyncio (async_printer) e
+# sqlite3 (print_outbox) vengono importati alla prima necessità, per lo più
+# dal thread di avvio in background, così la finestra di login compare subito
 
 class LoginWindow:
     def __init__(self, parent, on_login_success):
@@ -27,6 +40,7 @@ class LoginWindow:
         self._center_window()
         self.config_manager = ConfigManager()
         self.db_connection = None
+        self.credential_cache = CredentialCache()
         self.on_login_success = on_login_success
         self.username_var = tk.StringVar()
         self.password_var = tk.StringVar()
@@ -72,6 +86,7 @@ class LoginWindow:
         self.window.rowconfigure(0, weight=1)
         main_frame.columnconfigure(0, weight=1)
 
+    @timed('ui.login')
     def login(self, event=None):
         username = self.username_var.get().strip()
         password = self.password_var.get().strip()
@@ -80,14 +95,24 @@ class LoginWindow:
             messagebox.showwarning("Attenzione", "Inserire nome utente e password")
             return
 
+        # Login ripetuto sulla postazione: verifica locale, nessun accesso al database
+        try:
+            user = self.credential_cache.verify(username, password)
+        except Exception as e:
+            print(f"Verifica locale delle credenziali non riuscita: {str(e)}")
+            user = None
+        if user is not None:
+            self.on_login_success(user)
+            self.window.destroy()
+            return
+
         if not self._connect_db():
             return
 
         try:
-            user_info = self.db_connection.verify_credentials(username, password)
-            if user_info:
-                user_details = self._get_user_details(username)
-                self.on_login_success(user_details)
+            user = self._authenticate(username, password)
+            if user:
+                self.on_login_success(user)
                 self.window.destroy()
             else:
                 messagebox.showerror("Errore", "Nome utente o password non validi")
@@ -96,33 +121,26 @@ class LoginWindow:
         except Exception as e:
             messagebox.showerror("Errore", f"Errore durante il login: {str(e)}")
         finally:
+            # La connessione autenticata torna al pool condiviso e viene riusata dall'applicazione
             if self.db_connection:
                 self.db_connection.disconnect()
 
-    def _get_user_details(self, username):
-        try:
-            cursor = self.db_connection.connection.cursor()
-            cursor.execute("""
-                SELECT UserId, Name, [Name] as Username 
-                FROM dbo.[User] 
-                WHERE [name] = ?
-            """, username)
-
-            result = cursor.fetchone()
-            if result:
-                class User:
-                    def __init__(self, user_id, name, username):
-                        self.UserId = user_id
-                        self.Name = name
-                        self.Username = username
-                return User(result[0], result[1], result[2])
+    def _authenticate(self, username, password):
+        """Verifica le credenziali sul server e salva il verificatore locale; None se non valide"""
+        row = self.db_connection.authenticate(username, password)
+        if row is None:
+            self.credential_cache.forget(username)
             return None
+        user = User(row.UserId, row.Name, row.Username)
+        try:
+            self.credential_cache.store(user, password)
         except Exception as e:
-            print(f"Errore nel recupero dettagli utente: {e}")
-            return None
+            print(f"Salvataggio della verifica locale delle credenziali non riuscito: {str(e)}")
+        return user
 
     def _connect_db(self):
         try:
+            from db_connection import DatabaseConnection
             self.db_connection = DatabaseConnection(self.config_manager)
             self.db_connection.connect()
             return True
@@ -141,7 +159,7 @@ class BoxSplitterApp:
         self.main_frame.grid(row=0, column=0, sticky='nsew')
 
         self.config_manager = ConfigManager()
-        self.db_connection = DatabaseConnection(self.config_manager)
+        self.db_connection = None
         self.current_user = None
         self.current_user_id = None
         self.current_data = None
@@ -152,6 +170,17 @@ class BoxSplitterApp:
         self.batch_number_var = tk.StringVar()
         self.divisions_var = tk.IntVar(value=2)
 
+        self.executor = TaskExecutor(self.root, status_var=self.status_var)
+        self.async_runner = None
+        self.current_job = None
+
+        # Creati dal job di avvio in background (_start_services_job)
+        self.printer = None
+        self.print_outbox = None
+        self.outbox_drainer = None
+        self.cache_synchronizer = None
+        self.split_service = None
+
         self.load_printer_config()
         self.setup_ui()
         self.show_login()
@@ -161,24 +190,199 @@ class BoxSplitterApp:
         self.main_frame.grid_rowconfigure(1, weight=1)
         self.main_frame.grid_columnconfigure(0, weight=1)
 
-        # CORREZIONE: Inizializzazione corretta della stampante
-        self.printer = None
+        # Database, stampante e coda di stampa vengono preparati mentre
+        # l'operatore inserisce le credenziali. Il job è il primo della coda
+        # dell'executor: ricerche e split accodati dopo lo trovano completato.
+        self.status_var.set("Avvio servizi in corso...")
+        self.executor.submit(self._start_services_job, name='avvio',
+                             on_success=self._on_services_ready,
+                             on_error=self._on_services_error)
+
+    def _start_services_job(self, job):
+        """Eseguito sul thread di lavoro: crea i servizi e apre in anticipo le connessioni"""
+        from db_connection import DatabaseConnection
+        from print_outbox import PrintOutbox, OutboxDrainer
+        from local_cache import LocalCache, CacheSynchronizer
+
+        self.db_connection = DatabaseConnection(self.config_manager)
         self._initialize_printer()
 
+        # Coda di stampa persistente svuotata in background
+        print_outbox = PrintOutbox()
+        # Le etichette incerte vengono mostrate all'operatore in _on_services_ready
+        uncertain = print_outbox.recover()
+        outbox_drainer = OutboxDrainer(print_outbox, self._get_ready_printer,
+                                       on_status=self._on_outbox_status)
+        self.print_outbox = print_outbox
+        self.outbox_drainer = outbox_drainer
+        if self.printer is not None:
+            from printer_pool import status_monitors
+            for monitor in status_monitors(self.printer):
+                outbox_drainer.watch(monitor)
+        try:
+            pack_rules = load_pack_rules()
+        except Exception as e:
+            print(f"Regole di confezionamento non valide, piano automatico senza regole: {str(e)}")
+            pack_rules = {}
+        # Copia locale per lavorare anche con il server non raggiungibile
+        local_cache = LocalCache()
+        self.split_service = SplitService(self.db_connection, print_outbox=print_outbox,
+                                          on_labels_queued=outbox_drainer.notify,
+                                          pack_rules=pack_rules, local_cache=local_cache)
+        self.cache_synchronizer = CacheSynchronizer(local_cache, self.split_service,
+                                                    on_status=self._on_cache_status)
+        self.split_service.on_split_queued = self.cache_synchronizer.notify
+        profiler.mark("servizi creati")
+
+        # La stampante si connette su un thread a parte: se non risponde non
+        # deve ritardare le ricerche accodate dopo questo job
+        def warm_printer():
+            if self._ensure_printer_connection():
+                profiler.mark("stampante connessa")
+            outbox_drainer.start()
+
+        threading.Thread(target=warm_printer, name="PrinterWarmUp", daemon=True).start()
+
+        # Warm-up del pool: handshake TLS e login al database prima della prima ricerca
+        try:
+            self.db_connection.pool.warm()
+            profiler.mark("pool database pronto")
+        except Exception as e:
+            print(f"Connessione anticipata al database non riuscita: {str(e)}")
+
+        # Procedura di split sul server (sql/usp_SplitBox.sql) se installata, altrimenti batch SQL
+        try:
+            self.split_service.split_writer = self.db_connection.run(create_split_writer)
+        except Exception as e:
+            print(f"Verifica della procedura di split non riuscita: {str(e)}")
+        self.cache_synchronizer.start()
+        return uncertain
+
+    def _on_services_ready(self, uncertain):
+        self.status_var.set("Pronto")
+        if profiler.enabled:
+            profiler.mark("avvio completato")
+            profiler.uninstall()
+            profiler.write_report()
+        self._update_uncertain_button(uncertain)
+        if uncertain:
+            messagebox.showwarning("Etichette da verificare",
+                                   f"{uncertain} etichette sono state interrotte durante l'invio alla "
+                                   f"stampante e potrebbero non essere state stampate.\n"
+                                   f"Verificare e scegliere quali ristampare.")
+            self.show_uncertain_labels()
+
+    def _on_services_error(self, error):
+        self.status_var.set("Errore durante l'avvio")
+        messagebox.showerror("Errore", f"Errore durante l'avvio dei servizi: {str(error)}")
+
+    def _get_ready_printer(self):
+        """Eseguito dal thread della coda di stampa: restituisce la stampante connessa o None"""
+        if self._ensure_printer_connection():
+            return self.printer
+        return None
+
+    def _on_outbox_status(self, message, pending):
+        """Riceve dal thread della coda di stampa lo stato e lo riporta sull'interfaccia"""
+        from print_outbox import UNCERTAIN
+        text = f"{message} - etichette in coda: {pending}"
+        uncertain = self.print_outbox.count(UNCERTAIN)
+
+        def update():
+            self.outbox_label.config(text=text)
+            self._update_uncertain_button(uncertain)
+
+        self.executor.call_soon(update)
+
+    def _update_uncertain_button(self, uncertain):
+        """Mostra il pulsante delle etichette da verificare solo se ce ne sono"""
+        if uncertain:
+            self.uncertain_button.config(text=f"Etichette da verificare: {uncertain}")
+            self.uncertain_button.grid()
+        else:
+            self.uncertain_button.grid_remove()
+
+    def show_uncertain_labels(self):
+        """Elenco delle etichette interrotte durante l'invio: ristampa o conferma dell'operatore"""
+        if self.print_outbox is None:
+            return
+        window = tk.Toplevel(self.root)
+        window.title("Etichette da verificare")
+        window.geometry("640x320")
+        window.transient(self.root)
+
+        ttk.Label(window, text="Invio interrotto: controllare sulla stampante quali etichette sono uscite",
+                  wraplength=600).grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
+
+        columns = ('batch_number', 'item_code', 'quantity', 'created_at')
+        headings = ('Batch Number', 'Codice', 'Quantità', 'Accodata')
+        tree = ttk.Treeview(window, columns=columns, show='headings', selectmode='extended')
+        for column, heading in zip(columns, headings):
+            tree.heading(column, text=heading)
+            tree.column(column, width=140)
+        tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=5)
+
+        def refresh():
+            tree.delete(*tree.get_children())
+            labels = self.print_outbox.list_uncertain()
+            for label in labels:
+                tree.insert('', tk.END, iid=str(label['id']), values=(
+                    label['batch_number'], label['item_code'], label['quantity'],
+                    time.strftime('%d/%m/%Y %H:%M', time.localtime(label['created_at']))))
+            self._update_uncertain_button(len(labels))
+
+        def selected_ids():
+            ids = [int(iid) for iid in tree.selection()]
+            if not ids:
+                messagebox.showwarning("Attenzione", "Selezionare almeno un'etichetta", parent=window)
+            return ids
+
+        def reprint():
+            ids = selected_ids()
+            if ids:
+                self.print_outbox.requeue(ids)
+                self.outbox_drainer.notify()
+                refresh()
+
+        def dismiss():
+            ids = selected_ids()
+            if ids and messagebox.askyesno("Conferma", f"Confermi che le {len(ids)} etichette selezionate "
+                                                       f"sono state stampate?", parent=window):
+                self.print_outbox.dismiss(ids)
+                refresh()
+
+        button_frame = ttk.Frame(window)
+        button_frame.grid(row=2, column=0, pady=5)
+        ttk.Button(button_frame, text="Seleziona tutte",
+                   command=lambda: tree.selection_set(tree.get_children())).grid(row=0, column=0, padx=5)
+        ttk.Button(button_frame, text="Ristampa", command=reprint).grid(row=0, column=1, padx=5)
+        ttk.Button(button_frame, text="Già stampate", command=dismiss).grid(row=0, column=2, padx=5)
+        ttk.Button(button_frame, text="Chiudi", command=window.destroy).grid(row=0, column=3, padx=5)
+
+        window.columnconfigure(0, weight=1)
+        window.rowconfigure(1, weight=1)
+        refresh()
+
+    def _on_cache_status(self, message, pending):
+        """Riceve dal thread della copia locale lo stato del server e lo riporta sulla barra di stato"""
+        text = f"{message} - split da inviare: {pending}" if pending else message
+        self.executor.call_soon(lambda: self.status_var.set(text))
+
     def _initialize_printer(self):
         """Inizializza la connessione con la stampante - VERSIONE CORRETTA"""
         try:
             if not hasattr(self, 'printer_config'):
                 self.load_printer_config()
 
-            # CORREZIONE: Crea l'istanza correttamente
-            self.printer = PrinterConnection(  # Solo questo, niente parentesi extra
-                ip_address=self.printer_config.get('ip_address'),
-                port=int(self.printer_config.get('port', 9100)),
-                timeout=5
-            )
+            # Una PrinterConnection o, con più stampanti configurate, un PrinterPool
+            from printer_pool import create_printer, status_monitors
+            self.printer = create_printer(self.printer_config, template=self._load_label_template(), timeout=5)
+            for monitor in status_monitors(self.printer):
+                monitor.subscribe(self._on_printer_status)
+                if self.outbox_drainer is not None:
+                    self.outbox_drainer.watch(monitor)
 
-            print(f"Stampante configurata: {self.printer_config.get('ip_address')}:{self.printer_config.get('port')}")
+            print(f"Stampante configurata: {self._printer_description()}")
             return True
 
         except Exception as e:
@@ -186,9 +390,38 @@ class BoxSplitterApp:
             self.printer = None
             return False
 
-    def _print_split_label_safe(self, item_code, quantity, batch_number):
-        """Metodo specifico per la stampa delle etichette split"""
-        return self._print_label_safe(item_code, quantity, batch_number)
+    def _on_printer_status(self, monitor):
+        """Riceve dal monitor (thread di stato) i cambi della stampante e li mostra sull'interfaccia"""
+        from printer_pool import status_monitors
+        monitors = status_monitors(self.printer) if self.printer is not None else [monitor]
+        if len(monitors) <= 1:
+            text = f"Stato: {monitor.describe()}"
+        else:
+            text = "; ".join(f"{m.ip_address}: {m.describe()}" for m in monitors)
+        color = 'black' if all(m.ready for m in monitors) else 'red'
+        self.executor.call_soon(lambda: self.printer_state_label.config(text=text, foreground=color))
+
+    def _printer_description(self):
+        """Descrizione della stampante (o delle stampanti) configurate"""
+        from printer_pool import printer_entries
+        entries = printer_entries(self.printer_config)
+        if not entries:
+            return "Non configurata"
+        return ", ".join(f"{entry['ip_address']}:{entry.get('port', 'N/A')}" for entry in entries)
+
+    def _load_label_template(self):
+        """Carica il layout etichetta indicato in printer_config.json ('label_template').
+
+        Con "label_template": null si torna all'invio del layout ZPL completo.
+        """
+        name = self.printer_config.get('label_template', 'split_box')
+        if not name:
+            return None
+        try:
+            return load_template(name)
+        except Exception as e:
+            print(f"Layout etichetta '{name}' non disponibile, uso il layout completo: {str(e)}")
+            return None
 
     def setup_ui(self):
         # Frame principale
@@ -252,6 +485,7 @@ class BoxSplitterApp:
 
         ttk.Button(user_frame, text="Login", command=self.show_login).pack(side=tk.RIGHT, padx=5)
         ttk.Button(user_frame, text="Logout", command=self.logout).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(user_frame, text="Diagnostica", command=self.show_diagnostics).pack(side=tk.RIGHT, padx=5)
 
     def _setup_search_frame(self, parent):
         search_frame = ttk.LabelFrame(parent, text="Cerca Scatola", padding="5")
@@ -311,6 +545,7 @@ class BoxSplitterApp:
         divisions_spinbox.bind('<Return>', lambda e: self.input_quantities())
 
         ttk.Button(split_frame, text="Inserisci Quantità", command=self.input_quantities).grid(row=0, column=2, padx=5)
+        ttk.Button(split_frame, text="Sessione multipla", command=self.show_session).grid(row=0, column=3, padx=5)
 
     def _validate_divisions(self, value):
         """Valida l'input del numero di divisioni"""
@@ -329,12 +564,60 @@ class BoxSplitterApp:
         ttk.Button(printer_frame, text="Configura Stampante", command=self.configure_printer).grid(row=0, column=0,
                                                                                                    padx=5)
         self.printer_label = ttk.Label(printer_frame,
-                                       text=f"Stampante: {self.printer_config.get('ip_address', 'Non configurata')}:{self.printer_config.get('port', 'N/A')}")
+                                       text=f"Stampante: {self._printer_description()}")
         self.printer_label.grid(row=0, column=1, padx=5)
 
+        self.outbox_label = ttk.Label(printer_frame, text="")
+        self.outbox_label.grid(row=0, column=2, padx=5)
+
+        # Visibile solo con etichette interrotte durante l'invio (stato incerto)
+        self.uncertain_button = ttk.Button(printer_frame, text="", command=self.show_uncertain_labels)
+        self.uncertain_button.grid(row=0, column=3, padx=5)
+        self.uncertain_button.grid_remove()
+
+        # Stato letto dal monitor (~HS/~HQES), aggiornato a ogni cambio
+        self.printer_state_label = ttk.Label(printer_frame, text="")
+        self.printer_state_label.grid(row=1, column=0, columnspan=3, sticky=tk.W, padx=5)
+
     def _setup_status_bar(self, parent):
         status_bar = ttk.Label(parent, textvariable=self.status_var, relief=tk.SUNKEN)
-        status_bar.grid(row=6, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=5)
+        status_bar.grid(row=6, column=0, sticky=(tk.W, tk.E), pady=5)
+
+        self.cancel_button = ttk.Button(parent, text="Annulla operazione", command=self.cancel_current_job,
+                                        state=tk.DISABLED)
+        self.cancel_button.grid(row=6, column=1, sticky=tk.E, padx=5, pady=5)
+
+    def _run_in_background(self, func, *args, on_success=None, on_error=None, on_cancel=None, name=None):
+        """Esegue func su un thread di lavoro e riporta l'esito sul thread di Tk"""
+        def finish(callback):
+            def wrapper(*result):
+                if self.current_job is job:
+                    self.current_job = None
+                    self.cancel_button.config(state=tk.DISABLED)
+                if callback:
+                    callback(*result)
+            return wrapper
+
+        job = self.executor.submit(func, *args, name=name,
+                                   on_success=finish(on_success),
+                                   on_error=finish(on_error),
+                                   on_cancel=finish(on_cancel))
+        self.current_job = job
+        self.cancel_button.config(state=tk.NORMAL)
+        return job
+
+    def _is_busy(self):
+        """Segnala all'utente se è già in corso un'operazione"""
+        if self.current_job is not None and not self.current_job.done:
+            messagebox.showwarning("Attenzione", "Operazione in corso, attendere il completamento")
+            return True
+        return False
+
+    def cancel_current_job(self):
+        """Annulla l'operazione in corso"""
+        if self.current_job is not None:
+            self.current_job.cancel()
+            self.status_var.set("Annullamento in corso...")
 
     def show_login(self):
         """Mostra la finestra di login"""
@@ -361,6 +644,8 @@ class BoxSplitterApp:
             self.info_text.delete(1.0, tk.END)
             self.batch_number_var.set("")
             self.current_data = None
+            if self.split_service:
+                self.split_service.batch_index.clear()
             self.is_logged_in = False
         else:
             messagebox.showinfo("Info", "Nessun utente loggato")
@@ -371,17 +656,19 @@ class BoxSplitterApp:
             with open(self.printer_config_file, 'r') as f:
                 self.printer_config = json.load(f)
 
-            # Validazione dei parametri necessari
+            # Validazione dei parametri necessari: una stampante o una lista "printers"
+            entries = self.printer_config.get('printers') or [self.printer_config]
             required_params = ['ip_address', 'port', 'printer_name']
-            missing_params = [param for param in required_params
-                              if param not in self.printer_config]
+            for entry in entries:
+                missing_params = [param for param in required_params
+                                  if param not in entry]
 
-            if missing_params:
-                raise ValueError(f"Parametri mancanti nel file di configurazione: {missing_params}")
+                if missing_params:
+                    raise ValueError(f"Parametri mancanti nel file di configurazione: {missing_params}")
 
-            # Validazione del tipo di dati
-            if not isinstance(self.printer_config['port'], (int, str)):
-                raise ValueError("Il parametro 'port' deve essere un numero")
+                # Validazione del tipo di dati
+                if not isinstance(entry['port'], (int, str)):
+                    raise ValueError("Il parametro 'port' deve essere un numero")
 
         except FileNotFoundError:
             messagebox.showerror("Errore",
@@ -408,27 +695,34 @@ class BoxSplitterApp:
             with open(self.printer_config_file, 'w') as f:
                 json.dump(self.printer_config, f, indent=4)
             self.printer_label.config(
-                text=f"Stampante: {self.printer_config.get('ip_address', 'Non configurata')}:{self.printer_config.get('port', 'N/A')}")
+                text=f"Stampante: {self._printer_description()}")
         except Exception as e:
             messagebox.showerror("Errore", f"Impossibile salvare la configurazione: {str(e)}")
 
     def search_batch(self):
         """Cerca il batch number nel database"""
-        if not self._validate_search_prerequisites():
+        if not self._validate_search_prerequisites() or self._is_busy():
             return
 
         batch_number = self.batch_number_var.get().strip()
-        try:
-            if not self._ensure_database_connection():
-                return
+        self.status_var.set(f"Ricerca di {batch_number} in corso...")
 
-            result = self._execute_batch_search(batch_number)
+        def on_success(result):
             if result:
                 self._display_batch_info(result)
             else:
                 self._handle_batch_not_found(batch_number)
-        except Exception as e:
-            self._handle_search_error(e)
+
+        self._run_in_background(self._search_batch_job, batch_number,
+                                on_success=on_success,
+                                on_error=self._handle_search_error,
+                                on_cancel=lambda: self.status_var.set("Ricerca annullata"),
+                                name="search_batch")
+
+    def _search_batch_job(self, job, batch_number):
+        """Eseguito sul thread di lavoro: ricerca del batch con una connessione del pool"""
+        job.check_cancelled()
+        return self.split_service.find_batch(batch_number)
 
     def _validate_search_prerequisites(self):
         """Valida i prerequisiti per la ricerca"""
@@ -440,48 +734,15 @@ class BoxSplitterApp:
             return False
         return True
 
-    def _ensure_database_connection(self):
-        """Assicura che la connessione al database sia attiva"""
-        try:
-            if not self.db_connection or not self.db_connection.is_connected():
-                self.db_connection.connect()
-            return True
-        except Exception as e:
-            messagebox.showerror("Errore Database", f"Impossibile connettersi al database: {str(e)}")
-            return False
-
-    def _execute_batch_search(self, batch_number):
-        """Esegue la query di ricerca del batch"""
-        cursor = self.db_connection.connection.cursor()
-        cursor.execute("""
-            SELECT 
-                i.incomingid, 
-                id.incomingdetid, 
-                i.number, 
-                it.itemid, 
-                it.Code, 
-                p.BatchNumber_HU, 
-                p.Qty AS PackQty, 
-                id.Qty AS IncomingQty, 
-                l.locationid, 
-                l.Code AS LocationCode,
-                p.PackingId
-            FROM dbo.incoming i 
-            INNER JOIN dbo.incomingdet id ON i.IncomingId = id.incomingid	
-            INNER JOIN dbo.item it ON it.itemid = id.ItemId 
-            INNER JOIN dbo.packing p ON id.IncomingDetId = p.IncomingDetId 
-            INNER JOIN dbo.Location L ON p.LocationId = l.locationid
-            WHERE p.BatchNumber_HU = ?
-        """, batch_number)
-        return cursor.fetchone()
-
     def _display_batch_info(self, result):
         """Visualizza le informazioni del batch trovato"""
+        # Copia tipizzata della riga: non tiene in vita il cursore pyodbc
+        result = BatchRecord.from_row(result)
         self.current_data = result
         info_text = f"""Codice Prodotto: {result.Code}
 Numero Incoming: {result.number}
 Quantità Iniziale: {result.IncomingQty}
-Quantità Packing: {result.PackQty}
+Quantità Packing: {format_quantity(result.PackQty)}
 Locazione: {result.LocationCode}
 Batch Number: {result.BatchNumber_HU}"""
 
@@ -515,125 +776,112 @@ Batch Number: {result.BatchNumber_HU}"""
         self._show_quantities_dialog(divisions)
 
     #Funzione aggiunta per validare oltre 11 scatole fino a 100
-    def _show_quantities_dialog(self, divisions):
-        """Mostra la finestra di dialogo per l'inserimento delle quantità"""
-        dialog = tk.Toplevel(self.root)
+    def _show_quantities_dialog(self, divisions, data=None, on_confirm=None, parent=None):
+        """Mostra la finestra di dialogo per l'inserimento delle quantità.
+
+        Di default divide la scatola corrente; la sessione multipla passa la
+        propria scatola (data) e riceve le quantità confermate in on_confirm.
+        """
+        data = data if data is not None else self.current_data
+        on_confirm = on_confirm or self.perform_split
+        try:
+            decimals = self.split_service.decimals(data)
+        except ValueError as e:
+            messagebox.showerror("Errore", str(e), parent=parent or self.root)
+            return
+        dialog = tk.Toplevel(parent or self.root)
         dialog.title("Inserisci Quantità")
         dialog.geometry("400x600")  # Aumentiamo l'altezza della finestra
-        dialog.transient(self.root)
+        dialog.transient(parent or self.root)
         dialog.grab_set()
 
-        # Frame principale con scrollbar
         container = ttk.Frame(dialog)
         container.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
 
-        # Canvas e scrollbar
-        canvas = tk.Canvas(container)
-        scrollbar = ttk.Scrollbar(container, orient="vertical", command=canvas.yview)
-        scrollable_frame = ttk.Frame(canvas)
+        # Visualizzazione quantità totale
+        total_qty = to_decimal(data.PackQty)
+        ttk.Label(container, text=f"Quantità totale: {format_quantity(total_qty)}",
+                  font=('Arial', 10, 'bold')).grid(row=0, column=0, columnspan=3, pady=10)
+
+        # Inserimento rapido: '10x12, 1x5' = 10 scatole da 12 e una da 5
+        spec_var = tk.StringVar()
+        ttk.Label(container, text="Rapido (es. 10x12, 1x5):").grid(row=1, column=0, sticky=tk.W)
+        spec_entry = ttk.Entry(container, textvariable=spec_var, width=18)
+        spec_entry.grid(row=1, column=1, padx=5)
+
+        # Solo le righe visibili hanno dei widget: le quantità stanno nel modello
+        model = QuantityModel(divisions, decimals=decimals)
+        summary_var = tk.StringVar()
+
+        def update_summary(message=None):
+            if message:
+                summary_var.set(message)
+                return
+            remaining = total_qty - model.total
+            summary_var.set(f"Scatole: {len(model)} - inserito: {format_quantity(model.total)} - "
+                            f"residuo: {format_quantity(remaining)}")
 
-        scrollable_frame.bind(
-            "<Configure>",
-            lambda e: canvas.configure(scrollregion=canvas.bbox("all"))
-        )
+        grid = QuantityGrid(container, model, on_change=update_summary)
+        grid.grid(row=3, column=0, columnspan=3, pady=10, sticky=tk.W)
 
-        canvas.create_window((0, 0), window=scrollable_frame, anchor="nw")
-        canvas.configure(yscrollcommand=scrollbar.set)
+        def apply_spec(event=None):
+            try:
+                grid.load(parse_quantity_spec(spec_var.get()))
+                grid.focus_row(0)
+            except ValueError as e:
+                messagebox.showerror("Errore", str(e), parent=dialog)
 
-        # Configurazione grid
-        container.grid_columnconfigure(0, weight=1)
+        ttk.Button(container, text="Applica", command=apply_spec).grid(row=1, column=2)
+        spec_entry.bind('<Return>', apply_spec)
 
-        # Visualizzazione quantità totale
-        total_qty = float(self.current_data.PackQty)
-        ttk.Label(scrollable_frame, text=f"Quantità totale: {total_qty}",
-                  font=('Arial', 10, 'bold')).grid(row=0, column=0, columnspan=2, pady=10)
-
-        # Lista per tenere traccia delle entry
-        entries = []
-
-        # Creazione delle entry per le quantità
-        for i in range(divisions):
-            ttk.Label(scrollable_frame, text=f"Quantità {i + 1}:").grid(
-                row=i + 1, column=0, sticky=tk.W, pady=5)
-            entry_var = tk.StringVar()
-            entry = ttk.Entry(scrollable_frame, textvariable=entry_var, width=15)
-            entry.grid(row=i + 1, column=1, padx=5, pady=5)
-            entries.append(entry_var)
-
-            if i < divisions - 1:
-                entry.bind('<Return>',
-                           lambda e, next_idx=i + 1: scrollable_frame.grid_slaves(
-                               row=next_idx + 1, column=1)[0].focus())
+        # Piano automatico: scatole piene da N pezzi (proposto da pack_rules.json)
+        # oppure parti uguali sul numero di scatole attuale
+        try:
+            rule_box_size = rule_for(self.split_service.pack_rules, data.Code).box_size
+        except ValueError:
+            rule_box_size = None
+        box_size_var = tk.StringVar(value=str(rule_box_size) if rule_box_size is not None else "")
+        plan_frame = ttk.Frame(container)
+        plan_frame.grid(row=2, column=0, columnspan=3, sticky=tk.W, pady=5)
+        ttk.Label(plan_frame, text="Pezzi per scatola:").pack(side=tk.LEFT)
+        ttk.Entry(plan_frame, textvariable=box_size_var, width=8).pack(side=tk.LEFT, padx=5)
+
+        def apply_plan(**rule):
+            try:
+                grid.load(self.split_service.plan(data, **rule))
+                grid.focus_row(0)
+            except ValueError as e:
+                messagebox.showerror("Errore", str(e), parent=dialog)
+
+        ttk.Button(plan_frame, text="Calcola",
+                   command=lambda: apply_plan(box_size=box_size_var.get())).pack(side=tk.LEFT, padx=5)
+        ttk.Button(plan_frame, text="Parti uguali",
+                   command=lambda: apply_plan(boxes=len(model))).pack(side=tk.LEFT, padx=5)
+
+        ttk.Label(container, textvariable=summary_var).grid(row=4, column=0, columnspan=3, sticky=tk.W)
+        update_summary()
 
         # Frame per i pulsanti
-        button_frame = ttk.Frame(scrollable_frame)
-        button_frame.grid(row=divisions + 1, column=0, columnspan=2, pady=20)
+        button_frame = ttk.Frame(container)
+        button_frame.grid(row=5, column=0, columnspan=3, pady=20)
 
         def validate_and_split():
             try:
-                quantities = []
-                for i, entry_var in enumerate(entries):
-                    value = entry_var.get().strip()
-                    if not value:
-                        raise ValueError(f"Inserire la quantità {i + 1}")
-                    quantities.append(float(value))
-
-                if abs(sum(quantities) - total_qty) > 0.01:
-                    raise ValueError(
-                        f"La somma delle quantità ({sum(quantities)}) non corrisponde al totale ({total_qty})")
+                grid.commit()
+                quantities = self.split_service.validate_quantities(data, model.quantities())
 
                 dialog.destroy()
-                self.perform_split(quantities)
+                on_confirm(quantities)
             except ValueError as e:
-                messagebox.showerror("Errore", str(e))
+                messagebox.showerror("Errore", str(e), parent=dialog)
 
         ttk.Button(button_frame, text="Conferma",
                    command=validate_and_split).pack(side=tk.LEFT, padx=10)
         ttk.Button(button_frame, text="Annulla",
                    command=dialog.destroy).pack(side=tk.LEFT, padx=10)
 
-        # Configurazione scrollbar
-        scrollbar.pack(side="right", fill="y")
-        canvas.pack(side="left", fill="both", expand=True)
-
         # Focus sul primo campo
-        if entries:
-            scrollable_frame.grid_slaves(row=1, column=1)[0].focus()
-
-    def split_box(self):
-        """Gestisce l'intero processo di split della scatola"""
-        try:
-            # Validazione input
-            if not self._validate_split_input():
-                return
-
-            # Ottieni le quantità
-            quantities = self._calculate_quantities()
-            if not quantities:
-                return
-
-            # Conferma dall'utente
-            if not self._confirm_split(quantities):
-                return
-
-            # Salva nel database
-            if not self._save_split_to_database(quantities):
-                return
-
-            # Stampa le etichette
-            if not self._print_labels(quantities):
-                # Se la stampa fallisce, fai rollback del database
-                self._rollback_split()
-                return
-
-            # Aggiorna l'interfaccia
-            self._reset_after_split()
-
-            messagebox.showinfo("Successo", "Operazione completata con successo!")
-
-        except Exception as e:
-            messagebox.showerror("Errore", f"Errore durante lo split: {str(e)}")
-            self._rollback_split()
+        grid.focus_row(0)
 
     def perform_split(self, quantities):
         """Esegue lo split delle quantità"""
@@ -641,154 +889,37 @@ Batch Number: {result.BatchNumber_HU}"""
             messagebox.showerror("Errore", "Nessun dato disponibile per lo split")
             return
 
-        if not self._ensure_database_connection():
+        if self._is_busy():
             return
 
-        # Prepara tutte le etichette da stampare
-        labels_to_print = []
-        labels_to_print.append({
-            'item_code': self.current_data.Code,
-            'quantity': str(quantities[0]),
-            'batch_number': self.current_data.BatchNumber_HU
-        })
-
-        for i, qty in enumerate(quantities[1:], 1):
-            new_batch_number = f"{self.current_data.BatchNumber_HU}_{i}"
-            labels_to_print.append({
-                'item_code': self.current_data.Code,
-                'quantity': str(qty),
-                'batch_number': new_batch_number
-            })
-
-        print("Inizio processo di stampa etichette...")
-        current_label_index = 0
-
-        while current_label_index < len(labels_to_print):
-            label = labels_to_print[current_label_index]
-            print(f"Tentativo di stampa etichetta {current_label_index + 1} di {len(labels_to_print)}")
-
-            try:
-                success = self._print_label_safe(
-                    item_code=label['item_code'],
-                    quantity=label['quantity'],
-                    batch_number=label['batch_number']
-                )
-
-                if success:
-                    print(f"Etichetta {current_label_index + 1} stampata con successo")
-                    current_label_index += 1
-                else:
-                    raise Exception("Errore durante la stampa dell'etichetta")
-
-            except Exception as e:
-                error_message = f"Errore durante la stampa dell'etichetta {current_label_index + 1}:\n{str(e)}\nVuoi riprovare?"
-                response = messagebox.askretrycancel("Errore Stampa", error_message)
-
-                if not response:
-                    messagebox.showerror("Operazione Annullata", "Split annullato. Nessuna modifica salvata.")
-                    return
-
-        # Se tutte le etichette sono stampate, salva nel database
-        self._save_split_to_database(quantities)
-
-    def _rollback_split(self):
-        """Esegue il rollback delle modifiche in caso di errore"""
-        try:
-            if self.db_connection.connection:
-                self.db_connection.connection.rollback()
-                print("Eseguito rollback delle modifiche al database")
-        except Exception as e:
-            print(f"Errore durante il rollback: {str(e)}")
-
-    def _save_split_to_database(self, quantities):
-        """Salva le modifiche dello split nel database"""
-        try:
-            with self.db_connection.connection as connection:
-                cursor = connection.cursor()
-                original_was = f"1 x {self.current_data.PackQty}"
-
-                cursor.execute("""
-                    UPDATE dbo.incomingdet
-                    SET Qty = ?, OriginalWas = ?
-                    WHERE incomingdetid = ?
-                """, quantities[0], original_was, self.current_data.incomingdetid)
-
-                cursor.execute("""
-                    UPDATE dbo.Packing
-                    SET qty = ?, BatchNumber_HU = ?
-                    WHERE packingid = ?
-                """, quantities[0], self.current_data.BatchNumber_HU, self.current_data.PackingId)
-
-                for i, qty in enumerate(quantities[1:], 1):
-                    new_batch_number = f"{self.current_data.BatchNumber_HU}-{i}"
-
-                    cursor.execute("""
-                        INSERT INTO dbo.incomingdet
-                        (incomingid, itemid, batchnumber, Qty, OriginalWas)
-                        OUTPUT INSERTED.IncomingDetId
-                        VALUES (?, ?, ?, ?, ?)
-                    """, self.current_data.incomingid, self.current_data.itemid,
-                                   new_batch_number, qty, original_was)
-
-                    new_incomingdet_id = cursor.fetchone()[0]
-
-                    cursor.execute("""
-                        INSERT INTO dbo.packing
-                        (IncomingDetId, LocationId, Qty, Code, BatchNumber_HU,[CurrentDate],UserId)
-                        VALUES (?, ?, ?, ?, ?,GetDate(),?)
-                    """, new_incomingdet_id, self.current_data.locationid,
-                                   qty, new_batch_number, new_batch_number, self.current_user_id)
-
-                    cursor.execute("""
-                        INSERT INTO dbo.SplitBoxes
-                        (UserId, IncomingDetid)
-                        VALUES (?, ?)
-                    """, self.current_user_id, new_incomingdet_id)
-
-                connection.commit()
-                messagebox.showinfo("Successo", "Split e stampa completati con successo!")
-                self._reset_after_split()
-
-        except Exception as e:
-            if self.db_connection.connection:
-                self.db_connection.connection.rollback()
-            messagebox.showerror("Errore", f"Errore durante il salvataggio: {str(e)}")
-
-    def _confirm_split(self, quantities):
-        """Chiede conferma all'utente per lo split"""
-        message = "Confermi di voler dividere la scatola nelle seguenti quantità?\n\n"
-        message += f"Scatola originale: {quantities[0]} pezzi\n"
-        for i, qty in enumerate(quantities[1:], 1):
-            message += f"Nuova scatola {i}: {qty} pezzi\n"
-
-        return messagebox.askyesno("Conferma Split", message)
-
-    def _validate_split_input(self):
-        """Valida i dati di input prima dello split"""
-        try:
-            # Verifica che ci siano dati correnti
-            if not hasattr(self, 'current_data') or not self.current_data:
-                raise ValueError("Nessun dato selezionato per lo split")
-
-            # Verifica che l'utente sia loggato
-            if not hasattr(self, 'current_user_id') or not self.current_user_id:
-                raise ValueError("Utente non autenticato")
-
-            # Verifica connessione database
-            if not self.db_connection or not self.db_connection.connection:
-                raise ValueError("Connessione al database non disponibile")
-
-            # Verifica che la quantità totale sia corretta
-            total_qty = sum(self._calculate_quantities())
-            if total_qty != self.current_data.PackQty:
-                raise ValueError(
-                    f"La quantità totale ({total_qty}) non corrisponde alla quantità originale ({self.current_data.PackQty})")
-
-            return True
-
-        except Exception as e:
-            messagebox.showerror("Errore Validazione", str(e))
-            return False
+        data = self.current_data
+        self.status_var.set("Salvataggio dello split in corso...")
+        self._run_in_background(self._split_job, data, quantities,
+                                on_success=self._on_split_saved,
+                                on_error=self._on_split_save_error,
+                                on_cancel=lambda: self.status_var.set("Split annullato"),
+                                name="perform_split")
+
+    def _split_job(self, job, data, quantities):
+        """Eseguito sul thread di lavoro: salva lo split e accoda le etichette"""
+        labels = self.split_service.split(data, quantities, self.current_user_id,
+                                          check_cancelled=job.check_cancelled)
+        return len(labels)
+
+    def _on_split_saved(self, label_count):
+        messagebox.showinfo("Successo", f"Split completato con successo!\n"
+                                        f"{label_count} etichette inviate alla coda di stampa.")
+        self._reset_after_split()
+
+    def _on_split_save_error(self, error):
+        from local_cache import SplitQueued
+        if isinstance(error, SplitQueued):
+            messagebox.showinfo("Split in attesa", str(error))
+            self._reset_after_split()
+            self.status_var.set("Split salvato sulla postazione, in attesa del server")
+            return
+        messagebox.showerror("Errore", f"Errore durante il salvataggio: {str(error)}")
+        self.status_var.set("Errore durante il salvataggio")
 
     def _ensure_printer_connection(self):
         """Verifica e ristabilisce la connessione con la stampante"""
@@ -806,43 +937,6 @@ Batch Number: {result.BatchNumber_HU}"""
             print(f"Errore di connessione alla stampante: {str(e)}")
             return False
 
-    def _print_label_safe(self, item_code, quantity, batch_number):
-        """Stampa l'etichetta con gestione degli errori"""
-        max_retries = 3
-        retry_count = 0
-
-        while retry_count < max_retries:
-            try:
-                print(f"Tentativo di stampa {retry_count + 1} per {batch_number}")
-
-                if not self._ensure_printer_connection():
-                    print("Connessione stampante non disponibile")
-                    retry_count += 1
-                    time.sleep(2)
-                    continue
-
-                success = self.printer.print_label(
-                    item_code=item_code,
-                    quantity=quantity,
-                    batch_number=batch_number
-                )
-
-                if success:
-                    print(f"Etichetta stampata con successo: {batch_number}")
-                    return True
-                else:
-                    print(f"Stampa fallita per {batch_number}")
-                    retry_count += 1
-                    time.sleep(2)
-
-            except Exception as e:
-                print(f"Errore durante la stampa (tentativo {retry_count + 1}): {str(e)}")
-                retry_count += 1
-                time.sleep(2)
-
-        print(f"Tutti i {max_retries} tentativi di stampa falliti per {batch_number}")
-        return False
-
     def print_label(self, item_code, quantity, batch_number):
         """Metodo per la stampa delle etichette con retry"""
         max_retries = 3
@@ -900,8 +994,12 @@ Batch Number: {result.BatchNumber_HU}"""
         config_window.grab_set()
 
         # Campi di configurazione
-        ip_var = tk.StringVar(value=self.printer_config.get('ip_address', ''))
-        port_var = tk.StringVar(value=str(self.printer_config.get('port', '9100')))
+        # Con più stampanti configurate la finestra modifica la prima della lista
+        from printer_pool import printer_entries
+        entries = printer_entries(self.printer_config)
+        current = entries[0] if entries else {}
+        ip_var = tk.StringVar(value=current.get('ip_address', ''))
+        port_var = tk.StringVar(value=str(current.get('port', '9100')))
 
         # Layout
         ttk.Label(config_window, text="IP Address:").grid(row=0, column=0, padx=5, pady=5, sticky=tk.W)
@@ -912,12 +1010,40 @@ Batch Number: {result.BatchNumber_HU}"""
 
         def test_connection():
             try:
-                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-                    s.settimeout(5)
-                    s.connect((ip_var.get(), int(port_var.get())))
-                    messagebox.showinfo("Successo", "Connessione alla stampante riuscita!")
-            except Exception as e:
-                messagebox.showerror("Errore", f"Impossibile connettersi alla stampante: {str(e)}")
+                tested = [{'ip_address': ip_var.get().strip(), 'port': int(port_var.get())}]
+            except ValueError:
+                messagebox.showerror("Errore", "La porta deve essere un numero valido tra 1 e 65535")
+                return
+
+            # Le altre stampanti del pool vengono interrogate in parallelo
+            tested += entries[1:]
+            self.status_var.set("Test connessione stampante in corso...")
+            from async_printer import probe_printers
+            self._get_async_runner().submit(probe_printers(tested),
+                                     on_done=show_test_result,
+                                     on_error=lambda e: messagebox.showerror(
+                                         "Errore", f"Impossibile connettersi alla stampante: {str(e)}"),
+                                     call_soon=self.executor.call_soon)
+
+        def show_test_result(results):
+            lines = []
+            for entry, status, error in results:
+                address = f"{entry['ip_address']}:{entry.get('port', 9100)}"
+                if error:
+                    lines.append(f"{address}: non raggiungibile ({error})")
+                elif status is None:
+                    lines.append(f"{address}: connessa (stato non disponibile)")
+                else:
+                    lines.append(f"{address}: {status.describe()}")
+            self.status_var.set("Test connessione stampante completato")
+
+            _, first_status, first_error = results[0]
+            if first_error:
+                messagebox.showerror("Errore", "Impossibile connettersi alla stampante:\n" + "\n".join(lines))
+            elif first_status is not None and not first_status.ready:
+                messagebox.showwarning("Attenzione", "Stampante raggiungibile ma non pronta:\n" + "\n".join(lines))
+            else:
+                messagebox.showinfo("Successo", "Connessione alla stampante riuscita!\n" + "\n".join(lines))
 
         def save_config():
             try:
@@ -926,7 +1052,9 @@ Batch Number: {result.BatchNumber_HU}"""
                 if port <= 0 or port > 65535:
                     raise ValueError("Porta non valida")
 
-                self.printer_config.update({
+                target = (self.printer_config['printers'][0] if self.printer_config.get('printers')
+                          else self.printer_config)
+                target.update({
                     'ip_address': ip_var.get().strip(),
                     'port': port
                 })
@@ -941,12 +1069,260 @@ Batch Number: {result.BatchNumber_HU}"""
         ttk.Button(config_window, text="Salva", command=save_config).grid(row=3, column=0, pady=5)
         ttk.Button(config_window, text="Annulla", command=config_window.destroy).grid(row=3, column=1, pady=5)
 
+    def _get_async_runner(self):
+        """Thread con il loop asyncio, avviato al primo test delle stampanti"""
+        if self.async_runner is None:
+            from async_printer import AsyncLoopRunner
+            self.async_runner = AsyncLoopRunner()
+        return self.async_runner
+
+    def show_diagnostics(self):
+        """Mostra le latenze misurate (query, stampe, operazioni) aggiornate ogni secondo"""
+        window = tk.Toplevel(self.root)
+        window.title("Diagnostica")
+        window.geometry("720x320")
+        window.transient(self.root)
+
+        columns = ('count', 'errors', 'mean', 'p50', 'p95', 'p99', 'max')
+        headings = ('Conteggio', 'Errori', 'Media ms', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms')
+        tree = ttk.Treeview(window, columns=columns)
+        tree.heading('#0', text='Operazione')
+        tree.column('#0', width=180)
+        for column, heading in zip(columns, headings):
+            tree.heading(column, text=heading)
+            tree.column(column, width=70, anchor=tk.E)
+        tree.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=5, pady=5)
+
+        # Riutilizzo dei cursori e delle istruzioni preparate del registro delle query
+        from query_registry import queries
+        queries_var = tk.StringVar()
+        ttk.Label(window, textvariable=queries_var).grid(row=1, column=0, sticky=tk.W, padx=5)
+
+        def reset():
+            metrics.reset()
+            queries.reset_stats()
+
+        button_frame = ttk.Frame(window)
+        button_frame.grid(row=2, column=0, pady=5)
+        ttk.Button(button_frame, text="Azzera", command=reset).grid(row=0, column=0, padx=5)
+        ttk.Button(button_frame, text="Chiudi", command=window.destroy).grid(row=0, column=1, padx=5)
+
+        window.columnconfigure(0, weight=1)
+        window.rowconfigure(0, weight=1)
+
+        def refresh():
+            if not window.winfo_exists():
+                return
+            snapshot = metrics.snapshot()
+            for name in tree.get_children():
+                if name not in snapshot:
+                    tree.delete(name)
+            for name, stats in snapshot.items():
+                values = (stats['count'], stats['errors'], f"{stats['mean_ms']:.1f}",
+                          f"{stats['p50_ms']:.1f}", f"{stats['p95_ms']:.1f}",
+                          f"{stats['p99_ms']:.1f}", f"{stats['max_ms']:.1f}")
+                if tree.exists(name):
+                    tree.item(name, values=values)
+                else:
+                    tree.insert('', tk.END, iid=name, text=name, values=values)
+
+            stats = queries.stats()
+            busiest = sorted(stats['statements'].items(), key=lambda item: item[1][0], reverse=True)[:3]
+            queries_var.set(f"Cursori riutilizzati: {stats['hits']} - preparati: {stats['misses']} - "
+                            f"aperti: {stats['open_cursors']}  |  " +
+                            ", ".join(f"{name} {count}x {mean:.1f} ms" for name, (count, mean) in busiest))
+            window.after(1000, refresh)
+
+        refresh()
+
+    def show_session(self):
+        """Sessione multipla: scansione di più scatole, piano e conferma in gruppo"""
+        if not self.current_user_id:
+            messagebox.showwarning("Attenzione", "Effettuare prima il login")
+            return
+        if self.split_service is None:
+            messagebox.showwarning("Attenzione", "Connessione al database in corso, attendere")
+            return
+
+        session = SplitSession(self.split_service)
+        window = tk.Toplevel(self.root)
+        window.title("Sessione multipla")
+        window.geometry("760x480")
+        window.transient(self.root)
+
+        # Scansione: ogni batch number viene cercato sul thread di lavoro
+        scan_frame = ttk.Frame(window)
+        scan_frame.grid(row=0, column=0, sticky=(tk.W, tk.E), padx=5, pady=5)
+        scan_var = tk.StringVar()
+        ttk.Label(scan_frame, text="Batch Number:").pack(side=tk.LEFT)
+        scan_entry = ttk.Entry(scan_frame, textvariable=scan_var, width=30)
+        scan_entry.pack(side=tk.LEFT, padx=5)
+        session_status = tk.StringVar(value="Scansionare le scatole da dividere")
+
+        columns = ('item', 'qty', 'boxes', 'status')
+        headings = ('Articolo', 'Quantità', 'Scatole', 'Stato')
+        tree = ttk.Treeview(window, columns=columns, selectmode='browse')
+        tree.heading('#0', text='Batch Number')
+        tree.column('#0', width=180)
+        for column, heading in zip(columns, headings):
+            tree.heading(column, text=heading)
+            tree.column(column, width=110)
+        tree.column('status', width=240)
+        tree.grid(row=1, column=0, sticky=(tk.W, tk.E, tk.N, tk.S), padx=5, pady=5)
+
+        def refresh():
+            for entry in session.entries:
+                status = f"{entry.status}: {entry.error}" if entry.error else entry.status
+                values = (entry.data.Code, format_quantity(entry.data.PackQty),
+                          len(entry.quantities) if entry.quantities else "", status)
+                if tree.exists(entry.batch_number):
+                    tree.item(entry.batch_number, values=values)
+                else:
+                    tree.insert('', tk.END, iid=entry.batch_number, text=entry.batch_number, values=values)
+            for iid in tree.get_children():
+                if session.get(iid) is None:
+                    tree.delete(iid)
+
+        def on_found(batch_number, data):
+            if not window.winfo_exists():
+                return
+            if data is None:
+                window.bell()
+                session_status.set(f"Batch number '{batch_number}' non trovato")
+                return
+            try:
+                session.add_data(data)
+            except ValueError as e:
+                window.bell()
+                session_status.set(str(e))
+                return
+            refresh()
+            session_status.set(f"Scatole nella sessione: {len(session)} - "
+                               f"pezzi: {format_quantity(session.batches().total('PackQty'))}")
+
+        def scan(event=None):
+            batch_number = scan_var.get().strip()
+            scan_var.set("")
+            if not batch_number:
+                return
+            if session.get(batch_number) is not None:
+                window.bell()
+                session_status.set(f"Batch number '{batch_number}' già presente nella sessione")
+                return
+            # Le ricerche si accodano: l'operatore può continuare a scansionare
+            self.executor.submit(lambda job: self.split_service.find_batch(batch_number),
+                                 on_success=lambda data: on_found(batch_number, data),
+                                 on_error=lambda e: session_status.set(f"Errore nella ricerca: {str(e)}"),
+                                 name="session_search")
+
+        scan_entry.bind('<Return>', scan)
+        ttk.Button(scan_frame, text="Aggiungi", command=scan).pack(side=tk.LEFT, padx=5)
+
+        # Piano automatico per tutte le scatole: pezzi per scatola o regole di pack_rules.json
+        plan_frame = ttk.Frame(window)
+        plan_frame.grid(row=2, column=0, sticky=tk.W, padx=5)
+        box_size_var = tk.StringVar()
+        ttk.Label(plan_frame, text="Pezzi per scatola:").pack(side=tk.LEFT)
+        ttk.Entry(plan_frame, textvariable=box_size_var, width=8).pack(side=tk.LEFT, padx=5)
+
+        def plan_all():
+            try:
+                planned = session.plan_all(replace=True, box_size=box_size_var.get().strip() or None)
+            except ValueError as e:
+                messagebox.showerror("Errore", str(e), parent=window)
+                return
+            refresh()
+            session_status.set(f"Scatole pianificate: {planned} di {len(session)}")
+
+        def edit_selected():
+            selection = tree.selection()
+            if not selection:
+                return
+            entry = session.get(selection[0])
+            if entry.status == DONE:
+                return
+
+            def assign(quantities):
+                session.assign(entry.batch_number, quantities)
+                refresh()
+
+            divisions = len(entry.quantities) if entry.quantities else 2
+            self._show_quantities_dialog(divisions, data=entry.data, on_confirm=assign, parent=window)
+
+        def remove_selected():
+            for iid in tree.selection():
+                session.remove(iid)
+            refresh()
+            session_status.set(f"Scatole nella sessione: {len(session)} - "
+                               f"pezzi: {format_quantity(session.batches().total('PackQty'))}")
+
+        ttk.Button(plan_frame, text="Pianifica tutte", command=plan_all).pack(side=tk.LEFT, padx=5)
+        ttk.Button(plan_frame, text="Quantità...", command=edit_selected).pack(side=tk.LEFT, padx=5)
+        ttk.Button(plan_frame, text="Rimuovi", command=remove_selected).pack(side=tk.LEFT, padx=5)
+        tree.bind('<Double-1>', lambda e: edit_selected())
+        tree.bind('<Delete>', lambda e: remove_selected())
+
+        def on_committed(result):
+            done, failed, label_count = result
+            refresh()
+            session_status.set(f"Divise: {done} - errori: {failed} - etichette: {label_count}")
+            if failed:
+                messagebox.showwarning("Attenzione", f"{failed} scatole non sono state divise: "
+                                                     f"confermare di nuovo per riprovare", parent=window)
+            else:
+                messagebox.showinfo("Successo", f"{done} scatole divise.\n"
+                                                f"{label_count} etichette inviate alla coda di stampa.",
+                                    parent=window)
+            self.status_var.set("Pronto")
+
+        def commit_all():
+            pending = session.pending()
+            if not pending:
+                messagebox.showwarning("Attenzione", "Nessuna scatola pronta da dividere", parent=window)
+                return
+            if self._is_busy():
+                return
+            if not messagebox.askyesno("Conferma Split", f"Confermi lo split di {len(pending)} scatole?",
+                                       parent=window):
+                return
+            self.status_var.set("Salvataggio della sessione in corso...")
+            self._run_in_background(self._session_commit_job, session,
+                                    on_success=on_committed,
+                                    on_error=lambda e: messagebox.showerror(
+                                        "Errore", f"Errore durante il salvataggio: {str(e)}", parent=window),
+                                    on_cancel=lambda: (refresh(), self.status_var.set("Sessione annullata")),
+                                    name="session_commit")
+
+        def clear_done():
+            session.clear_done()
+            refresh()
+
+        button_frame = ttk.Frame(window)
+        button_frame.grid(row=3, column=0, pady=5)
+        ttk.Button(button_frame, text="Conferma tutte", command=commit_all).grid(row=0, column=0, padx=5)
+        ttk.Button(button_frame, text="Togli divise", command=clear_done).grid(row=0, column=1, padx=5)
+        ttk.Button(button_frame, text="Chiudi", command=window.destroy).grid(row=0, column=2, padx=5)
+        ttk.Label(window, textvariable=session_status).grid(row=4, column=0, sticky=tk.W, padx=5, pady=5)
+
+        window.columnconfigure(0, weight=1)
+        window.rowconfigure(1, weight=1)
+        scan_entry.focus_set()
+
+    def _session_commit_job(self, job, session):
+        """Eseguito sul thread di lavoro: scrive la sessione a gruppi di scatole"""
+        return session.commit(self.current_user_id, check_cancelled=job.check_cancelled,
+                              on_progress=lambda done, total: job.report_progress(
+                                  f"Salvataggio sessione: {done}/{total} scatole"))
+
 
 def main():
     try:
+        profiler.mark("import completati")
         root = tk.Tk()
         app = BoxSplitterApp(root)
-        root.protocol("WM_DELETE_WINDOW", lambda: on_closing(root))
+        root.protocol("WM_DELETE_WINDOW", lambda: on_closing(root, app))
+        if profiler.enabled:
+            root.after_idle(profiler.mark, "finestra di login visibile")
         root.mainloop()
     except KeyboardInterrupt:
         print("\nApplicazione terminata dall'utente")
@@ -958,10 +1334,21 @@ def main():
         except:
             pass
 
-def on_closing(root):
+def on_closing(root, app):
     """Gestisce la chiusura pulita dell'applicazione"""
     try:
         if messagebox.askokcancel("Chiudi", "Vuoi chiudere l'applicazione?"):
+            app.executor.shutdown()
+            if app.outbox_drainer:
+                app.outbox_drainer.stop(timeout=2)
+            if app.cache_synchronizer:
+                app.cache_synchronizer.stop(timeout=2)
+            if app.printer is not None:
+                from printer_pool import status_monitors
+                for monitor in status_monitors(app.printer):
+                    monitor.stop()
+            if app.async_runner:
+                app.async_runner.stop()
             root.quit()
             root.destroy()
     except:
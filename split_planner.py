@@ -0,0 +1,131 @@
+# split_planner.py
+"""Calcolo automatico delle quantità di uno split.
+
+Dalla quantità della scatola (PackQty) e da una regola (pezzi per
+scatola, numero di scatole, numero massimo di scatole, unità minima)
+ricava l'elenco delle quantità con aritmetica decimale esatta: la somma
+del piano è sempre uguale alla quantità di partenza. La prima quantità
+resta nella scatola originale, come nello split manuale.
+
+Le regole per articolo si leggono da pack_rules.json:
+  {"default": {"unit": 1},
+   "items": {"ART-001": {"box_size": 12, "max_boxes": 100}}}
+"""
+import json
+import os
+from decimal import Decimal, InvalidOperation
+
+PACK_RULES_FILE = 'pack_rules.json'
+
+
+def to_decimal(value, name="quantità"):
+    """Converte un valore (anche float di pyodbc o testo con virgola) in Decimal"""
+    if isinstance(value, Decimal):
+        return value
+    try:
+        # str() evita di portarsi dietro l'errore di rappresentazione del float
+        return Decimal(str(value).strip().replace(',', '.'))
+    except (InvalidOperation, ValueError):
+        raise ValueError(f"Valore non valido per {name}: {value}")
+
+
+class PackRule:
+    """Regola di confezionamento: pezzi per scatola, numero di scatole e unità minima"""
+
+    def __init__(self, box_size=None, boxes=None, max_boxes=None, unit=1):
+        self.box_size = to_decimal(box_size, "pezzi per scatola") if box_size not in (None, '') else None
+        self.boxes = int(boxes) if boxes not in (None, '') else None
+        self.max_boxes = int(max_boxes) if max_boxes not in (None, '') else None
+        self.unit = to_decimal(unit, "unità") if unit not in (None, '') else Decimal(1)
+
+        if self.box_size is not None and self.box_size <= 0:
+            raise ValueError("I pezzi per scatola devono essere maggiori di zero")
+        if self.boxes is not None and self.boxes < 2:
+            raise ValueError("Il numero di scatole deve essere almeno 2")
+        if self.unit <= 0:
+            raise ValueError("L'unità minima deve essere maggiore di zero")
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(box_size=values.get('box_size'), boxes=values.get('boxes'),
+                   max_boxes=values.get('max_boxes'), unit=values.get('unit', 1))
+
+    def merged(self, **overrides):
+        """Copia della regola con i valori indicati al posto di quelli della regola"""
+        values = {'box_size': self.box_size, 'boxes': self.boxes,
+                  'max_boxes': self.max_boxes, 'unit': self.unit}
+        values.update({key: value for key, value in overrides.items() if value not in (None, '')})
+        return PackRule(**values)
+
+
+def load_pack_rules(path=PACK_RULES_FILE):
+    """Legge le regole per articolo; senza file restituisce regole vuote"""
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def rule_for(rules, item_code):
+    """Regola dell'articolo, o quella di default, o una regola vuota"""
+    values = dict(rules.get('default', {}))
+    values.update(rules.get('items', {}).get(item_code, {}))
+    return PackRule.from_dict(values)
+
+
+def plan_by_box_size(total, box_size, max_boxes=None):
+    """Scatole piene da box_size; l'eventuale resto va in un'ultima scatola"""
+    total = to_decimal(total)
+    box_size = to_decimal(box_size, "pezzi per scatola")
+    if box_size <= 0:
+        raise ValueError("I pezzi per scatola devono essere maggiori di zero")
+
+    full_boxes, remainder = divmod(total, box_size)
+    full_boxes = int(full_boxes)
+    count = full_boxes + (1 if remainder else 0)
+    if max_boxes is not None and count > max_boxes:
+        raise ValueError(f"Con {box_size} pezzi per scatola servono {count} scatole (massimo {max_boxes})")
+    quantities = [box_size] * full_boxes
+    if remainder:
+        quantities.append(remainder)
+    return quantities
+
+
+def plan_by_box_count(total, boxes, unit=Decimal(1)):
+    """Divide total in boxes scatole il più possibile uguali, a multipli di unit.
+
+    Le unità in eccesso vanno una per scatola alle prime scatole; la parte
+    di total che non è multipla di unit resta nella scatola originale.
+    """
+    total = to_decimal(total)
+    unit = to_decimal(unit, "unità")
+    units, fraction = divmod(total, unit)
+    units = int(units)
+    if units < boxes:
+        raise ValueError(f"La quantità {total} non basta per {boxes} scatole da almeno {unit}")
+
+    base, extra = divmod(units, boxes)
+    larger = unit * (base + 1)
+    smaller = unit * base
+    quantities = [larger] * extra + [smaller] * (boxes - extra)
+    if fraction:
+        quantities[0] += fraction
+    return quantities
+
+
+def plan_split(total, rule):
+    """Calcola il piano di split secondo la regola.
+
+    Con box_size vengono create scatole piene (max_boxes è il limite);
+    altrimenti total viene diviso in boxes (o max_boxes) parti uguali.
+    """
+    if rule.box_size is not None:
+        quantities = plan_by_box_size(total, rule.box_size, rule.max_boxes)
+    elif rule.boxes is not None or rule.max_boxes is not None:
+        quantities = plan_by_box_count(total, rule.boxes or rule.max_boxes, rule.unit)
+    else:
+        raise ValueError("Indicare i pezzi per scatola o il numero di scatole")
+
+    if len(quantities) < 2:
+        raise ValueError(f"La quantità {to_decimal(total)} sta in una sola scatola: nessuno split necessario")
+    return quantities
@@ -0,0 +1,301 @@
+# split_service.py
+from datetime import datetime
+
+from batch_index import BatchIndex
+from metrics import timer, timed
+from query_registry import queries
+from quantities import QUANTITY_DECIMALS, decimals_for, format_quantity, parse_quantity, to_quantity, validate_split
+from split_planner import plan_split, rule_for
+from split_writer import SplitWriter
+
+# db_connection (pyodbc) e local_cache (sqlite3) vengono importati solo dove
+# servono: split_manager importa questo modulo prima di aprire la connessione
+
+# Quantità attuale della scatola, bloccata fino alla fine della transazione di split
+CURRENT_PACK_QTY = queries.register('current_pack_qty', """
+    SELECT p.Qty AS PackQty FROM dbo.packing p WITH (UPDLOCK, ROWLOCK) WHERE p.PackingId = ?
+""")
+
+
+class SplitService:
+    """Logica di split indipendente dall'interfaccia grafica.
+
+    Raccoglie ricerca, validazione, scrittura sul database e accodamento
+    delle etichette, così da poter essere usata sia da BoxSplitterApp sia
+    dalla modalità batch senza Tkinter. Gli errori di validazione vengono
+    segnalati con ValueError, gli altri errori vengono propagati.
+
+    Con una copia locale (local_cache) le ricerche vengono risolte sulla
+    postazione e, se il server non è raggiungibile, lo split viene accodato
+    (SplitQueued) e inviato più tardi da replay_pending().
+    """
+
+    def __init__(self, db_connection, print_outbox=None, on_labels_queued=None,
+                 batch_index=None, split_writer=None, pack_rules=None, local_cache=None,
+                 on_split_queued=None):
+        self.db_connection = db_connection
+        self.print_outbox = print_outbox
+        self.on_labels_queued = on_labels_queued
+        self.batch_index = batch_index or BatchIndex()
+        self.split_writer = split_writer or SplitWriter()
+        self.pack_rules = pack_rules or {}
+        self.local_cache = local_cache
+        self.on_split_queued = on_split_queued
+
+    def find_batch(self, batch_number):
+        """Cerca il batch number; restituisce None se non esiste"""
+        with timer('split.find_batch'):
+            if self.local_cache is not None:
+                data = self.local_cache.lookup(batch_number)
+                if data is not None:
+                    return data
+                if self.local_cache.online is False:
+                    raise Exception(f"Server non raggiungibile e batch {batch_number} "
+                                    f"non presente nella copia locale")
+            data = self.db_connection.run(
+                lambda connection: self.batch_index.lookup(connection, batch_number))
+            if self.local_cache is not None:
+                self.local_cache.add_rows([data])
+            return data
+
+    @staticmethod
+    def parse_quantities(values, decimals=QUANTITY_DECIMALS):
+        """Converte i valori inseriti in quantità Decimal con al massimo decimals decimali"""
+        return [parse_quantity(value, decimals, i) for i, value in enumerate(values)]
+
+    def decimals(self, data):
+        """Decimali dell'unità di misura dell'articolo della scatola (pack_rules.json)"""
+        return decimals_for(self.pack_rules, data.Code)
+
+    def validate_quantities(self, data, quantities):
+        """Verifica che le quantità siano coerenti con la scatola da dividere.
+
+        Il confronto con PackQty è esatto alla precisione dell'articolo.
+        Restituisce le quantità come Decimal con la scala dell'articolo,
+        da usare per la scrittura e le etichette.
+        """
+        return validate_split(data.PackQty, quantities, self.decimals(data))
+
+    def plan(self, data, box_size=None, boxes=None, max_boxes=None, unit=None):
+        """Calcola le quantità dello split dalla regola dell'articolo (pack_rules.json).
+
+        I parametri indicati sostituiscono quelli della regola. Restituisce
+        una lista di Decimal la cui somma è esattamente PackQty.
+        """
+        rule = rule_for(self.pack_rules, data.Code)
+        if boxes is not None and box_size is None:
+            # Numero di scatole esplicito: i pezzi per scatola della regola non valgono
+            rule.box_size = None
+        rule = rule.merged(box_size=box_size, boxes=boxes, max_boxes=max_boxes, unit=unit)
+        return plan_split(data.PackQty, rule)
+
+    def build_labels(self, data, quantities):
+        """Prepara le etichette da stampare: la prima per la scatola originale.
+
+        Il batch number delle figlie viene da split_writer, come le righe
+        scritte sul database: l'etichetta scansionata ritrova la sua riga.
+        """
+        labels = [{
+            'item_code': data.Code,
+            'quantity': format_quantity(quantities[0]),
+            'batch_number': data.BatchNumber_HU
+        }]
+        for i, qty in enumerate(quantities[1:], 1):
+            labels.append({
+                'item_code': data.Code,
+                'quantity': format_quantity(qty),
+                'batch_number': self.split_writer.child_batch_number(data.BatchNumber_HU, i)
+            })
+        return labels
+
+    @staticmethod
+    def new_split_key(data):
+        """Chiave univoca dello split usata dalla coda di stampa"""
+        return f"{data.incomingdetid}:{data.BatchNumber_HU}:{datetime.now():%Y%m%d%H%M%S%f}"
+
+    def _check_unchanged(self, connection, data, quantities, replay=False):
+        """Verifica che la scatola sul server abbia ancora la quantità letta nella ricerca.
+
+        La riga viene bloccata (UPDLOCK, ROWLOCK) fino al commit dello split:
+        i dati della ricerca possono venire dall'indice del documento o dalla
+        copia locale ed essere ormai superati. Restituisce False se si
+        tratta di un invio ripetuto di uno split già scritto (la scatola ha
+        già la prima quantità del piano).
+        """
+        decimals = self.decimals(data)
+        row = queries.fetchone(connection, CURRENT_PACK_QTY, data.PackingId)
+        current = to_quantity(row.PackQty, decimals) if row is not None else None
+        if current is not None and current == to_quantity(data.PackQty, decimals):
+            return True
+        if replay and current is not None and current == to_quantity(quantities[0], decimals):
+            return False
+        # La riga in copia locale non è più valida: "ripetere la ricerca" deve rileggerla dal server
+        if self.local_cache is not None:
+            self.local_cache.invalidate(data.PackingId)
+        raise ValueError(f"La scatola {data.BatchNumber_HU} è stata modificata da un'altra postazione: "
+                         f"ripetere la ricerca")
+
+    def save_split(self, data, quantities, user_id, replay=False):
+        """Scrive lo split in una transazione e invalida le righe in cache del documento.
+
+        Restituisce False se lo split risultava già scritto (solo con replay=True).
+        Se la connessione cade durante il commit l'esito è incerto: lo split
+        viene ripetuto come un invio ripetuto, che lo scrive solo se la
+        scatola sul server ha ancora la quantità di partenza.
+        """
+        def write(connection, replay):
+            if not self._check_unchanged(connection, data, quantities, replay):
+                return False
+            self.split_writer.save(connection, data, quantities, user_id)
+            return True
+
+        try:
+            attempts = self.db_connection.RECONNECT_RETRIES
+            uncertain = False
+            while True:
+                try:
+                    written = self.db_connection.run_in_transaction(
+                        lambda connection: write(connection, replay or uncertain))
+                    break
+                except Exception as e:
+                    if not self.db_connection.commit_uncertain(e) or not attempts:
+                        raise
+                    attempts -= 1
+                    uncertain = True
+                    print(f"Esito del commit incerto per {data.BatchNumber_HU}, verifica sul server...")
+        finally:
+            # Le righe del documento in cache non sono più affidabili
+            self.batch_index.invalidate_document(data.number)
+        if self.local_cache is not None:
+            self.local_cache.online = True
+            self.local_cache.apply_split(data, quantities, self.split_writer.child_batch_number)
+        return written
+
+    def save_splits(self, splits, user_id):
+        """Scrive più split (lista di (data, quantità)) in un'unica transazione"""
+        def write(connection):
+            for data, quantities in splits:
+                self._check_unchanged(connection, data, quantities)
+            self.split_writer.save_many(connection, splits, user_id)
+
+        try:
+            self.db_connection.run_in_transaction(write)
+        finally:
+            for data, _ in splits:
+                self.batch_index.invalidate_document(data.number)
+        if self.local_cache is not None:
+            for data, quantities in splits:
+                self.local_cache.apply_split(data, quantities, self.split_writer.child_batch_number)
+
+    def _queue_offline(self, split_key, data, quantities, user_id):
+        """Accoda lo split nella copia locale; le etichette restano sospese fino all'invio"""
+        from local_cache import SplitQueued
+        self.local_cache.queue_split(split_key, data, quantities, user_id)
+        self.local_cache.apply_split(data, quantities, self.split_writer.child_batch_number)
+        if self.on_split_queued:
+            self.on_split_queued()
+        raise SplitQueued(
+            f"Server non raggiungibile: lo split di {data.BatchNumber_HU} è stato salvato sulla "
+            f"postazione e verrà inviato al ripristino della connessione. Le etichette verranno "
+            f"stampate dopo l'invio.")
+
+    def replay_pending(self):
+        """Invia al server gli split accodati offline; restituisce (inviati, rifiutati).
+
+        Si ferma al primo errore di connessione. Uno split rifiutato dal server
+        (per esempio scatola modificata da un'altra postazione) viene scartato
+        insieme alle sue etichette e la copia locale viene ricaricata.
+        """
+        if self.local_cache is None:
+            return 0, 0
+        from db_connection import is_offline_error
+        replayed = rejected = 0
+        for write_id, split_key, data, quantities, user_id in self.local_cache.pending_writes():
+            try:
+                self.save_split(data, quantities, user_id, replay=True)
+            except Exception as e:
+                if is_offline_error(e):
+                    raise
+                print(f"Split di {data.BatchNumber_HU} rifiutato dal server: {str(e)}")
+                self.local_cache.mark_failed(write_id, str(e))
+                self.local_cache.discard_split(data, quantities, self.split_writer.child_batch_number)
+                self.local_cache.request_full_sync()
+                if self.print_outbox is not None:
+                    self.print_outbox.discard(split_key)
+                rejected += 1
+                continue
+
+            self.local_cache.mark_replayed(write_id)
+            if self.print_outbox is not None:
+                self.print_outbox.release(split_key)
+                if self.on_labels_queued:
+                    self.on_labels_queued()
+            replayed += 1
+        return replayed, rejected
+
+    @timed('split.group')
+    def split_many(self, splits, user_id, check_cancelled=None):
+        """Come split() per più scatole: una transazione e un unico lavoro di stampa.
+
+        Se il salvataggio fallisce nessuno split del gruppo viene scritto e
+        nessuna etichetta viene stampata.
+        """
+        splits = [(data, self.validate_quantities(data, quantities)) for data, quantities in splits]
+        labels = []
+        for data, quantities in splits:
+            labels += self.build_labels(data, quantities)
+        split_key = f"gruppo:{len(splits)}:{datetime.now():%Y%m%d%H%M%S%f}"
+
+        if self.print_outbox is not None:
+            self.print_outbox.enqueue(labels, split_key, hold=True)
+        try:
+            if check_cancelled:
+                check_cancelled()
+            self.save_splits(splits, user_id)
+        except Exception:
+            if self.print_outbox is not None:
+                self.print_outbox.discard(split_key)
+            raise
+
+        if self.print_outbox is not None:
+            self.print_outbox.release(split_key)
+            if self.on_labels_queued:
+                self.on_labels_queued()
+        return labels
+
+    @timed('split.total')
+    def split(self, data, quantities, user_id, check_cancelled=None):
+        """Valida, salva lo split e accoda le etichette; restituisce le etichette accodate.
+
+        Le etichette vengono scritte nella coda di stampa persistente ma
+        restano sospese finché lo split non è stato salvato: se il
+        salvataggio fallisce vengono scartate. Con la copia locale e il server
+        non raggiungibile lo split viene accodato e viene sollevato SplitQueued.
+        """
+        quantities = self.validate_quantities(data, quantities)
+        labels = self.build_labels(data, quantities)
+        split_key = self.new_split_key(data)
+
+        if self.print_outbox is not None:
+            self.print_outbox.enqueue(labels, split_key, hold=True)
+        if self.local_cache is not None and self.local_cache.online is False:
+            # Server già noto come non raggiungibile: niente attese di connessione
+            self._queue_offline(split_key, data, quantities, user_id)
+        try:
+            if check_cancelled:
+                check_cancelled()
+            self.save_split(data, quantities, user_id)
+        except Exception as e:
+            from db_connection import is_offline_error
+            if self.local_cache is not None and is_offline_error(e):
+                self.local_cache.online = False
+                self._queue_offline(split_key, data, quantities, user_id)
+            if self.print_outbox is not None:
+                self.print_outbox.discard(split_key)
+            raise
+
+        if self.print_outbox is not None:
+            self.print_outbox.release(split_key)
+            if self.on_labels_queued:
+                self.on_labels_queued()
+        return labels
@@ -0,0 +1,135 @@
+# split_session.py
+from batch_record import BatchColumns
+
+# Stati di una scatola nella lista di lavoro
+TO_PLAN = 'da pianificare'
+READY = 'pronta'
+DONE = 'divisa'
+FAILED = 'errore'
+
+
+class SessionEntry:
+    """Scatola scansionata nella sessione con il suo piano di split"""
+
+    def __init__(self, data):
+        self.data = data
+        self.quantities = None
+        self.status = TO_PLAN
+        self.error = None
+
+    @property
+    def batch_number(self):
+        return self.data.BatchNumber_HU
+
+
+class SplitSession:
+    """Lista di lavoro di più scatole da dividere e confermare insieme.
+
+    L'operatore scansiona i batch number, assegna un piano a ciascuno (a
+    mano o con il piano automatico) e conferma tutto: gli split vengono
+    scritti a gruppi di group_size, ognuno in una sola transazione, e le
+    etichette di ogni gruppo accodate come un unico lavoro di stampa.
+    """
+
+    def __init__(self, service, group_size=25):
+        self.service = service
+        self.group_size = group_size
+        self.entries = []
+        self._by_batch = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, batch_number):
+        """Cerca il batch e lo aggiunge alla lista; restituisce la voce creata"""
+        batch_number = batch_number.strip()
+        if batch_number in self._by_batch:
+            raise ValueError(f"Batch number '{batch_number}' già presente nella sessione")
+        data = self.service.find_batch(batch_number)
+        if data is None:
+            raise ValueError(f"Batch number '{batch_number}' non trovato nel database")
+        return self.add_data(data)
+
+    def add_data(self, data):
+        """Aggiunge una scatola già cercata (la ricerca può avvenire su un thread di lavoro)"""
+        if data.BatchNumber_HU in self._by_batch:
+            raise ValueError(f"Batch number '{data.BatchNumber_HU}' già presente nella sessione")
+        entry = SessionEntry(data)
+        self.entries.append(entry)
+        self._by_batch[entry.batch_number] = entry
+        return entry
+
+    def batches(self):
+        """Scatole della sessione in una raccolta per colonne (totali e ricerche senza scorrere le voci)"""
+        return BatchColumns(entry.data for entry in self.entries)
+
+    def get(self, batch_number):
+        return self._by_batch.get(batch_number)
+
+    def remove(self, batch_number):
+        entry = self._by_batch.pop(batch_number, None)
+        if entry is not None:
+            self.entries.remove(entry)
+
+    def assign(self, batch_number, quantities):
+        """Assegna le quantità di una scatola dopo averle validate"""
+        entry = self._by_batch[batch_number]
+        entry.quantities = self.service.validate_quantities(entry.data, quantities)
+        entry.status = READY
+        entry.error = None
+
+    def plan_all(self, replace=False, **rule):
+        """Applica il piano automatico alle scatole senza piano (o a tutte con replace=True).
+
+        Restituisce il numero di scatole pianificate; gli errori restano sulla voce.
+        """
+        planned = 0
+        for entry in self.entries:
+            if entry.status == DONE or (entry.quantities is not None and not replace):
+                continue
+            try:
+                entry.quantities = self.service.plan(entry.data, **rule)
+                entry.status = READY
+                entry.error = None
+                planned += 1
+            except ValueError as e:
+                entry.quantities = None
+                entry.status = TO_PLAN
+                entry.error = str(e)
+        return planned
+
+    def pending(self):
+        return [entry for entry in self.entries if entry.status in (READY, FAILED) and entry.quantities]
+
+    def commit(self, user_id, check_cancelled=None, on_progress=None):
+        """Scrive tutti gli split pronti a gruppi; restituisce (scatole divise, errori, etichette).
+
+        Un errore annulla solo il proprio gruppo: le sue scatole restano in
+        stato di errore e possono essere confermate di nuovo.
+        """
+        entries = self.pending()
+        done = failed = labels = 0
+        for start in range(0, len(entries), self.group_size):
+            if check_cancelled:
+                check_cancelled()
+            group = entries[start:start + self.group_size]
+            try:
+                labels += len(self.service.split_many(
+                    [(entry.data, entry.quantities) for entry in group], user_id))
+                for entry in group:
+                    entry.status = DONE
+                    entry.error = None
+                done += len(group)
+            except Exception as e:
+                for entry in group:
+                    entry.status = FAILED
+                    entry.error = str(e)
+                failed += len(group)
+            if on_progress:
+                on_progress(done + failed, len(entries))
+        return done, failed, labels
+
+    def clear_done(self):
+        """Rimuove dalla lista le scatole già divise"""
+        for entry in [entry for entry in self.entries if entry.status == DONE]:
+            self.remove(entry.batch_number)
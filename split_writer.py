@@ -0,0 +1,292 @@
+# split_writer.py
+import json
+
+from query_registry import queries
+from metrics import timer
+from quantities import db_param, format_quantity
+
+# Procedura di split lato server (sql/usp_SplitBox.sql) e versione richiesta dal client
+SPLIT_PROCEDURE = 'dbo.usp_SplitBox'
+SPLIT_PROCEDURE_VERSION = 1
+SPLIT_PROCEDURE_SCRIPT = 'sql/usp_SplitBox.sql'
+SPLIT_PROCEDURE_PARAMS = 10
+SPLIT_MODES = ('auto', 'sql', 'procedure')
+
+PROCEDURE_VERSION = queries.register('split_procedure_version', """
+    SELECT CAST(ep.value AS INT) AS Version
+    FROM sys.extended_properties ep
+    WHERE ep.major_id = OBJECT_ID(?, N'P') AND ep.minor_id = 0 AND ep.name = N'Version'
+""")
+# Sintassi ODBC CALL: il driver invia una chiamata RPC, senza testo SQL da compilare
+SPLIT_PROCEDURE_CALL = queries.register(
+    'split_procedure', f"{{CALL {SPLIT_PROCEDURE} ({', '.join(['?'] * SPLIT_PROCEDURE_PARAMS)})}}")
+
+
+class SplitWriter:
+    """Scrive uno split sul database con un numero costante di round trip.
+
+    Tutte le scatole figlie vengono inserite con un unico INSERT multi-riga
+    il cui OUTPUT finisce in una table variable; packing e SplitBoxes vengono
+    poi popolate con un INSERT ... SELECT dalla stessa table variable.
+    L'intero split viaggia verso il server in un solo batch T-SQL. Il
+    cursore della connessione viene riutilizzato: split con lo stesso
+    numero di scatole riusano anche l'istruzione già preparata.
+
+    Le righe di origine (incomingdet e Packing) vengono bloccate a livello
+    di riga, sempre in quest'ordine, e save_many le scrive in ordine di
+    incomingdetid: operatori concorrenti acquisiscono i lock nello stesso
+    ordine, riducendo i deadlock. Transazione e commit restano al chiamante.
+    """
+
+    # SQL Server accetta al massimo 2100 parametri per comando e 1000 righe
+    # per costrutto VALUES: ogni riga figlia usa 2 parametri.
+    MAX_ROWS_PER_BATCH = 900
+    MAX_PARAMS_PER_BATCH = 2000
+    # Parametri fissi di uno split: UPDATE della scatola originale + INSERT delle figlie
+    SPLIT_FIXED_PARAMS = 12
+
+    def __init__(self, batch_separator='-'):
+        self.batch_separator = batch_separator
+
+    def child_batch_number(self, parent_batch_number, index):
+        """Restituisce il batch number della scatola figlia n-esima"""
+        return f"{parent_batch_number}{self.batch_separator}{index}"
+
+    def save(self, connection, data, quantities, user_id):
+        """Esegue l'intero split sulla connessione indicata.
+
+        Non effettua il commit: la gestione della transazione resta al
+        chiamante. Restituisce il numero di scatole figlie create.
+        """
+        original_was = f"1 x {format_quantity(data.PackQty)}"
+        children = [
+            (self.child_batch_number(data.BatchNumber_HU, i), qty)
+            for i, qty in enumerate(quantities[1:], 1)
+        ]
+
+        cursor = queries.cursor(connection, 'split_batch')
+        try:
+            chunks = [children[i:i + self.MAX_ROWS_PER_BATCH]
+                      for i in range(0, len(children), self.MAX_ROWS_PER_BATCH)] or [[]]
+            for chunk_index, chunk in enumerate(chunks):
+                sql, params = self._build_batch(
+                    data, quantities[0], original_was, chunk, user_id,
+                    include_parent_update=(chunk_index == 0)
+                )
+                with timer('db.split_batch', rows=len(chunk)):
+                    cursor.execute(sql, params)
+            return len(children)
+        except Exception:
+            queries.discard(connection, 'split_batch')
+            raise
+
+    def save_many(self, connection, splits, user_id):
+        """Scrive più split (lista di (data, quantità)) con il minimo numero di batch T-SQL.
+
+        Gli split vengono accorpati nello stesso batch finché non si supera
+        il limite di parametri; ognuno usa una propria table variable.
+        Non effettua il commit. Restituisce il numero di batch inviati.
+        """
+        cursor = queries.cursor(connection, 'split_group')
+        try:
+            batches = 0
+            statements, params = [], []
+            for data, quantities in sorted(splits, key=lambda split: split[0].incomingdetid):
+                if len(quantities) - 1 > self.MAX_ROWS_PER_BATCH:
+                    # Split molto grande: viaggia da solo, suddiviso come in save(),
+                    # dopo gli split già accumulati per mantenere l'ordine per incomingdetid
+                    if statements:
+                        self._execute_many(cursor, statements, params)
+                        batches += 1
+                        statements, params = [], []
+                    self.save(connection, data, quantities, user_id)
+                    batches += 1
+                    continue
+
+                needed = self.SPLIT_FIXED_PARAMS + 2 * (len(quantities) - 1)
+                if statements and len(params) + needed > self.MAX_PARAMS_PER_BATCH:
+                    self._execute_many(cursor, statements, params)
+                    batches += 1
+                    statements, params = [], []
+
+                original_was = f"1 x {format_quantity(data.PackQty)}"
+                children = [(self.child_batch_number(data.BatchNumber_HU, i), qty)
+                            for i, qty in enumerate(quantities[1:], 1)]
+                sql, split_params = self._build_batch(
+                    data, quantities[0], original_was, children, user_id,
+                    include_parent_update=True, table_variable=f"@new{len(statements)}")
+                statements.append(sql)
+                params += split_params
+
+            if statements:
+                self._execute_many(cursor, statements, params)
+                batches += 1
+            return batches
+        except Exception:
+            queries.discard(connection, 'split_group')
+            raise
+
+    @staticmethod
+    def _execute_many(cursor, statements, params):
+        with timer('db.split_group_batch', splits=len(statements), params=len(params)):
+            cursor.execute("\n".join(statements), params)
+
+    def _build_batch(self, data, first_qty, original_was, children, user_id, include_parent_update,
+                     table_variable='@new'):
+        """Costruisce il batch T-SQL e la lista dei parametri"""
+        statements = ["SET NOCOUNT ON;"]
+        params = []
+
+        if include_parent_update:
+            statements.append("""
+                UPDATE dbo.incomingdet WITH (UPDLOCK, ROWLOCK)
+                SET Qty = ?, OriginalWas = ?
+                WHERE incomingdetid = ?;
+
+                UPDATE dbo.Packing WITH (UPDLOCK, ROWLOCK)
+                SET qty = ?, BatchNumber_HU = ?
+                WHERE packingid = ?;
+            """)
+            first_qty = db_param(first_qty)
+            params += [first_qty, original_was, data.incomingdetid,
+                       first_qty, data.BatchNumber_HU, data.PackingId]
+
+        if children:
+            values = ", ".join("(?, ?)" for _ in children)
+            statements.append(f"""
+                DECLARE {table_variable} TABLE (
+                    IncomingDetId BIGINT NOT NULL,
+                    BatchNumber NVARCHAR(255) NOT NULL,
+                    Qty DECIMAL(18, 4) NOT NULL
+                );
+
+                INSERT INTO dbo.incomingdet
+                (incomingid, itemid, batchnumber, Qty, OriginalWas)
+                OUTPUT INSERTED.IncomingDetId, INSERTED.batchnumber, INSERTED.Qty
+                INTO {table_variable} (IncomingDetId, BatchNumber, Qty)
+                SELECT ?, ?, v.BatchNumber, v.Qty, ?
+                FROM (VALUES {values}) AS v (BatchNumber, Qty);
+
+                INSERT INTO dbo.packing
+                (IncomingDetId, LocationId, Qty, Code, BatchNumber_HU, [CurrentDate], UserId)
+                SELECT n.IncomingDetId, ?, n.Qty, n.BatchNumber, n.BatchNumber, GetDate(), ?
+                FROM {table_variable} n;
+
+                INSERT INTO dbo.SplitBoxes
+                (UserId, IncomingDetid)
+                SELECT ?, n.IncomingDetId
+                FROM {table_variable} n;
+            """)
+            params += [data.incomingid, data.itemid, original_was]
+            for batch_number, qty in children:
+                params += [batch_number, db_param(qty)]
+            params += [data.locationid, user_id, user_id]
+
+        return "\n".join(statements), params
+
+
+class ProcedureSplitWriter(SplitWriter):
+    """Scrive lo split chiamando la procedura dbo.usp_SplitBox.
+
+    Il client invia solo gli identificativi e le quantità (array JSON):
+    aggiornamenti, scatole figlie e SplitBoxes vengono eseguiti sul server
+    con un piano già compilato. Se la procedura sparisce dopo l'avvio lo
+    split in corso fallisce e i successivi usano il batch di SplitWriter.
+    """
+
+    # Parametri di ogni chiamata: 10, quindi fino a 200 split per batch
+    CALL_PARAMS = SPLIT_PROCEDURE_PARAMS
+    EXEC_STATEMENT = (f"EXEC {SPLIT_PROCEDURE} @IncomingDetId = ?, @PackingId = ?, @IncomingId = ?, "
+                      "@ItemId = ?, @LocationId = ?, @BatchNumber = ?, @OriginalWas = ?, "
+                      "@UserId = ?, @Quantities = ?, @Separator = ?;")
+
+    def __init__(self, version=SPLIT_PROCEDURE_VERSION, batch_separator='-'):
+        super().__init__(batch_separator)
+        self.version = version
+        self.available = True
+
+    def call_params(self, data, quantities, user_id):
+        """Parametri della chiamata; le quantità in formato decimale senza esponente"""
+        return [data.incomingdetid, data.PackingId, data.incomingid, data.itemid, data.locationid,
+                data.BatchNumber_HU, f"1 x {format_quantity(data.PackQty)}", user_id,
+                json.dumps([format_quantity(qty) for qty in quantities]),
+                self.batch_separator]
+
+    def save(self, connection, data, quantities, user_id):
+        if not self.available:
+            return super().save(connection, data, quantities, user_id)
+        with timer('db.split_procedure', rows=len(quantities) - 1):
+            self._call(queries.execute, connection, SPLIT_PROCEDURE_CALL,
+                       self.call_params(data, quantities, user_id))
+        return len(quantities) - 1
+
+    def save_many(self, connection, splits, user_id):
+        if not self.available:
+            return super().save_many(connection, splits, user_id)
+        cursor = queries.cursor(connection, 'split_procedure_group')
+        try:
+            batches = 0
+            statements, params = [], []
+            for data, quantities in sorted(splits, key=lambda split: split[0].incomingdetid):
+                if statements and len(params) + self.CALL_PARAMS > self.MAX_PARAMS_PER_BATCH:
+                    self._execute_many(cursor, statements, params)
+                    batches += 1
+                    statements, params = [], []
+                statements.append(self.EXEC_STATEMENT)
+                params += self.call_params(data, quantities, user_id)
+            if statements:
+                self._execute_many(cursor, statements, params)
+                batches += 1
+            return batches
+        except Exception:
+            queries.discard(connection, 'split_procedure_group')
+            raise
+
+    def _execute_many(self, cursor, statements, params):
+        with timer('db.split_group_batch', splits=len(statements), params=len(params)):
+            self._call(cursor.execute, "SET NOCOUNT ON;\n" + "\n".join(statements), params)
+
+    def _call(self, execute, *args):
+        try:
+            return execute(*args)
+        except Exception as e:
+            # 2812: Could not find stored procedure
+            if "(2812)" in str(e):
+                print(f"Procedura {SPLIT_PROCEDURE} non trovata: uso il batch SQL del client")
+                self.available = False
+            raise
+
+
+def detect_split_procedure(connection):
+    """Versione della procedura di split installata sul server, o None se assente"""
+    row = queries.fetchone(connection, PROCEDURE_VERSION, SPLIT_PROCEDURE)
+    return int(row.Version) if row and row.Version is not None else None
+
+
+def create_split_writer(connection, mode='auto'):
+    """Sceglie come scrivere gli split.
+
+    'sql' usa sempre il batch del client, 'procedure' richiede la procedura
+    installata, 'auto' usa la procedura se presente in versione compatibile
+    e altrimenti il batch del client.
+    """
+    if mode not in SPLIT_MODES:
+        raise ValueError(f"Modalità di split non valida: {mode}")
+    if mode == 'sql':
+        return SplitWriter()
+
+    try:
+        version = detect_split_procedure(connection)
+    except Exception as e:
+        if mode == 'procedure':
+            raise
+        print(f"Verifica della procedura {SPLIT_PROCEDURE} non riuscita: {str(e)}")
+        version = None
+
+    if version is not None and version >= SPLIT_PROCEDURE_VERSION:
+        print(f"Split tramite procedura {SPLIT_PROCEDURE} (versione {version})")
+        return ProcedureSplitWriter(version)
+    if mode == 'procedure':
+        found = f"versione {version}" if version is not None else "non installata"
+        raise Exception(f"Procedura {SPLIT_PROCEDURE} {found}: eseguire {SPLIT_PROCEDURE_SCRIPT}")
+    return SplitWriter()
@@ -0,0 +1,19 @@
+-- local_cache_rowversion.sql
+-- Colonne rowversion per l'allineamento incrementale della copia locale.
+--
+-- Con SyncVersion su packing e incomingdet le postazioni scaricano solo le
+-- righe modificate dopo l'ultimo allineamento (LocalCache.sync). Senza
+-- queste colonne la copia locale scarica le righe nuove e ricarica a
+-- intervalli l'intera finestra dei documenti recenti.
+--
+-- Lo script può essere eseguito più volte: le colonne già presenti non
+-- vengono toccate. L'aggiunta di una colonna rowversion riscrive la
+-- tabella: eseguire fuori dall'orario di lavoro.
+
+IF COL_LENGTH('dbo.packing', 'SyncVersion') IS NULL
+    ALTER TABLE dbo.packing ADD SyncVersion rowversion;
+GO
+
+IF COL_LENGTH('dbo.incomingdet', 'SyncVersion') IS NULL
+    ALTER TABLE dbo.incomingdet ADD SyncVersion rowversion;
+GO
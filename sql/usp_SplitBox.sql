@@ -0,0 +1,96 @@
+-- usp_SplitBox.sql
+-- Procedura di split di una scatola lato server (versione 1).
+--
+-- Esegue in un solo round trip quello che SplitWriter invia come batch:
+-- aggiorna la scatola originale (incomingdet e Packing), crea le scatole
+-- figlie (incomingdet e packing) e registra le nuove righe in SplitBoxes.
+-- Le quantità arrivano come array JSON: la prima resta nella scatola
+-- originale, le altre diventano le scatole figlie <BatchNumber><Separator><n>.
+--
+-- Richiede SQL Server 2016 SP1 o successivo (CREATE OR ALTER, OPENJSON).
+-- Il client legge la versione dalla proprietà estesa 'Version': se la
+-- procedura manca, o ha una versione precedente, usa il batch di SplitWriter.
+-- Una nuova versione deve mantenere i parametri esistenti e aggiornare
+-- la proprietà in fondo al file.
+
+CREATE OR ALTER PROCEDURE dbo.usp_SplitBox
+    @IncomingDetId BIGINT,
+    @PackingId BIGINT,
+    @IncomingId BIGINT,
+    @ItemId BIGINT,
+    @LocationId BIGINT,
+    @BatchNumber NVARCHAR(255),
+    @OriginalWas NVARCHAR(255),
+    @UserId INT,
+    @Quantities NVARCHAR(MAX),
+    @Separator NVARCHAR(10) = N'-'
+AS
+BEGIN
+    SET NOCOUNT ON;
+    SET XACT_ABORT ON;
+
+    DECLARE @qty TABLE (
+        Position INT NOT NULL PRIMARY KEY,
+        Qty DECIMAL(18, 4) NOT NULL
+    );
+
+    INSERT INTO @qty (Position, Qty)
+    SELECT CAST(q.[key] AS INT), CAST(q.[value] AS DECIMAL(18, 4))
+    FROM OPENJSON(@Quantities) AS q;
+
+    IF (SELECT COUNT(*) FROM @qty) < 2
+        THROW 50001, N'Il numero di divisioni deve essere almeno 2', 1;
+
+    DECLARE @first DECIMAL(18, 4) = (SELECT Qty FROM @qty WHERE Position = 0);
+
+    DECLARE @new TABLE (
+        IncomingDetId BIGINT NOT NULL,
+        BatchNumber NVARCHAR(255) NOT NULL,
+        Qty DECIMAL(18, 4) NOT NULL
+    );
+
+    -- Se chiamata fuori da una transazione del client, la procedura resta atomica
+    BEGIN TRANSACTION;
+
+    -- Stesso ordine dei lock di SplitWriter: prima incomingdet, poi Packing
+    UPDATE dbo.incomingdet WITH (UPDLOCK, ROWLOCK)
+    SET Qty = @first, OriginalWas = @OriginalWas
+    WHERE incomingdetid = @IncomingDetId;
+
+    UPDATE dbo.Packing WITH (UPDLOCK, ROWLOCK)
+    SET qty = @first, BatchNumber_HU = @BatchNumber
+    WHERE packingid = @PackingId;
+
+    INSERT INTO dbo.incomingdet
+    (incomingid, itemid, batchnumber, Qty, OriginalWas)
+    OUTPUT INSERTED.IncomingDetId, INSERTED.batchnumber, INSERTED.Qty
+    INTO @new (IncomingDetId, BatchNumber, Qty)
+    SELECT @IncomingId, @ItemId, @BatchNumber + @Separator + CAST(q.Position AS NVARCHAR(10)), q.Qty, @OriginalWas
+    FROM @qty q
+    WHERE q.Position > 0
+    ORDER BY q.Position;
+
+    INSERT INTO dbo.packing
+    (IncomingDetId, LocationId, Qty, Code, BatchNumber_HU, [CurrentDate], UserId)
+    SELECT n.IncomingDetId, @LocationId, n.Qty, n.BatchNumber, n.BatchNumber, GetDate(), @UserId
+    FROM @new n;
+
+    INSERT INTO dbo.SplitBoxes
+    (UserId, IncomingDetid)
+    SELECT @UserId, n.IncomingDetId
+    FROM @new n;
+
+    COMMIT TRANSACTION;
+END;
+GO
+
+IF EXISTS (SELECT 1 FROM sys.extended_properties
+           WHERE major_id = OBJECT_ID(N'dbo.usp_SplitBox', N'P') AND minor_id = 0 AND name = N'Version')
+    EXEC sys.sp_updateextendedproperty @name = N'Version', @value = 1,
+        @level0type = N'SCHEMA', @level0name = N'dbo',
+        @level1type = N'PROCEDURE', @level1name = N'usp_SplitBox';
+ELSE
+    EXEC sys.sp_addextendedproperty @name = N'Version', @value = 1,
+        @level0type = N'SCHEMA', @level0name = N'dbo',
+        @level1type = N'PROCEDURE', @level1name = N'usp_SplitBox';
+GO
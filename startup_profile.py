@@ -0,0 +1,94 @@
+# startup_profile.py
+"""Profilo dei tempi di avvio (split_manager.py --profile-startup).
+
+Misura il tempo di import di ogni modulo, come python -X importtime, ma
+funziona anche nell'eseguibile creato con PyInstaller, e registra le
+fasi dell'avvio (import, finestra di login, servizi pronti). Usa solo
+moduli leggeri della libreria standard per non alterare le misure.
+"""
+import builtins
+import sys
+import threading
+import time
+
+# Istante di riferimento: il caricamento di questo modulo, che split_manager importa per primo
+STARTED_AT = time.perf_counter()
+
+
+class StartupProfiler:
+    def __init__(self):
+        self.enabled = False
+        self.imports = []  # (modulo, profondità, secondi inclusi, secondi propri, thread)
+        self.phases = []   # (fase, secondi dall'avvio)
+        self._original_import = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def install(self):
+        """Inizia a misurare gli import successivi"""
+        if self.enabled:
+            return
+        self.enabled = True
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self.enabled:
+            builtins.__import__ = self._original_import
+            self.enabled = False
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(0.0)  # tempo degli import annidati
+        started = time.perf_counter()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - started
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with self._lock:
+                self.imports.append((name, len(stack), elapsed, elapsed - nested,
+                                     threading.current_thread().name))
+
+    def mark(self, phase):
+        """Registra il completamento di una fase dell'avvio"""
+        if self.enabled:
+            with self._lock:
+                self.phases.append((phase, time.perf_counter() - STARTED_AT))
+
+    def report(self, top=25):
+        """Restituisce il profilo come testo: fasi e import più costosi"""
+        with self._lock:
+            phases = list(self.phases)
+            imports = list(self.imports)
+
+        lines = ["Fasi dell'avvio (ms dall'avvio):"]
+        for phase, offset in phases:
+            lines.append(f"  {offset * 1000:9.1f}  {phase}")
+
+        total = sum(elapsed for _, depth, elapsed, _, _ in imports if depth == 0)
+        lines.append(f"Import: {len(imports)} moduli, {total * 1000:.1f} ms totali")
+        lines.append(f"  {'inclusivo':>10} {'proprio':>9}  modulo [thread]")
+        for name, depth, elapsed, own, thread in sorted(imports, key=lambda r: r[2], reverse=True)[:top]:
+            lines.append(f"  {elapsed * 1000:10.1f} {own * 1000:9.1f}  {'  ' * depth}{name} [{thread}]")
+        return "\n".join(lines)
+
+    def write_report(self, path='startup_profile.txt'):
+        """Salva il profilo su file e lo stampa sulla console"""
+        text = self.report()
+        print(text)
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(text + "\n")
+        except OSError as e:
+            print(f"Impossibile salvare il profilo di avvio: {str(e)}")
+
+
+profiler = StartupProfiler()
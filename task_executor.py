@@ -0,0 +1,162 @@
+# task_executor.py
+import threading
+import time
+from queue import Queue, Empty
+
+from metrics import metrics
+
+
+class JobCancelled(Exception):
+    """Sollevata all'interno di un job quando ne viene richiesto l'annullamento"""
+
+
+class Job:
+    """Operazione in coda da eseguire su un thread di lavoro"""
+
+    def __init__(self, executor, func, args, kwargs, on_success, on_error, on_cancel, name):
+        self.executor = executor
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.on_success = on_success
+        self.on_error = on_error
+        self.on_cancel = on_cancel
+        self.name = name or getattr(func, '__name__', 'job')
+        self._cancel_event = threading.Event()
+        self.done = False
+        self.submitted_at = time.perf_counter()
+
+    def cancel(self):
+        """Richiede l'annullamento del job"""
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """Interrompe il job se è stato richiesto l'annullamento"""
+        if self.cancelled:
+            raise JobCancelled(self.name)
+
+    def wait(self, seconds):
+        """Attende senza bloccare l'annullamento; solleva JobCancelled se annullato"""
+        if self._cancel_event.wait(seconds):
+            raise JobCancelled(self.name)
+
+    def report_progress(self, message):
+        """Invia un messaggio di avanzamento al thread dell'interfaccia"""
+        self.executor._post(self.executor._progress, message)
+
+
+class TaskExecutor:
+    """Esegue le operazioni di I/O su thread di lavoro.
+
+    I job vengono accodati con submit() ed eseguiti in ordine FIFO. Le
+    callback di completamento e i messaggi di avanzamento vengono riportati
+    sul thread di Tkinter tramite una coda svuotata periodicamente con
+    root.after, perché Tk non è thread-safe.
+    """
+
+    def __init__(self, root, status_var=None, workers=1, poll_interval=50):
+        self.root = root
+        self.status_var = status_var
+        self.poll_interval = poll_interval
+        self._jobs = Queue()
+        self._callbacks = Queue()
+        self._active = set()
+        self._lock = threading.Lock()
+        self._running = True
+        self._threads = []
+
+        for i in range(workers):
+            thread = threading.Thread(target=self._worker, name=f"TaskExecutor-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+        self._poll_id = self.root.after(self.poll_interval, self._poll)
+
+    def submit(self, func, *args, on_success=None, on_error=None, on_cancel=None, name=None, **kwargs):
+        """Accoda func(job, *args, **kwargs) e restituisce il Job creato"""
+        job = Job(self, func, args, kwargs, on_success, on_error, on_cancel, name)
+        with self._lock:
+            self._active.add(job)
+        self._jobs.put(job)
+        return job
+
+    @property
+    def busy(self):
+        with self._lock:
+            return bool(self._active)
+
+    def call_soon(self, callback, *args):
+        """Esegue callback sul thread di Tk; utilizzabile da qualsiasi thread"""
+        self._post(callback, *args)
+
+    def cancel_all(self):
+        """Annulla tutti i job in coda o in esecuzione"""
+        with self._lock:
+            jobs = list(self._active)
+        for job in jobs:
+            job.cancel()
+
+    def shutdown(self, wait=False):
+        """Ferma i thread di lavoro"""
+        self.cancel_all()
+        self._running = False
+        for _ in self._threads:
+            self._jobs.put(None)
+        if wait:
+            for thread in self._threads:
+                thread.join()
+        try:
+            self.root.after_cancel(self._poll_id)
+        except Exception:
+            pass
+
+    def _worker(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            started = time.perf_counter()
+            metrics.record(f"job.{job.name}.queue", started - job.submitted_at)
+            try:
+                job.check_cancelled()
+                with metrics.timer(f"job.{job.name}"):
+                    result = job.func(job, *job.args, **job.kwargs)
+            except JobCancelled:
+                self._post(self._finish, job, job.on_cancel)
+            except Exception as e:
+                self._post(self._finish, job, job.on_error, e)
+            else:
+                self._post(self._finish, job, job.on_success, result)
+
+    def _post(self, callback, *args):
+        self._callbacks.put((callback, args))
+
+    def _finish(self, job, callback, *args):
+        job.done = True
+        with self._lock:
+            self._active.discard(job)
+        if callback:
+            callback(*args)
+        elif job.on_error is None and args and isinstance(args[0], Exception):
+            print(f"Errore non gestito nel job {job.name}: {str(args[0])}")
+
+    def _progress(self, message):
+        if self.status_var is not None:
+            self.status_var.set(message)
+
+    def _poll(self):
+        while True:
+            try:
+                callback, args = self._callbacks.get_nowait()
+            except Empty:
+                break
+            try:
+                callback(*args)
+            except Exception as e:
+                print(f"Errore nella callback: {str(e)}")
+        if self._running:
+            self._poll_id = self.root.after(self.poll_interval, self._poll)
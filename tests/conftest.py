@@ -0,0 +1,48 @@
+# conftest.py
+import argparse
+
+import pytest
+
+from metrics import metrics
+
+
+@pytest.fixture(autouse=True)
+def no_metrics_log():
+    """Le misure dei test non finiscono in metrics.log"""
+    log_file, metrics.log_file = metrics.log_file, None
+    metrics.reset()
+    yield
+    metrics.log_file = log_file
+
+
+@pytest.fixture
+def bench_env():
+    """Crea ambienti di benchmark (database e stampante simulati) chiusi a fine test"""
+    pytest.importorskip('pyodbc')
+    import benchmark_split
+
+    environments = []
+
+    def create(documents=4, boxes_per_document=25, **options):
+        args = argparse.Namespace(connect_latency=0.0, db_latency=0.0, print_time=0.0, seed=0,
+                                  pool_size=5, split_mode='sql')
+        env = benchmark_split.BenchEnvironment(args, documents=documents,
+                                               boxes_per_document=boxes_per_document, **options)
+        environments.append(env)
+        return env
+
+    yield create
+    for env in environments:
+        env.close()
+
+
+@pytest.fixture
+def fake_database():
+    """Database SQLite simulato (bench_fakes) con alcuni documenti, chiuso a fine test"""
+    pytest.importorskip('pyodbc')
+    from bench_fakes import FakeDatabase
+
+    database = FakeDatabase()
+    database.batch_numbers = database.seed(documents=3, boxes_per_document=5)
+    yield database
+    database.close()
@@ -0,0 +1,105 @@
+# test_batch_index.py
+"""Precaricamento, scadenza e invalidazione dell'indice dei batch"""
+from decimal import Decimal
+
+import pytest
+
+import batch_index
+from batch_index import BatchIndex
+from batch_record import BatchRecord
+
+
+def record(batch_number, number='DOC00000', packing_id=1):
+    return BatchRecord(1, packing_id, number, 1, 'ART-001', batch_number, '120', '120', 1, 'A01', packing_id)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Orologio manuale per le scadenze dell'indice"""
+    now = [1000.0]
+    monkeypatch.setattr(batch_index.time, 'time', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def connection(fake_database):
+    connection = fake_database.connect()
+    yield connection
+    connection.close()
+
+
+def test_lookup_prefetches_the_whole_document(fake_database, connection):
+    index = BatchIndex()
+    first, second, *_ = fake_database.batch_numbers
+
+    row = index.lookup(connection, first)
+    assert row.BatchNumber_HU == first
+    assert row.number == 'DOC00000'
+    assert row.PackQty == Decimal('120')
+    assert (index.hits, index.misses) == (0, 1)
+
+    # Le altre scatole dello stesso documento sono già nell'indice
+    assert index.get(second).BatchNumber_HU == second
+    assert index.get(fake_database.batch_numbers[5]) is None
+    assert (index.hits, index.misses) == (1, 2)
+
+
+def test_lookup_of_unknown_batch_returns_none(connection):
+    index = BatchIndex()
+    assert index.lookup(connection, 'HU-INESISTENTE') is None
+    assert index.get('HU-INESISTENTE') is None
+
+
+def test_entries_expire_after_ttl(clock):
+    index = BatchIndex(ttl=10)
+    index.add_rows([record('HU1')])
+
+    clock[0] += 10
+    assert index.get('HU1') is not None
+    clock[0] += 1
+    assert index.get('HU1') is None
+    assert index.get('HU1') is None, "la voce scaduta viene rimossa"
+    assert (index.hits, index.misses) == (1, 2)
+
+
+def test_least_recently_used_entries_are_evicted():
+    index = BatchIndex(max_entries=2)
+    index.add_rows([record('HU1'), record('HU2')])
+    assert index.get('HU1') is not None
+
+    index.add_rows([record('HU3')])
+    assert index.get('HU2') is None
+    assert index.get('HU1') is not None and index.get('HU3') is not None
+
+
+def test_duplicate_batch_keeps_first_row():
+    index = BatchIndex()
+    index.add_rows([record('HU1', packing_id=1), record('HU1', packing_id=2)])
+    assert index.get('HU1').PackingId == 1
+
+
+def test_invalidate_document_removes_only_its_rows():
+    index = BatchIndex()
+    index.add_rows([record('HU1', 'DOC1'), record('HU2', 'DOC1'), record('HU3', 'DOC2')])
+
+    index.invalidate_document('DOC1')
+    assert index.get('HU1') is None and index.get('HU2') is None
+    assert index.get('HU3') is not None
+
+    index.clear()
+    assert index.get('HU3') is None
+
+
+def test_split_invalidates_the_document(bench_env):
+    from benchmark_split import BENCH_USER_ID
+
+    env = bench_env(documents=2, boxes_per_document=3)
+    service = env.service()
+    first, second = env.batch_numbers[:2]
+
+    data = service.find_batch(first)
+    assert env.batch_index.get(second) is not None
+
+    service.save_split(data, [Decimal(1000), Decimal(200)], BENCH_USER_ID)
+    assert env.batch_index.get(second) is None
+    assert env.batch_index.get(env.batch_numbers[3]) is None  # altro documento mai cercato
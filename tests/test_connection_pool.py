@@ -0,0 +1,114 @@
+# test_connection_pool.py
+"""Prestito, verifica ed eliminazione delle connessioni del ConnectionPool"""
+import threading
+import time
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+from db_connection import ConnectionPool, DatabaseConnection
+
+
+def make_pool(database, **options):
+    options.setdefault('acquire_timeout', 2)
+    return ConnectionPool(database.connect, **options)
+
+
+def test_released_connection_is_reused(fake_database):
+    pool = make_pool(fake_database)
+    first = pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first
+    assert fake_database.connections_opened == 1
+
+
+def test_acquire_waits_for_a_free_connection(fake_database):
+    pool = make_pool(fake_database, max_size=1)
+    connection = pool.acquire()
+    threading.Timer(0.1, pool.release, args=(connection,)).start()
+
+    started = time.time()
+    assert pool.acquire() is connection
+    assert time.time() - started >= 0.05
+    assert pool.size == 1
+
+
+def test_acquire_times_out_when_pool_is_full(fake_database):
+    pool = make_pool(fake_database, max_size=1, acquire_timeout=0.1)
+    pool.acquire()
+    with pytest.raises(Exception, match="Nessuna connessione disponibile"):
+        pool.acquire()
+
+
+def test_validate_replaces_dropped_session(fake_database):
+    pool = make_pool(fake_database)
+    connection = pool.acquire()
+    pool.release(connection)
+    fake_database.kill_connections()
+
+    # Usata da poco: senza validate viene riconsegnata senza verifica
+    assert pool.acquire() is connection
+    pool.release(connection)
+
+    replacement = pool.acquire(validate=True)
+    assert replacement is not connection
+    assert connection.closed
+    assert fake_database.connections_opened == 2
+    assert pool.size == 1
+
+
+def test_idle_connection_is_checked_after_validate_after(fake_database):
+    pool = make_pool(fake_database, validate_after=0)
+    connection = pool.acquire()
+    pool.release(connection)
+    fake_database.kill_connections()
+
+    assert pool.acquire() is not connection
+    assert connection.closed
+
+
+def test_idle_connections_above_min_size_are_evicted(fake_database):
+    pool = make_pool(fake_database, min_size=1, idle_timeout=0.01)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    time.sleep(0.05)
+
+    pool.acquire()
+    # Una delle due viene chiusa, l'altra resta per min_size
+    assert pool.size == 1
+    assert first.closed != second.closed
+
+
+def test_release_rolls_back_open_transaction(fake_database):
+    pool = make_pool(fake_database)
+    connection = pool.acquire()
+    connection.autocommit = False
+    connection.execute("UPDATE dbo.packing SET Qty = 0")
+    pool.release(connection)
+
+    assert connection.autocommit
+    assert fake_database.query("SELECT COUNT(*) FROM packing WHERE Qty = 0")[0][0] == 0
+
+
+def test_failed_open_frees_the_reserved_slot(fake_database):
+    fake_database.set_offline()
+    pool = make_pool(fake_database, max_size=1)
+    with pytest.raises(Exception):
+        pool.acquire()
+    assert pool.size == 0
+
+    fake_database.set_offline(False)
+    assert pool.acquire() is not None
+
+
+def test_run_retries_on_validated_connection(fake_database):
+    pool = make_pool(fake_database)
+    database = DatabaseConnection(None, pool=pool)
+    pool.release(pool.acquire())
+    fake_database.kill_connections()
+
+    count = database.run(lambda connection: connection.execute("SELECT COUNT(*) FROM dbo.packing").fetchone()[0])
+    assert count == len(fake_database.batch_numbers)
+    assert fake_database.connections_opened == 2
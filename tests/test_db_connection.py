@@ -0,0 +1,110 @@
+# test_db_connection.py
+"""Transazioni di DatabaseConnection su connessioni simulate"""
+import threading
+
+import pytest
+
+pyodbc = pytest.importorskip('pyodbc')
+
+from db_connection import DatabaseConnection, failed_during_commit
+
+
+def connection_lost():
+    return pyodbc.OperationalError('08S01', "[08S01] Communication link failure")
+
+
+class FakeConnection:
+    def __init__(self, on_commit=None):
+        self.autocommit = True
+        self.on_commit = on_commit
+        self.commits = 0
+        self.rollbacks = 0
+
+    def execute(self, sql, *params):
+        return self
+
+    def commit(self):
+        if self.on_commit:
+            self.on_commit()
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+
+class FakePool:
+    def __init__(self, connections):
+        self.connections = list(connections)
+        self.released = []
+        self._lock = threading.Lock()
+
+    def acquire(self, validate=False):
+        with self._lock:
+            return self.connections.pop(0)
+
+    def release(self, connection, discard=False):
+        with self._lock:
+            self.released.append((connection, discard))
+
+    @staticmethod
+    def ping(connection):
+        return True
+
+
+def test_commit_phase_is_kept_per_transaction():
+    """La caduta durante il commit di un thread resta incerta anche se un altro thread apre una transazione"""
+    committing = threading.Event()
+    resume = threading.Event()
+
+    def lose_during_commit():
+        committing.set()
+        resume.wait(5)
+        raise connection_lost()
+
+    pool = FakePool([FakeConnection(on_commit=lose_during_commit), FakeConnection(), FakeConnection()])
+    database = DatabaseConnection(None, pool=pool)
+    calls = []
+    errors = []
+
+    def first():
+        try:
+            database.run_in_transaction(lambda connection: calls.append('first'), backoff=0)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    assert committing.wait(5)
+
+    # Seconda transazione sulla stessa istanza mentre la prima è nel COMMIT
+    assert database.run_in_transaction(lambda connection: 'second') == 'second'
+    with pytest.raises(pyodbc.Error) as second_error:
+        with database.transaction():
+            raise connection_lost()
+    assert not failed_during_commit(second_error.value)
+
+    resume.set()
+    thread.join(5)
+
+    assert calls == ['first'], "lo split con commit incerto non va ripetuto come una nuova scrittura"
+    assert len(errors) == 1
+    assert failed_during_commit(errors[0])
+    assert database.commit_uncertain(errors[0])
+    assert not database.commit_uncertain(second_error.value)
+
+
+def test_connection_lost_before_commit_is_retried():
+    pool = FakePool([FakeConnection(), FakeConnection()])
+    database = DatabaseConnection(None, pool=pool)
+    attempts = []
+
+    def operation(connection):
+        attempts.append(connection)
+        if len(attempts) == 1:
+            raise connection_lost()
+        return 'ok'
+
+    assert database.run_in_transaction(operation, backoff=0) == 'ok'
+    assert len(attempts) == 2
+    assert attempts[0].rollbacks == 1 and attempts[1].commits == 1
+    assert all(connection.autocommit for connection in attempts)
@@ -0,0 +1,125 @@
+# test_local_cache.py
+"""Copia locale: allineamento dal server, split accodati offline e invio al ripristino"""
+import os
+import sqlite3
+from decimal import Decimal
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+import benchmark_split as bench
+from local_cache import LocalCache, SplitQueued, PENDING, DONE, FAILED
+from print_outbox import HELD
+
+
+@pytest.fixture
+def offline_env(bench_env):
+    """Ambiente di benchmark con un SplitService che usa la copia locale già allineata"""
+    env = bench_env(documents=2, boxes_per_document=5)
+    env.cache = LocalCache(os.path.join(env.work_dir, 'local_cache.db'))
+    env.split_service = env.service()
+    env.split_service.local_cache = env.cache
+    env.split_service.db_connection.run(env.cache.sync)
+    yield env
+    env.cache.close()
+
+
+def test_full_sync_then_delta_sync(offline_env):
+    env = offline_env
+    row = env.cache.lookup(env.batch_numbers[0])
+    assert row.BatchNumber_HU == env.batch_numbers[0]
+    assert Decimal(row.PackQty) == 1200
+
+    db = sqlite3.connect(env.database.path)
+    db.execute("""
+        INSERT INTO packing (IncomingDetId, LocationId, Qty, Code, BatchNumber_HU)
+        SELECT IncomingDetId, LocationId, 7, Code, 'HU-NUOVA' FROM packing WHERE BatchNumber_HU = ?
+    """, (env.batch_numbers[0],))
+    db.commit()
+    db.close()
+
+    # Allineamento incrementale: arriva solo la riga nuova
+    assert env.split_service.db_connection.run(env.cache.sync) == 1
+    assert Decimal(env.cache.lookup('HU-NUOVA').PackQty) == 7
+
+
+def test_offline_split_is_queued_and_replayed_once(offline_env):
+    env = offline_env
+    service = env.split_service
+    batch_number = env.batch_numbers[0]
+    env.database.set_offline()
+
+    data = service.find_batch(batch_number)
+    with pytest.raises(SplitQueued):
+        service.split(data, [Decimal(1000), Decimal(200)], bench.BENCH_USER_ID)
+
+    assert env.cache.count_writes(PENDING) == 1
+    assert env.outbox.count(HELD) == 2
+    # La copia locale riporta già lo split: la figlia ha un PackingId provvisorio negativo
+    assert Decimal(env.cache.lookup(batch_number).PackQty) == 1000
+    assert env.cache.lookup(f"{batch_number}-1").PackingId < 0
+
+    env.database.set_offline(False)
+    assert service.replay_pending() == (1, 0)
+    assert service.replay_pending() == (0, 0)
+    assert env.cache.count_writes(DONE) == 1
+    assert env.fake_printer.wait_for(2, 5)
+    assert env.database.count('SplitBoxes') == 1
+    assert env.database.query("SELECT Qty FROM packing WHERE BatchNumber_HU = ?", batch_number)[0][0] == 1000
+
+
+def test_replay_of_already_written_split_is_not_duplicated(offline_env):
+    env = offline_env
+    service = env.split_service
+    data = service.find_batch(env.batch_numbers[1])
+    env.cache.queue_split('split-1', data, [Decimal(600), Decimal(600)], bench.BENCH_USER_ID)
+
+    # Lo split era arrivato al server prima della caduta della connessione
+    service.save_split(data, [Decimal(600), Decimal(600)], bench.BENCH_USER_ID)
+    assert service.replay_pending() == (1, 0)
+    assert env.database.count('SplitBoxes') == 1
+
+
+def test_replay_rejected_when_box_changed_on_server(offline_env):
+    env = offline_env
+    service = env.split_service
+    batch_number = env.batch_numbers[2]
+    env.database.set_offline()
+    data = service.find_batch(batch_number)
+    with pytest.raises(SplitQueued):
+        service.split(data, [Decimal(600), Decimal(600)], bench.BENCH_USER_ID)
+    env.database.set_offline(False)
+
+    db = sqlite3.connect(env.database.path)
+    db.execute("UPDATE packing SET Qty = 900 WHERE BatchNumber_HU = ?", (batch_number,))
+    db.commit()
+    db.close()
+
+    assert service.replay_pending() == (0, 1)
+    assert env.cache.count_writes(FAILED) == 1
+    # Etichette e scatole figlie create offline vengono scartate
+    assert env.outbox.count(HELD) == 0
+    assert env.cache.lookup(f"{batch_number}-1") is None
+    assert env.database.count('SplitBoxes') == 0
+
+
+def test_old_schema_is_rebuilt_keeping_pending_writes(tmp_path):
+    path = str(tmp_path / 'local_cache.db')
+    db = sqlite3.connect(path)
+    db.executescript("""
+        CREATE TABLE batches (PackingId INTEGER PRIMARY KEY, BatchNumber_HU TEXT, PackQty REAL);
+        INSERT INTO batches VALUES (1, 'HU1', 0.1);
+        CREATE TABLE pending_writes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, split_key TEXT NOT NULL UNIQUE, payload TEXT NOT NULL,
+            status TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, created_at REAL NOT NULL);
+        INSERT INTO pending_writes (split_key, payload, status, created_at) VALUES ('k', '{}', 'pending', 0);
+    """)
+    db.close()
+
+    cache = LocalCache(path)
+    try:
+        assert cache.lookup('HU1') is None
+        assert cache.count_writes(PENDING) == 1
+    finally:
+        cache.close()
@@ -0,0 +1,73 @@
+# test_login_cache.py
+"""Verificatori locali delle credenziali: scadenza, password errate e file su disco"""
+import json
+import time
+
+import pytest
+
+from login_cache import CredentialCache, User
+
+
+@pytest.fixture
+def cache(tmp_path):
+    # Poche iterazioni PBKDF2: il test verifica la logica, non il costo
+    return CredentialCache(str(tmp_path / 'login_cache.json'), ttl=60, iterations=1000)
+
+
+def test_verify_after_store(cache):
+    cache.store(User(7, 'Mario Rossi', 'mrossi'), 'segreta')
+    user = cache.verify('mrossi', 'segreta')
+    assert (user.UserId, user.Name, user.Username) == (7, 'Mario Rossi', 'mrossi')
+
+
+def test_username_ignores_case_and_spaces(cache):
+    cache.store(User(7, 'Mario Rossi', 'MRossi'), 'segreta')
+    assert cache.verify(' mrossi ', 'segreta') is not None
+
+
+def test_wrong_password_or_unknown_user_is_not_verified(cache):
+    cache.store(User(7, 'Mario Rossi', 'mrossi'), 'segreta')
+    assert cache.verify('mrossi', 'Segreta') is None
+    assert cache.verify('altro', 'segreta') is None
+    # Una password errata non elimina la voce: il login torna al server
+    assert cache.verify('mrossi', 'segreta') is not None
+
+
+def test_expired_entry_is_removed(cache, monkeypatch):
+    cache.store(User(7, 'Mario Rossi', 'mrossi'), 'segreta')
+    now = time.time()
+    monkeypatch.setattr('login_cache.time.time', lambda: now + 61)
+
+    assert cache.verify('mrossi', 'segreta') is None
+    with open(cache.path, encoding='utf-8') as f:
+        assert json.load(f) == {}
+
+
+def test_password_is_not_written_to_disk(cache):
+    cache.store(User(7, 'Mario Rossi', 'mrossi'), 'segreta-123')
+    with open(cache.path, encoding='utf-8') as f:
+        text = f.read()
+    assert 'segreta-123' not in text
+    entry = json.loads(text)['mrossi']
+    assert set(entry) == {'user_id', 'name', 'salt', 'iterations', 'verifier', 'expires'}
+
+
+def test_same_password_gets_different_salt(cache):
+    cache.store(User(1, 'Uno', 'uno'), 'uguale')
+    cache.store(User(2, 'Due', 'due'), 'uguale')
+    with open(cache.path, encoding='utf-8') as f:
+        entries = json.load(f)
+    assert entries['uno']['salt'] != entries['due']['salt']
+    assert entries['uno']['verifier'] != entries['due']['verifier']
+
+
+def test_forget_and_corrupt_file(cache):
+    cache.store(User(7, 'Mario Rossi', 'mrossi'), 'segreta')
+    cache.forget('MROSSI')
+    assert cache.verify('mrossi', 'segreta') is None
+
+    with open(cache.path, 'w', encoding='utf-8') as f:
+        f.write('{non json')
+    assert cache.verify('mrossi', 'segreta') is None
+    cache.store(User(7, 'Mario Rossi', 'mrossi'), 'segreta')
+    assert cache.verify('mrossi', 'segreta') is not None
@@ -0,0 +1,125 @@
+# test_print_outbox.py
+"""Stati delle etichette nella coda di stampa persistente"""
+import pytest
+
+from print_outbox import PrintOutbox, OutboxDrainer, HELD, PENDING, SENDING, DONE, UNCERTAIN
+
+
+def make_labels(count, prefix='HU1'):
+    return [{'item_code': 'ART-001', 'quantity': '12', 'batch_number': f"{prefix}-{i}"} for i in range(count)]
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = PrintOutbox(str(tmp_path / 'outbox.db'))
+    yield outbox
+    outbox.close()
+
+
+def counts(outbox):
+    return {status: outbox.count(status) for status in (HELD, PENDING, SENDING, DONE, UNCERTAIN)}
+
+
+class FakePrinter:
+    """Stampante che accetta le prime `accepted` etichette e interrompe il blocco successivo"""
+
+    def __init__(self, accepted=None, block_size=3):
+        self.accepted = accepted
+        self.block_size = block_size
+        self.printed = []
+
+    def print_labels(self, labels, on_label_sent=None, on_label_uncertain=None):
+        sent = 0
+        while sent < len(labels):
+            block = range(sent, min(sent + self.block_size, len(labels)))
+            if self.accepted is not None and sent + len(block) > self.accepted:
+                for index in block:
+                    on_label_uncertain(index)
+                return sent
+            for index in block:
+                self.printed.append(labels[index]['batch_number'])
+                on_label_sent(index)
+                sent += 1
+        return sent
+
+
+def test_enqueue_is_idempotent_and_held_until_release(outbox):
+    outbox.enqueue(make_labels(3), 'split-1', hold=True)
+    outbox.enqueue(make_labels(3), 'split-1', hold=True)
+    assert counts(outbox)[HELD] == 3
+    assert outbox.next_batch() == []
+
+    outbox.release('split-1')
+    assert [label['batch_number'] for label in outbox.next_batch()] == ['HU1-0', 'HU1-1', 'HU1-2']
+
+
+def test_recover_list_and_requeue(tmp_path):
+    path = str(tmp_path / 'outbox.db')
+    outbox = PrintOutbox(path)
+    outbox.enqueue(make_labels(4), 'split-1')
+    ids = [label['id'] for label in outbox.next_batch()]
+    outbox.mark_sending(ids[:2])
+    outbox.mark_done(ids[0])
+    outbox.close()
+
+    # Riavvio dopo un crash durante l'invio
+    outbox = PrintOutbox(path)
+    assert outbox.recover() == 1
+    uncertain = outbox.list_uncertain()
+    assert [label['batch_number'] for label in uncertain] == ['HU1-1']
+    assert uncertain[0]['id'] == ids[1]
+    assert [label['id'] for label in outbox.next_batch()] == ids[2:]
+
+    outbox.requeue([ids[1]])
+    assert outbox.list_uncertain() == []
+    assert [label['id'] for label in outbox.next_batch()] == ids[1:]
+    assert counts(outbox) == {HELD: 0, PENDING: 3, SENDING: 0, DONE: 1, UNCERTAIN: 0}
+    outbox.close()
+
+
+def test_dismiss_marks_uncertain_labels_printed(outbox):
+    outbox.enqueue(make_labels(2), 'split-1')
+    ids = [label['id'] for label in outbox.next_batch()]
+    outbox.mark_sending(ids)
+    outbox.recover()
+
+    outbox.dismiss([ids[0]])
+    # Solo le etichette incerte cambiano stato
+    outbox.requeue([ids[0]])
+    assert counts(outbox) == {HELD: 0, PENDING: 0, SENDING: 0, DONE: 1, UNCERTAIN: 1}
+    assert [label['id'] for label in outbox.list_uncertain()] == [ids[1]]
+
+
+def test_drainer_prints_whole_batch(outbox):
+    outbox.enqueue(make_labels(5), 'split-1')
+    printer = FakePrinter()
+    drainer = OutboxDrainer(outbox, lambda: printer)
+
+    assert drainer._drain_once()
+    assert printer.printed == [f"HU1-{i}" for i in range(5)]
+    assert counts(outbox)[DONE] == 5
+
+
+def test_drainer_moves_interrupted_block_to_uncertain(outbox):
+    outbox.enqueue(make_labels(7), 'split-1')
+    printer = FakePrinter(accepted=3, block_size=3)
+    statuses = []
+    drainer = OutboxDrainer(outbox, lambda: printer, on_status=lambda message, pending: statuses.append(message))
+
+    assert not drainer._drain_once()
+    assert counts(outbox) == {HELD: 0, PENDING: 1, SENDING: 0, DONE: 3, UNCERTAIN: 3}
+    assert [label['batch_number'] for label in outbox.list_uncertain()] == ['HU1-3', 'HU1-4', 'HU1-5']
+    assert "da verificare" in statuses[-1]
+
+    # Il blocco interrotto non viene reinviato in automatico
+    printer.accepted = None
+    assert drainer._drain_once()
+    assert printer.printed == ['HU1-0', 'HU1-1', 'HU1-2', 'HU1-6']
+
+
+def test_drainer_requeues_labels_when_printer_unreachable(outbox):
+    outbox.enqueue(make_labels(2), 'split-1')
+    drainer = OutboxDrainer(outbox, lambda: None)
+
+    assert not drainer._drain_once()
+    assert counts(outbox)[PENDING] == 2
@@ -0,0 +1,145 @@
+# test_printer_pool.py
+"""Distribuzione delle etichette e passaggio ad altre stampanti nel PrinterPool"""
+import threading
+
+from printer_pool import (PrinterPool, PoolMember, ROUND_ROBIN, create_printer, printer_entries,
+                          status_monitors)
+from printer_status import PrinterStatus
+
+
+def make_labels(count):
+    return [{'item_code': 'ART-001', 'quantity': '12', 'batch_number': f"HU1-{i}"} for i in range(count)]
+
+
+class FakePrinter:
+    """Stampante del pool: accetta `accepts` etichette, poi interrompe l'invio (o il blocco in corso)"""
+
+    def __init__(self, name, accepts=None, interrupt_block=False):
+        self.ip_address = name
+        self.port = 9100
+        self.accepts = accepts
+        self.interrupt_block = interrupt_block
+        self.printed = []
+        self.connected = True
+        self.reachable = True
+        self.status = None
+        self.status_monitor = None
+        self._lock = threading.Lock()
+
+    def print_labels(self, labels, on_label_sent=None, on_label_uncertain=None):
+        for index, label in enumerate(labels):
+            with self._lock:
+                if self.accepts is not None and len(self.printed) >= self.accepts:
+                    if self.interrupt_block:
+                        for pending in range(index, len(labels)):
+                            on_label_uncertain(pending)
+                    self.connected = False
+                    return index
+                self.printed.append(label['batch_number'])
+            on_label_sent(index)
+        return len(labels)
+
+    def is_connected(self):
+        return self.connected
+
+    def connect(self):
+        self.connected = self.reachable
+        return self.connected
+
+    def query_status(self):
+        return self.status
+
+    def disconnect(self):
+        self.connected = False
+
+
+def make_pool(*printers, strategy=ROUND_ROBIN):
+    return PrinterPool([PoolMember(printer.ip_address, printer) for printer in printers], strategy=strategy)
+
+
+def test_labels_are_spread_over_healthy_printers():
+    first, second = FakePrinter('A'), FakePrinter('B')
+    pool = make_pool(first, second)
+    acked = []
+
+    assert pool.print_labels(make_labels(40), on_label_sent=acked.append) == 40
+    assert sorted(acked) == list(range(40))
+    assert len(first.printed) == len(second.printed) == 20
+
+
+def test_labels_of_failed_printer_move_to_the_others():
+    broken, spare = FakePrinter('A', accepts=3), FakePrinter('B')
+    pool = make_pool(broken, spare)
+    acked = []
+
+    assert pool.print_labels(make_labels(40), on_label_sent=acked.append) == 40
+    # Ogni etichetta è stampata una sola volta
+    assert sorted(acked) == list(range(40))
+    assert sorted(broken.printed + spare.printed) == sorted(f"HU1-{i}" for i in range(40))
+    assert len(broken.printed) == 3
+    assert not pool.members[0].healthy and pool.members[1].healthy
+    assert pool.status_summary() == "1/2 stampanti disponibili"
+
+
+def test_interrupted_block_is_not_reassigned():
+    broken, spare = FakePrinter('A', accepts=3, interrupt_block=True), FakePrinter('B')
+    pool = make_pool(broken, spare)
+    acked, uncertain = [], []
+
+    printed = pool.print_labels(make_labels(20), on_label_sent=acked.append, on_label_uncertain=uncertain.append)
+    assert printed == 13
+    assert sorted(uncertain) == list(range(3, 10))
+    assert sorted(acked + uncertain) == list(range(20))
+    assert not set(spare.printed) & {f"HU1-{i}" for i in uncertain}
+
+
+def test_no_healthy_printer_stops_with_labels_unconfirmed():
+    pool = make_pool(FakePrinter('A', accepts=0), FakePrinter('B', accepts=5))
+    acked = []
+
+    assert pool.print_labels(make_labels(30), on_label_sent=acked.append) == 5
+    assert not any(member.healthy for member in pool.members)
+
+
+def test_health_check_brings_printer_back():
+    printer = FakePrinter('A', accepts=0)
+    pool = make_pool(printer)
+    pool.print_labels(make_labels(1))
+    member = pool.members[0]
+    assert not member.healthy
+
+    printer.reachable = False
+    pool._check_member(member)
+    assert not member.healthy and member.last_error == "non raggiungibile"
+
+    printer.reachable = True
+    printer.status = PrinterStatus(paper_out=True)
+    pool._check_member(member)
+    assert not member.healthy
+
+    printer.status = PrinterStatus()
+    pool._check_member(member)
+    assert member.healthy and member.last_error is None
+
+
+def test_least_queued_prefers_idle_printer():
+    busy, idle = FakePrinter('A'), FakePrinter('B')
+    pool = make_pool(busy, idle, strategy='least_queued')
+    pool.members[0].queued = 100
+
+    pool.print_labels(make_labels(10))
+    assert idle.printed and not busy.printed
+
+
+def test_printer_entries_accepts_single_and_list_config():
+    assert printer_entries({'ip_address': '10.0.0.1', 'port': 6101, 'status_port': 9200}) == [
+        {'printer_name': '', 'ip_address': '10.0.0.1', 'port': 6101, 'status_port': 9200}]
+    assert printer_entries({'printers': [{'ip_address': '10.0.0.1'}, {'printer_name': 'vuota'}]}) == [
+        {'ip_address': '10.0.0.1'}]
+    assert printer_entries({}) == []
+
+
+def test_status_monitor_needs_explicit_status_port():
+    printer = create_printer({'ip_address': '127.0.0.1', 'port': 9100})
+    assert printer.status_monitor is None
+    assert status_monitors(printer) == []
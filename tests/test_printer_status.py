@@ -0,0 +1,154 @@
+# test_printer_status.py
+"""Interpretazione delle risposte di stato della stampante (~HS, ~HQES) e monitor di stato"""
+import time
+
+import pytest
+
+from printer_status import PrinterStatus, PrinterStatusMonitor, parse_extended_status
+
+
+def host_status(paper_out=0, paused=0, formats=0, buffer_full=0, head_open=0, ribbon_out=0, labels_remaining=0):
+    """Risposta a ~HS nel formato Zebra: tre stringhe STX...ETX separate da CR LF"""
+    return (f"\x02030,{paper_out},{paused},1245,{formats:03d},{buffer_full},0,0,000,0,0,0\x03\r\n"
+            f"\x02000,0,{head_open},{ribbon_out},0,2,4,0,{labels_remaining:08d},1,000\x03\r\n"
+            f"\x021234,0\x03\r\n").encode('ascii')
+
+
+def test_parse_ready_printer():
+    status = PrinterStatus.parse(host_status(formats=3, labels_remaining=12))
+    assert status.ready and not status.fault
+    assert status.formats_in_buffer == 3
+    assert status.labels_remaining == 12
+    assert status.describe() == "pronta (3 etichette in attesa)"
+
+
+@pytest.mark.parametrize('flags, description', [
+    ({'paper_out': 1}, "carta esaurita"),
+    ({'paused': 1}, "in pausa"),
+    ({'head_open': 1}, "testina aperta"),
+    ({'ribbon_out': 1}, "nastro esaurito"),
+    ({'paper_out': 1, 'head_open': 1}, "carta esaurita, testina aperta"),
+])
+def test_parse_faults(flags, description):
+    status = PrinterStatus.parse(host_status(**flags))
+    assert status.fault and not status.ready
+    assert status.describe() == description
+
+
+def test_full_buffer_is_not_a_fault():
+    status = PrinterStatus.parse(host_status(formats=10, buffer_full=1))
+    assert not status.fault
+    assert not status.ready
+    assert status.describe() == "buffer pieno"
+
+
+def test_parse_response_split_across_reads():
+    """La risposta può arrivare in più recv: conta solo il testo completo"""
+    raw = host_status(paper_out=1)
+    chunks = [raw[:7], raw[7:40], raw[40:]]
+    assert PrinterStatus.parse(b''.join(chunks)).paper_out
+
+
+@pytest.mark.parametrize('raw', [
+    b'',
+    b'\x02030,0,0\x03',
+    b'\x02030,0,0,1245,000,0,0,0,000,0,0,0\x03\r\n\x02000,0\x03\r\n',
+])
+def test_parse_rejects_invalid_response(raw):
+    with pytest.raises(ValueError):
+        PrinterStatus.parse(raw)
+
+
+def extended_status(errors=0, warnings=0):
+    """Risposta a ~HQES con le maschere di bit del secondo gruppo"""
+    return (f"\x02\r\n PRINTER STATUS\r\n"
+            f"   ERRORS:         {int(bool(errors))} 00000000 {errors:08X}\r\n"
+            f"   WARNINGS:       {int(bool(warnings))} 00000000 {warnings:08X}\r\n\x03\r\n").encode('ascii')
+
+
+def test_parse_extended_status_flags():
+    errors, warnings = parse_extended_status(extended_status(errors=0x1 | 0x4, warnings=0x8))
+    assert errors == ["carta esaurita", "testina aperta"]
+    assert warnings == ["carta in esaurimento"]
+
+
+def test_parse_extended_status_without_problems():
+    assert parse_extended_status(extended_status()) == ([], [])
+
+
+def test_parse_extended_status_rejects_other_replies():
+    with pytest.raises(ValueError):
+        parse_extended_status(host_status())
+
+
+def test_extended_errors_make_status_a_fault():
+    status = PrinterStatus.parse(host_status())
+    status.errors, status.warnings = parse_extended_status(extended_status(errors=0x10, warnings=0x2))
+    assert status.fault
+    assert status.describe() == "testina surriscaldata - attenzione: pulire la testina"
+
+
+@pytest.fixture
+def fake_printer():
+    pytest.importorskip('pyodbc')
+    from bench_fakes import FakePrinter
+
+    printer = FakePrinter().start()
+    yield printer
+    printer.stop()
+
+
+def start_monitor(port, **options):
+    options.setdefault('interval', 0.02)
+    options.setdefault('timeout', 0.2)
+    return PrinterStatusMonitor('127.0.0.1', port=port, **options).start()
+
+
+def test_monitor_publishes_fault_and_recovery(fake_printer):
+    monitor = start_monitor(fake_printer.port)
+    changes = []
+    monitor.subscribe(lambda m: changes.append(m.ready))
+    try:
+        assert monitor.wait_for_update(0, 2) is not None
+        assert monitor.ready
+
+        fake_printer.set_fault('paper_out')
+        monitor.poll_now()
+        status = monitor.wait_for_update(monitor.updated_at, 2)
+        assert status.paper_out and "carta esaurita" in status.errors
+        assert not monitor.ready
+
+        fake_printer.set_fault(None)
+        monitor.poll_now()
+        assert monitor.wait_for_update(monitor.updated_at, 2).ready
+        assert changes == [True, False, True]
+    finally:
+        monitor.stop(timeout=2)
+
+
+def test_monitor_gives_up_only_when_printer_never_answered(fake_printer):
+    fake_printer.status_supported = False
+    monitor = start_monitor(fake_printer.port, timeout=0.05)
+    monitor.MAX_BACKOFF = 0.05
+    try:
+        monitor._thread.join(5)
+        assert not monitor._thread.is_alive()
+        assert not monitor.supported
+        assert not monitor.answered
+        # Senza stato la stampa non viene bloccata: si usa il controllo di flusso TCP
+        assert monitor.ready
+    finally:
+        monitor.stop(timeout=2)
+
+
+def test_monitor_reports_unreachable_printer():
+    monitor = start_monitor(1)
+    try:
+        deadline = time.time() + 2
+        while monitor.error is None and time.time() < deadline:
+            time.sleep(0.01)
+        assert monitor.error is not None
+        assert monitor.describe().startswith("non raggiungibile")
+        assert monitor.supported
+    finally:
+        monitor.stop(timeout=2)
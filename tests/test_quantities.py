@@ -0,0 +1,132 @@
+# test_quantities.py
+"""Proprietà del modulo quantities e di QuantityModel su split casuali (seed fisso)"""
+import random
+from decimal import Decimal
+
+import pytest
+
+from quantities import (MAX_DECIMALS, db_param, format_quantity, parse_quantity, sum_quantities,
+                        to_quantity, validate_split)
+from quantity_grid import QuantityModel
+
+SEEDS = range(40)
+
+
+def random_split(rng, decimals, max_parts=3000):
+    """Totale e quantità con decimals decimali la cui somma è esattamente il totale"""
+    scale = Decimal(1).scaleb(-decimals)
+    units = [rng.randint(1, 10 ** (decimals + 3)) for _ in range(rng.randint(2, max_parts))]
+    return sum(units) * scale, [value * scale for value in units]
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_validate_split_accepts_exact_splits_in_any_input_form(seed):
+    rng = random.Random(seed)
+    decimals = rng.randint(0, MAX_DECIMALS)
+    total, quantities = random_split(rng, decimals)
+    # Testo con la virgola, float del driver e Decimal danno lo stesso risultato
+    mixed = [format_quantity(qty).replace('.', ',') if i % 3 == 0 else float(qty) if i % 3 == 1 else qty
+             for i, qty in enumerate(quantities)]
+
+    validated = validate_split(total, mixed, decimals)
+
+    assert validated == quantities
+    assert sum_quantities(validated, decimals) == total
+    assert all(qty.as_tuple().exponent == -decimals for qty in validated)
+    assert all(db_param(qty) is qty for qty in validated)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_validate_split_rejects_one_unit_difference(seed):
+    rng = random.Random(seed)
+    decimals = rng.randint(0, MAX_DECIMALS)
+    total, quantities = random_split(rng, decimals)
+    index = rng.randrange(len(quantities))
+    quantities[index] += Decimal(rng.choice((1, -1))).scaleb(-decimals)
+
+    with pytest.raises(ValueError):
+        validate_split(total, quantities, decimals)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_validate_split_rejects_decimals_beyond_precision(seed):
+    rng = random.Random(seed)
+    decimals = rng.randint(0, MAX_DECIMALS - 1)
+    total, quantities = random_split(rng, decimals)
+    # La somma resta giusta ma due scatole hanno un decimale in più
+    half = Decimal(5).scaleb(-decimals - 1)
+    quantities[0] += half
+    quantities[-1] -= half
+
+    with pytest.raises(ValueError):
+        validate_split(total, quantities, decimals)
+
+
+def test_float_sum_error_does_not_reject_split():
+    # In float 0.1 sommato 12000 volte non dà 1200
+    quantities = [0.1] * 12000
+    assert sum(quantities) != 1200.0
+    assert sum(validate_split(1200.0, quantities, 1)) == Decimal(1200)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_format_quantity_round_trip(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        decimals = rng.randint(0, MAX_DECIMALS)
+        qty = Decimal(rng.randint(0, 10 ** 9)).scaleb(-decimals)
+        text = format_quantity(qty)
+
+        assert 'E' not in text and ',' not in text
+        assert not ('.' in text and text.endswith('0'))
+        assert to_quantity(text, decimals) == qty
+        assert format_quantity(float(text)) == text
+
+
+def test_parse_quantity_messages():
+    assert parse_quantity(' 12,5 ', 1) == Decimal('12.5')
+    with pytest.raises(ValueError, match="al massimo 2 decimali"):
+        parse_quantity('1.234', 2, 0)
+    with pytest.raises(ValueError, match="Quantità 3 non valida"):
+        parse_quantity('abc', 2, 2)
+    with pytest.raises(ValueError, match="Inserire la quantità 1"):
+        parse_quantity('', 2, 0)
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_quantity_model_total_matches_rows(seed):
+    rng = random.Random(seed)
+    decimals = rng.randint(0, MAX_DECIMALS)
+    model = QuantityModel(rng.randint(2, 50), max_size=1000, decimals=decimals)
+    for _ in range(500):
+        operation = rng.random()
+        index = rng.randrange(len(model))
+        if operation < 0.6:
+            text = format_quantity(Decimal(rng.randint(0, 10 ** 6)).scaleb(-decimals))
+            model.set_text(index, rng.choice((text, text.replace('.', ','), '', 'x')))
+        elif operation < 0.8:
+            values = [Decimal(rng.randint(1, 10 ** 6)).scaleb(-decimals) for _ in range(rng.randint(1, 20))]
+            model.paste(values, start=index)
+        elif operation < 0.95:
+            model.resize(rng.randint(2, 200))
+        else:
+            model.load([Decimal(rng.randint(1, 10 ** 6)).scaleb(-decimals) for _ in range(rng.randint(2, 200))])
+
+        rows = [model.get(i) for i in range(len(model))]
+        filled = [qty for qty in rows if qty is not None]
+        assert model.total == sum(filled, Decimal(0))
+        assert model.filled == len(filled)
+
+    for index in range(len(model)):
+        if model.get(index) is None:
+            model.set_text(index, '1')
+    assert sum(model.quantities()) == model.total
+
+
+def test_quantity_model_rejects_excess_decimals():
+    model = QuantityModel(2, decimals=2)
+    assert not model.set_text(0, '1.005')
+    assert model.set_text(1, '2.5')
+    assert model.total == Decimal('2.50')
+    with pytest.raises(ValueError, match="al massimo 2 decimali"):
+        model.quantities()
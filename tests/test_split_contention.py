@@ -0,0 +1,93 @@
+# test_split_contention.py
+"""Split concorrenti sullo stesso database con deadlock simulati (bench_fakes)"""
+import sqlite3
+
+import pytest
+
+pytest.importorskip('pyodbc')
+
+import benchmark_split as bench
+from db_connection import DatabaseConnection
+
+
+def test_concurrent_splits_keep_documents_consistent(bench_env, monkeypatch):
+    # Il deadlock simulato colpisce ogni istruzione (verifica con UPDLOCK e batch dello split):
+    # con più tentativi nessuno split esaurisce i retry per caso e il test resta deterministico
+    monkeypatch.setattr(DatabaseConnection, 'DEADLOCK_RETRIES', 8)
+    env = bench_env(deadlock_rate=0.1)
+    result = bench.scenario_contention(env, iterations=100, workers=4)
+    row = result.as_dict()
+
+    assert env.database.deadlocks > 0, "nessun deadlock simulato: il test non verifica i nuovi tentativi"
+    assert row['errors'] == 0
+    assert row['unbalanced_documents'] == 0
+    assert row['lost_children'] == 0
+    assert row['duplicate_children'] == 0
+    assert row['split_boxes'] == row['split_boxes_expected'] == 100 * 2
+    assert not result.failed
+
+
+def split_some(env, count, ways=3):
+    service = env.service()
+    completed = []
+    for batch_number in env.batch_numbers[:count]:
+        data = service.find_batch(batch_number)
+        service.split(data, bench.even_quantities(int(data.PackQty), ways), bench.BENCH_USER_ID)
+        completed.append(batch_number)
+    return completed
+
+
+def test_consistency_check_detects_lost_child(bench_env):
+    env = bench_env()
+    completed = split_some(env, 3)
+    assert bench.split_consistency(env, completed, 3) == {
+        'unbalanced_documents': 0, 'lost_children': 0, 'duplicate_children': 0}
+
+    child = f"{completed[1]}-2"
+    db = sqlite3.connect(env.database.path)
+    db.execute("DELETE FROM packing WHERE BatchNumber_HU = ?", (child,))
+    db.execute("DELETE FROM incomingdet WHERE batchnumber = ?", (child,))
+    db.commit()
+    db.close()
+
+    checks = bench.split_consistency(env, completed, 3)
+    assert checks['lost_children'] == 1
+    assert checks['unbalanced_documents'] == 1
+
+
+def test_consistency_check_detects_duplicate_child(bench_env):
+    env = bench_env()
+    completed = split_some(env, 2)
+    child = f"{completed[0]}-1"
+    db = sqlite3.connect(env.database.path)
+    db.execute("""
+        INSERT INTO packing (IncomingDetId, LocationId, Qty, Code, BatchNumber_HU)
+        SELECT IncomingDetId, LocationId, Qty, Code, BatchNumber_HU FROM packing WHERE BatchNumber_HU = ?
+    """, (child,))
+    db.commit()
+    db.close()
+
+    assert bench.split_consistency(env, completed, 3)['duplicate_children'] >= 1
+
+
+def test_split_against_stale_pack_qty_is_refused(bench_env):
+    """Senza copia locale la riga letta dall'indice può essere superata: lo split va rifiutato"""
+    env = bench_env()
+    service = env.service()
+    assert service.local_cache is None
+    batch_number = env.batch_numbers[0]
+    data = service.find_batch(batch_number)
+
+    db = sqlite3.connect(env.database.path)
+    db.execute("UPDATE packing SET Qty = Qty - 1 WHERE BatchNumber_HU = ?", (batch_number,))
+    db.commit()
+    db.close()
+
+    with pytest.raises(ValueError, match="modificata da un'altra postazione"):
+        service.split(data, bench.even_quantities(int(data.PackQty), 2), bench.BENCH_USER_ID)
+
+    db = sqlite3.connect(env.database.path)
+    children = db.execute("SELECT COUNT(*) FROM packing WHERE BatchNumber_HU LIKE ?",
+                          (f"{batch_number}-%",)).fetchone()[0]
+    db.close()
+    assert children == 0
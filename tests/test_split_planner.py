@@ -0,0 +1,90 @@
+# test_split_planner.py
+"""Piani di split automatici e regole di confezionamento per articolo"""
+import json
+from decimal import Decimal
+
+import pytest
+
+from split_planner import (PackRule, load_pack_rules, plan_by_box_count, plan_by_box_size, plan_split,
+                           rule_for, to_decimal)
+
+D = Decimal
+
+
+def test_to_decimal_accepts_comma_and_float():
+    assert to_decimal('12,5') == D('12.5')
+    assert to_decimal(0.1) == D('0.1')
+    with pytest.raises(ValueError, match="pezzi per scatola"):
+        to_decimal('abc', "pezzi per scatola")
+
+
+def test_plan_by_box_size_keeps_remainder_in_last_box():
+    assert plan_by_box_size(D('1200'), 500) == [D(500), D(500), D(200)]
+    assert plan_by_box_size('10,5', '2,5') == [D('2.5')] * 4 + [D('0.5')]
+    assert plan_by_box_size(1200, 400) == [D(400)] * 3
+
+
+def test_plan_by_box_size_respects_max_boxes():
+    with pytest.raises(ValueError, match=r"servono 3 scatole \(massimo 2\)"):
+        plan_by_box_size(1200, 500, max_boxes=2)
+
+
+def test_plan_by_box_count_spreads_units():
+    assert plan_by_box_count(D(10), 3) == [D(4), D(3), D(3)]
+    quantities = plan_by_box_count(D(100), 3, unit=D(12))
+    assert sum(quantities) == D(100)
+    # La parte non multipla dell'unità resta nella scatola originale
+    assert quantities == [D(36 + 4), D(36), D(24)]
+
+
+def test_plan_by_box_count_needs_enough_units():
+    with pytest.raises(ValueError, match="non basta per 4 scatole"):
+        plan_by_box_count(D(30), 4, unit=D(10))
+
+
+@pytest.mark.parametrize('total', ['1200', '999.999', '7.5', '12345.678'])
+@pytest.mark.parametrize('rule', [PackRule(box_size='2.5'), PackRule(boxes=7),
+                                  PackRule(max_boxes=3, unit='0.001')])
+def test_plan_split_sums_to_total(total, rule):
+    quantities = plan_split(D(total), rule)
+    assert sum(quantities) == D(total)
+    assert len(quantities) >= 2
+    assert all(quantity > 0 for quantity in quantities)
+
+
+def test_plan_split_refuses_single_box_and_missing_rule():
+    with pytest.raises(ValueError, match="nessuno split necessario"):
+        plan_split(D(100), PackRule(box_size=100))
+    with pytest.raises(ValueError, match="Indicare"):
+        plan_split(D(100), PackRule())
+
+
+def test_pack_rule_validation_and_merge():
+    with pytest.raises(ValueError):
+        PackRule(box_size=0)
+    with pytest.raises(ValueError):
+        PackRule(boxes=1)
+    with pytest.raises(ValueError):
+        PackRule(unit='0')
+
+    rule = PackRule(box_size=12, max_boxes=100).merged(box_size='', boxes=None, unit='0,5')
+    assert (rule.box_size, rule.boxes, rule.max_boxes, rule.unit) == (D(12), None, 100, D('0.5'))
+
+
+def test_rules_per_item_override_default(tmp_path):
+    path = tmp_path / 'pack_rules.json'
+    path.write_text(json.dumps({'default': {'unit': 2, 'max_boxes': 10},
+                                'items': {'ART-001': {'box_size': 12}}}), encoding='utf-8')
+    rules = load_pack_rules(str(path))
+
+    item = rule_for(rules, 'ART-001')
+    assert (item.box_size, item.max_boxes, item.unit) == (D(12), 10, D(2))
+    other = rule_for(rules, 'ART-999')
+    assert (other.box_size, other.max_boxes, other.unit) == (None, 10, D(2))
+
+
+def test_missing_rules_file_gives_empty_rule(tmp_path):
+    rules = load_pack_rules(str(tmp_path / 'assente.json'))
+    assert rules == {}
+    rule = rule_for(rules, 'ART-001')
+    assert (rule.box_size, rule.boxes, rule.max_boxes, rule.unit) == (None, None, None, D(1))
@@ -0,0 +1,44 @@
+# test_zpl_templates.py
+"""Layout salvato sulla stampante (^DF/^XF) a confronto con l'etichetta completa"""
+import re
+
+import pytest
+
+from PrinterConnection import PrinterConnection
+from zpl_templates import LabelTemplate, field_values, load_template
+
+
+def render(template, item_code, quantity, batch_number):
+    """Etichetta come la compone la stampante: ogni ^FNn del layout prende il valore inviato da recall()"""
+    sent = dict(re.findall(r'\^FN(\d+)\^FD(.*?)\^FS', template.recall(item_code, quantity, batch_number)))
+    return re.sub(r'\^FN(\d+)', lambda match: f"^FD{sent[match.group(1)]}", template.body)
+
+
+def zpl_lines(zpl):
+    return [line for line in zpl.split() if line not in ('^XA', '^XZ', '^CI28')]
+
+
+@pytest.mark.parametrize('label', [
+    ('ART-001', '12', 'HU000010001'),
+    ('ART/7 X', '0.5', 'HU000010001-12'),
+])
+def test_split_box_prints_same_label_as_full_zpl(label):
+    template = load_template('split_box')
+    assert zpl_lines(render(template, *label)) == zpl_lines(PrinterConnection.build_label_zpl(*label))
+
+
+def test_recall_sends_only_fields_used_by_layout():
+    template = LabelTemplate('SMALL', "^XA^FO50,50^A0N,35,35^FN7^FS^FO50,100^BCN,80,Y,N,N,A^FN3^FS^XZ")
+    assert template.recall('ART-001', '12', 'HU1-2') == \
+        "^XA^CI28^XFR:SMALL.ZPL^FS^FN3^FDHU1-2^FS^FN7^FDLotto: HU1-2^FS^XZ\n"
+
+
+def test_field_values_keep_caption_and_value_together():
+    assert field_values('ART-001', '12', 'HU1') == [
+        'ART-001', '12', 'HU1', 'Prodotto: ART-001', 'Codice: ART-001', 'Quantità: 12', 'Lotto: HU1']
+
+
+def test_load_template_rejects_unknown_fields(tmp_path):
+    (tmp_path / 'bad.zpl').write_text("^XA^FO50,50^A0N,35,35^FN8^FS^XZ", encoding='utf-8')
+    with pytest.raises(ValueError, match=r"\^FN1\.\.\^FN7"):
+        load_template('bad', templates_dir=str(tmp_path))
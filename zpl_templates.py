@@ -0,0 +1,61 @@
+# zpl_templates.py
+import os
+import re
+
+TEMPLATES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'label_templates')
+
+# Campi variabili dei layout: ^FN1 codice articolo, ^FN2 quantità, ^FN3 lotto (valori dei
+# codici a barre) e le righe di testo con didascalia e valore in un unico campo, come
+# nell'etichetta completa (PrinterConnection.build_label_zpl)
+LABEL_FIELDS = ('item_code', 'quantity', 'batch_number')
+CAPTION_FIELDS = ("Prodotto: {item_code}", "Codice: {item_code}", "Quantità: {quantity}",
+                  "Lotto: {batch_number}")
+FIELD_COUNT = len(LABEL_FIELDS) + len(CAPTION_FIELDS)
+
+
+def field_values(item_code, quantity, batch_number):
+    """Valori dei campi ^FN1..^FN7 di un'etichetta"""
+    values = {'item_code': item_code, 'quantity': quantity, 'batch_number': batch_number}
+    return [values[name] for name in LABEL_FIELDS] + [caption.format(**values) for caption in CAPTION_FIELDS]
+
+
+class LabelTemplate:
+    """Formato ZPL memorizzato sulla stampante (^DF) e richiamato con ^XF.
+
+    Il layout viene inviato una volta per connessione; per ogni etichetta
+    si trasmettono solo i valori dei campi ^FN usati dal layout.
+    """
+
+    def __init__(self, name, body, device='R'):
+        self.name = name
+        self.body = body
+        self.path = f"{device}:{name.upper()}.ZPL"
+        self.fields = sorted({int(n) for n in re.findall(r'\^FN(\d+)', body)})
+
+    def definition(self):
+        """Comando ZPL che salva il formato sulla stampante"""
+        body = self.body.strip()
+        if body.startswith('^XA'):
+            body = body[3:]
+        return f"^XA^DF{self.path}^FS{body}\n"
+
+    def recall(self, item_code, quantity, batch_number):
+        """Comando ZPL che stampa un'etichetta richiamando il formato salvato"""
+        values = field_values(item_code, quantity, batch_number)
+        fields = "".join(f"^FN{i}^FD{values[i - 1]}^FS" for i in self.fields)
+        return f"^XA^CI28^XF{self.path}^FS{fields}^XZ\n"
+
+
+def load_template(name, templates_dir=TEMPLATES_DIR):
+    """Carica un layout da label_templates/<name>.zpl"""
+    path = os.path.join(templates_dir, f"{name}.zpl")
+    with open(path, 'r', encoding='utf-8') as f:
+        body = f.read()
+
+    used_fields = {int(n) for n in re.findall(r'\^FN(\d+)', body)}
+    if not used_fields or min(used_fields) < 1 or max(used_fields) > FIELD_COUNT:
+        raise ValueError(f"Il layout {name} deve usare i campi ^FN1..^FN{FIELD_COUNT}")
+
+    # Il nome sulla stampante è limitato a 8 caratteri alfanumerici
+    device_name = re.sub(r'[^A-Za-z0-9]', '', name)[:8] or 'LABEL'
+    return LabelTemplate(device_name, body)